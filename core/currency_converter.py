@@ -1,65 +1,97 @@
-from datetime import date
+from datetime import date, datetime
 
+import numpy as np
 import pandas as pd
 
 from shared.enums.trade_enums import Currency
 
 
 class CurrencyConverter:
+    """
+    Converts currency amounts into divines using a (currency x day) matrix of divines per currency. Rates between the
+    conversion dates are interpolated linearly, and dates outside of them use the closest date's rate.
+    """
     _instance = None
     _initialized = None
 
-    def __new__(cls, conversions_df: pd.DataFrame):
+    def __new__(cls, conversions_df: pd.DataFrame = None):
         if cls._instance is None:
             cls._instance = super(CurrencyConverter, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self, conversions_df: pd.DataFrame):
-
+    def __init__(self, conversions_df: pd.DataFrame = None):
+        """
+        :param conversions_df: Columns date, currency and div_per_currency. Defaults to the CurrencyConversionsFile
+        """
         if self._initialized:
             return
         self._initialized = True
 
-        self.conversions_dict = self._create_conversions_dict(conversions_df)
+        if conversions_df is None:
+            from file_management.file_managers import CurrencyConversionsFile
+            conversions_df = CurrencyConversionsFile().load()
+
+        self._currencies, self._first_day, self._rates = self._create_rate_matrix(conversions_df)
 
-        self._conversion_cache = {}
+        # {currency value: matrix row}
+        self._currency_rows = {currency: row for row, currency in enumerate(self._currencies)}
 
     @staticmethod
-    def _create_conversions_dict(conversions_df: pd.DataFrame) -> dict:
-        df = conversions_df
-        df['date'] = pd.to_datetime(df['date'])
+    def _create_rate_matrix(conversions_df: pd.DataFrame) -> tuple[pd.Index, np.datetime64, np.ndarray]:
+        """
+        :return: (currency of each row, day of the first column, divines per currency of shape (currencies, days))
+        """
+        df = conversions_df.copy()
+        df['date'] = pd.to_datetime(df['date']).dt.normalize()
 
         # Create a full date range covering all currencies
         full_date_range = pd.date_range(df['date'].min(), df['date'].max(), freq='D')
 
-        # Group by currency and interpolate each group
-        conversion_dict = {}
-        for currency, group in df.groupby('currency'):
-            group = group.set_index('date').sort_index()
-            group = group.reindex(full_date_range)
-            group['div_per_currency'] = group['div_per_currency'].interpolate(method='linear')
-            group.index.name = 'date'
-            # Convert to dictionary with datetime.date keys
-            conversion_dict[currency] = {
-                date.date(): rate for date, rate in group['div_per_currency'].items()
-            }
+        rates = (
+            df.pivot_table(index='date', columns='currency', values='div_per_currency', aggfunc='mean')
+            .reindex(full_date_range)
+            .interpolate(method='linear', limit_direction='both')
+        )
+
+        # Divines convert to themselves on every day
+        rates[Currency.DIVINE_ORB.value] = 1.0
+
+        first_day = np.datetime64(full_date_range[0].date(), 'D')
+        return pd.Index(rates.columns), first_day, rates.to_numpy(dtype=np.float64).T
 
-        return conversion_dict
+    def _day_columns(self, days: np.ndarray) -> np.ndarray:
+        day_offsets = (days - self._first_day).astype(np.int64)
+        return np.clip(day_offsets, 0, self._rates.shape[1] - 1)
 
     def convert_to_divs(self, currency: Currency, currency_amount: int | float, relevant_date: date):
         if currency == Currency.DIVINE_ORB:
             return currency_amount
 
-        simple_date = (relevant_date.year, relevant_date.month, relevant_date.day)
-        convert_key = (currency, currency_amount, simple_date)
-        if convert_key in self._conversion_cache:
-            return self._conversion_cache[convert_key]
+        if isinstance(relevant_date, datetime):
+            relevant_date = relevant_date.date()
+
+        day_column = self._day_columns(np.array([relevant_date], dtype='datetime64[D]'))[0]
+        exchange_rate = self._rates[self._currency_rows[currency.value], day_column]
+
+        return currency_amount * exchange_rate
+
+    def convert_columns_to_divs(self, currencies, currency_amounts, dates) -> np.ndarray:
+        """
+        Vectorized convert_to_divs.
 
-        closest_date = min(self.conversions_dict.keys(), key=lambda d: abs(d - relevant_date))
+        :param currencies: Currency values, ex: 'exalted'
+        :param currency_amounts: Amounts of each currency
+        :param dates: Dates or datetimes, as objects or strings. Naive datetimes are taken as UTC
+        :return: The amounts in divines. NaN where the currency has no conversion rates
+        """
+        currency_amounts = np.asarray(currency_amounts, dtype=np.float64)
+        if not len(currency_amounts):
+            return currency_amounts
 
-        exchange_rate = self.conversions_dict[closest_date][currency.value]
-        converted_amount = currency_amount * exchange_rate
+        currency_rows = self._currencies.get_indexer(pd.Index(currencies))
 
-        self._conversion_cache[convert_key] = converted_amount
+        utc_dates = pd.DatetimeIndex(pd.to_datetime(dates, utc=True, format='ISO8601')).tz_localize(None)
+        day_columns = self._day_columns(utc_dates.to_numpy(dtype='datetime64[D]'))
 
-        return converted_amount
+        exchange_rates = np.where(currency_rows >= 0, self._rates[currency_rows, day_columns], np.nan)
+        return currency_amounts * exchange_rates
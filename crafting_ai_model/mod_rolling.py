@@ -1,12 +1,12 @@
 import random
 
 from file_management.file_managers import ItemModsFile
-from instances_and_definitions import ModifiableListing, ItemMod
+from instances_and_definitions import ModifiableListing, ItemMod, ModTemplate
 from shared.enums.item_enums import ModAffixType, AType
 from shared.enums.trade_enums import ModClass
 
 
-def _mods_into_dict(mods: list[ItemMod]):
+def _mods_into_dict(mods: list[ModTemplate]):
     """
 
     :param mods:
@@ -29,8 +29,9 @@ class ModsFetcher:
 
     def __init__(self):
         mods = ItemModsFile().load(default={})
+        templates = [mod if isinstance(mod, ModTemplate) else ModTemplate.from_mod(mod) for mod in mods.values()]
 
-        self.mods_dict = _mods_into_dict(list(mods.values))
+        self.mods_dict = _mods_into_dict(templates)
 
     def fetch_mod_tiers(self,
                         atype: AType,
@@ -115,6 +116,7 @@ class ModRoller:
                                  weights=[(mod.weighting / total_weight) for mod in atype_item_mods],
                                  k=1)[0]
 
-        return new_mod
+        # The cached mods are shared templates - the listing gets its own instance
+        return new_mod.instantiate()
 
 
@@ -57,7 +57,7 @@ class CraftingModelPipeline:
         random.shuffle(training_queries)
         for responses in self._trade_api_handler.fetch_responses(training_queries):
             parsers = [ApiResponseParser(response) for response in responses]
-            listings = [self._listing_builder.build_listing(rp) for rp in parsers]
+            listings = self._listing_builder.build_listings(parsers)
 
             if not listings:
                 continue
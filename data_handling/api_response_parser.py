@@ -1,8 +1,9 @@
 from dataclasses import dataclass
 from datetime import datetime
+from functools import cached_property
 
 from program_logging import LogsHandler, LogFile
-from shared import shared_utils
+from shared import shared_utils, text_normalization
 from shared.enums.item_enums import AType
 from shared.enums.trade_enums import ModClass, Currency, Rarity
 
@@ -31,42 +32,141 @@ class _ATypeClassifier:
         'galvanic_wand': 'lightning_wand',
     }
 
+    # Attribute requirement bits
+    _str_bit, _dex_bit, _int_bit = 1, 2, 4
+
+    # Atype suffixes in the order they're tried after the bare category, with the attributes each one needs
+    _suffix_masks = (
+        ('_(str/dex/int)', 7),
+        ('_(str/int)', 5),
+        ('_(str/dex)', 3),
+        ('_(dex/int)', 6),
+        ('_str', 1),
+        ('_dex', 2),
+        ('_int', 4)
+    )
+
+    # {(item category, attribute mask): atype} - built on first use, with unknown categories added as they show up
+    _atype_table = dict()
+
     @classmethod
-    def classify(cls, item_category: str, item_btype: str, str_req: int, int_req: int, dex_req: int):
-        if item_btype in cls._wand_btype_map:
-            return cls._wand_btype_map[item_btype]
+    def _classify_uncached(cls, item_category: str, attribute_mask: int) -> AType | None:
+        atypes = AType._value2member_map_
+        if item_category in atypes:
+            return atypes[item_category]
 
-        possible_atypes = [item_category]
+        for suffix, needed_mask in cls._suffix_masks:
+            if attribute_mask & needed_mask == needed_mask and f"{item_category}{suffix}" in atypes:
+                return atypes[f"{item_category}{suffix}"]
 
-        if str_req and int_req and dex_req:
-            possible_atypes.append(f"{item_category}_(str/dex/int)")
+        return None
 
-        if str_req and int_req:
-            possible_atypes.append(f"{item_category}_(str/int)")
+    @classmethod
+    def _build_atype_table(cls) -> dict:
+        categories = set()
+        for atype in AType:
+            categories.add(atype.value)
+            categories.update(atype.value[:-len(suffix)] for suffix, _ in cls._suffix_masks
+                              if atype.value.endswith(suffix))
 
-        if str_req and dex_req:
-            possible_atypes.append(f"{item_category}_(str/dex)")
+        return {(category, mask): cls._classify_uncached(category, mask)
+                for category in categories for mask in range(8)}
 
-        if dex_req and int_req:
-            possible_atypes.append(f"{item_category}_(dex/int)")
+    @classmethod
+    def classify(cls, item_category: str, item_btype: str, str_req: int, int_req: int, dex_req: int):
+        if item_btype in cls._wand_btype_map:
+            return cls._wand_btype_map[item_btype]
 
-        if str_req:
-            possible_atypes.append(f"{item_category}_str")
+        if not cls._atype_table:
+            cls._atype_table = cls._build_atype_table()
+
+        attribute_mask = ((cls._str_bit if str_req else 0)
+                          | (cls._dex_bit if dex_req else 0)
+                          | (cls._int_bit if int_req else 0))
+        key = (item_category, attribute_mask)
+        if key not in cls._atype_table:
+            cls._atype_table[key] = cls._classify_uncached(item_category, attribute_mask)
+
+        return cls._atype_table[key]
+
+
+class _ResponseFields:
+    """
+    The fields of a trade API response that ApiResponseParser reads as sanitized text, as paths into the response. '*'
+    stands for every element of a list or every value of a dict, and everything below the last key is sanitized.
+    Nothing else is touched - icon urls, ids, descriptions and flavour text are read as is or not at all.
+    """
+    sanitized_paths = (
+        ('listing', 'account', 'name'),
+        ('listing', 'price', 'currency'),
+        ('item', 'name'),
+        ('item', 'baseType'),
+        ('item', 'rarity'),
+        ('item', 'properties', '*', 'name'),
+        ('item', 'properties', '*', 'values'),
+        ('item', 'requirements', '*', 'name'),
+        ('item', 'grantedSkills', '*', 'values'),
+        ('item', 'extended', 'mods', '*', '*', 'name'),
+        ('item', 'extended', 'mods', '*', '*', 'tier'),
+        *(('item', mod_class.value, '*') for mod_class in ModClass)
+    )
+
+    # {block: {key: ... {key: None}}}, with None at the end of each path - built on first use
+    _paths_tree = dict()
 
-        if dex_req:
-            possible_atypes.append(f"{item_category}_dex")
+    @classmethod
+    def _build_paths_tree(cls) -> dict:
+        paths_tree = dict()
+        for path in cls.sanitized_paths:
+            node = paths_tree
+            for key in path[:-1]:
+                node = node.setdefault(key, dict())
+            node[path[-1]] = None
 
-        if int_req:
-            possible_atypes.append(f"{item_category}_int")
+        return paths_tree
 
-        for atype in possible_atypes:
-            try:
-                return AType(atype)
-            except ValueError:
-                pass
+    @classmethod
+    def _sanitize(cls, value, node: dict | None):
+        if node is None:
+            return text_normalization.sanitize_dict_texts(value)
+
+        # Only the containers along the paths are copied, everything else is shared with the raw response
+        if isinstance(value, list):
+            return [cls._sanitize(item, node['*']) for item in value] if '*' in node else value
+
+        if isinstance(value, dict):
+            sanitized = dict(value)
+            for key, child in node.items():
+                if key == '*':
+                    for k, v in value.items():
+                        sanitized[k] = cls._sanitize(v, child)
+                elif key in value:
+                    sanitized[key] = cls._sanitize(value[key], child)
+            return sanitized
+
+        return value
+
+    @classmethod
+    def sanitize_field(cls, block: str, key: str, value):
+        """
+        :param block: 'item' or 'listing'
+        :param key: Key of the value within the block
+        """
+        if not cls._paths_tree:
+            cls._paths_tree = cls._build_paths_tree()
+
+        block_tree = cls._paths_tree[block]
+        return cls._sanitize(value, block_tree[key]) if key in block_tree else value
 
 
 class ApiResponseParser:
+    """
+    Reads one trade API fetch response. Derived fields are computed on first access and cached, since ListingBuilder
+    reads most of them several times per listing - and the fetch stage only needs the listing id and date.
+
+    Responses are taken raw, as the API returns them. The text fields listed in _ResponseFields are sanitized when
+    they're first read. Sanitizing is idempotent, so records that were saved already sanitized parse the same.
+    """
     mod_class_to_abbrev = {
         ModClass.IMPLICIT: 'implicit',
         ModClass.ENCHANT: 'enchant',
@@ -81,15 +181,28 @@ class ApiResponseParser:
         6: 'lightning_damage'
     }
 
+    _attribute_requirements = ('str', 'dex', 'int')
+
     def __init__(self, api_response_data: dict):
         self.raw_response_data = self._clean_blank_spear_implicit(api_response_data)
 
-        self.sub_mod_hash_to_text = self._determine_sub_mod_hash_to_text()
-        self._properties = self._parse_properties()
+        # {(block, key): sanitized value}
+        self._fields = dict()
+
+    def _field(self, block: str, key: str, default=None):
+        """
+        :param block: 'item' or 'listing'
+        :return: The block's value for key, sanitized on first read
+        """
+        if (block, key) not in self._fields:
+            raw_value = self.raw_response_data[block].get(key, default)
+            self._fields[(block, key)] = _ResponseFields.sanitize_field(block, key, raw_value)
+
+        return self._fields[(block, key)]
 
     def fetch_tiered_mod_strings(self, mod_class: ModClass, mod_abbrev: str) -> list[str]:
-        hash_to_text = {k: f"({mod_class.value}) {v}   " for k, v in self.sub_mod_hash_to_text[mod_class].items()}
-        for mod in self.item_data['extended']['mods'][mod_abbrev]:
+        hash_to_text = {k: f"({mod_class.value}) {v}   " for k, v in self.fetch_sub_mod_hash_to_text(mod_class).items()}
+        for mod in self._mods_data.get(mod_abbrev, ()):
             hashes = [magnitude['hash'] for magnitude in mod['magnitudes']]
             is_hybrid = len(hashes) >= 2
 
@@ -125,14 +238,12 @@ class ApiResponseParser:
     def _parse_properties(self) -> dict:
         properties = dict()
 
-        if 'properties' not in self.item_data:
+        if not self.raw_properties:
             parse_log.info(f"No item properties found for item '{self.item_name}'.")
             return dict()
 
         # The first property is the item category
-        raw_properties = self.item_data['properties'][1:]
-
-        for raw_property in raw_properties:
+        for raw_property in self.raw_properties[1:]:
             property_name = raw_property['name']
 
             if property_name == 'elemental_damage':
@@ -160,13 +271,12 @@ class ApiResponseParser:
         for mod_class in mod_classes:
             abbrev_class = self.__class__.mod_class_to_abbrev[mod_class]
 
-            if abbrev_class not in self.item_data['extended']['hashes']:
+            hashes_data = self.item_data['extended']['hashes']
+            if abbrev_class not in hashes_data:
                 continue
 
-            hashes_list = self.item_data['extended']['hashes'][abbrev_class]
-
-            hash_display_order = [mod_hash[0] for mod_hash in hashes_list]
-            mod_text_display_order = self.item_data[mod_class.value]
+            hash_display_order = [mod_hash[0] for mod_hash in hashes_data[abbrev_class]]
+            mod_text_display_order = self._field('item', mod_class.value)
 
             mod_id_to_text = {
                 mod_id: mod_text
@@ -176,9 +286,29 @@ class ApiResponseParser:
 
         return hash_to_text
 
+    @cached_property
+    def sub_mod_hash_to_text(self) -> dict:
+        return self._determine_sub_mod_hash_to_text()
+
     def fetch_sub_mod_hash_to_text(self, mod_class: ModClass) -> dict:
         return self.sub_mod_hash_to_text[mod_class] if mod_class in self.sub_mod_hash_to_text else dict()
 
+    @cached_property
+    def _requirements(self) -> dict[str, int]:
+        """
+        Every requirement that the parser reads, from one pass over the requirements block.
+        """
+        requirements = dict()
+        for i, requirement in enumerate(self._field('item', 'requirements') or ()):
+            # Ex: '[Strength|Str]' -> 'str'
+            name = requirement['name']
+
+            # The level requirement only counts when it's listed first
+            if (name in self._attribute_requirements and name not in requirements) or (name == 'level' and i == 0):
+                requirements[name] = int(requirement['values'][0][0])
+
+        return requirements
+
     @property
     def item_data(self) -> dict:
         return self.raw_response_data['item']
@@ -189,9 +319,9 @@ class ApiResponseParser:
 
     @property
     def skills_data(self) -> dict:
-        return self.item_data['grantedSkills'] if 'grantedSkills' in self.item_data else dict()
+        return self._field('item', 'grantedSkills', dict())
 
-    @property
+    @cached_property
     def date_fetched(self) -> datetime:
         return shared_utils.format_date_into_utc(self.listing_data['indexed'])
 
@@ -199,40 +329,44 @@ class ApiResponseParser:
     def listing_id(self) -> str:
         return self.raw_response_data['id']
 
-    @property
+    @cached_property
     def mod_classes(self) -> list[ModClass]:
         # We aren't messing with runes right now
         return [mod_class for mod_class in ModClass
                 if mod_class.value in self.item_data and mod_class != ModClass.RUNE]
 
+    @property
+    def _mods_data(self) -> dict:
+        return self._field('item', 'extended')['mods']
+
     def fetch_mods_data(self, mod_class: ModClass) -> dict:
         abbrev_class = self.__class__.mod_class_to_abbrev[mod_class]
-        mods_data = self.item_data['extended']['mods']
+        mods_data = self._mods_data
         return mods_data[abbrev_class] if abbrev_class in mods_data else dict()
 
     @property
     def account_name(self) -> str:
-        return self.listing_data['account']['name']
+        return self._field('listing', 'account')['name']
 
-    @property
+    @cached_property
     def price(self) -> Price:
+        price_data = self._field('listing', 'price')
         return Price(
-            currency=Currency(self.listing_data['price']['currency']),
-            amount=self.listing_data['price']['amount']
+            currency=Currency(price_data['currency']),
+            amount=price_data['amount']
         )
 
     @property
     def item_name(self) -> str:
-        return self.item_data['name']
+        return self._field('item', 'name')
 
     @property
     def item_btype(self) -> str:
-        return self.item_data['baseType']
+        return self._field('item', 'baseType')
 
-    @property
+    @cached_property
     def item_rarity(self) -> Rarity:
-        rarity_str = self.item_data['rarity'].lower()
-        return Rarity(rarity_str)
+        return Rarity(self._field('item', 'rarity'))
 
     @property
     def item_ilvl(self) -> int:
@@ -240,8 +374,7 @@ class ApiResponseParser:
 
     @property
     def level_requirement(self) -> int:
-        reqs = self.item_data['requirements']
-        return int(reqs[0]['values'][0][0]) if reqs and reqs[0]['name'] == 'Level' else 0
+        return self._requirements.get('level', 0)
 
     @property
     def is_identified(self) -> bool:
@@ -251,7 +384,18 @@ class ApiResponseParser:
     def is_corrupted(self) -> bool:
         return 'corrupted' in self.item_data and self.item_data['corrupted'] is True
 
-    @property
+    @staticmethod
+    def classify_atype(item_category: str, item_btype: str, str_req: int, int_req: int, dex_req: int) -> AType | None:
+        """
+        Classifies an item from its sanitized category and base type. Only whether each requirement is there matters.
+        """
+        return _ATypeClassifier.classify(item_category=item_category,
+                                         item_btype=item_btype,
+                                         str_req=str_req,
+                                         int_req=int_req,
+                                         dex_req=dex_req)
+
+    @cached_property
     def item_atype(self) -> AType:
         return _ATypeClassifier.classify(item_category=self.item_category,
                                          item_btype=self.item_btype,
@@ -259,29 +403,30 @@ class ApiResponseParser:
                                          dex_req=self.dex_requirement,
                                          int_req=self.int_requirement)
 
-    @property
-    def item_category(self):
-        return shared_utils.extract_from_brackets(self.item_properties[0]['name'])
+    @cached_property
+    def item_category(self) -> str | None:
+        # The first property is the item category, ex: '[Quarterstaff]' -> 'quarterstaff'
+        return self.raw_properties[0]['name'] if self.raw_properties else None
 
     @property
+    def raw_properties(self) -> list[dict]:
+        """
+        The unparsed properties, with sanitized names and values.
+        """
+        return self._field('item', 'properties') or []
+
+    @cached_property
     def item_properties(self) -> dict:
-        return self._properties
+        return self._parse_properties()
 
     @property
     def str_requirement(self) -> int:
-        requirements = self.item_data['requirements']
-        str_req = [req for req in requirements if req['name'] == 'str']
-
-        return int(str_req[0]['values'][0][0]) if str_req else 0
+        return self._requirements.get('str', 0)
 
     @property
     def int_requirement(self) -> int:
-        requirements = self.item_data['requirements']
-        int_req = [req for req in requirements if req['name'] == 'int']
-        return int(int_req[0]['values'][0][0]) if int_req else 0
+        return self._requirements.get('int', 0)
 
     @property
     def dex_requirement(self) -> int:
-        requirements = self.item_data['requirements']
-        dex_req = [req for req in requirements if req['name'] == 'dex']
-        return int(dex_req[0]['values'][0][0]) if dex_req else 0
+        return self._requirements.get('dex', 0)
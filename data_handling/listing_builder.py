@@ -1,11 +1,11 @@
-import copy
 import pprint
 import re
 from dataclasses import dataclass
 import uuid
 
-from file_management.file_managers import ItemModsFile, Poe2DbModsManagerFile
-from instances_and_definitions import ItemMod, SubMod, ItemSkill, ModifiableListing, generate_mod_id
+from file_management.file_managers import ItemModsFile, Poe2DbModsManagerFile, ModMatchCacheFile
+from instances_and_definitions import ItemMod, SubMod, ItemSkill, ModifiableListing, ModTemplate, generate_mod_id
+from poe2db_scrape.mods_management import Poe2DbMod
 from program_logging import LogFile, LogsHandler, log_errors
 from shared import shared_utils
 from shared.enums.item_enums import ModAffixType, AType
@@ -22,12 +22,20 @@ class ListingBuilder:
     def __init__(self):
         self._mod_resolver = self._create_mod_resolver()
 
+    def flush(self):
+        """
+        Writes out any mod templates that are still buffered.
+        """
+        self._mod_resolver.flush()
+
     @staticmethod
     def _create_mod_resolver() -> '_ModResolver':
         item_mods_file = ItemModsFile()
 
-        poe2db_mods_manager = Poe2DbModsManagerFile().load(missing_ok=False)
-        mod_matcher = ModMatcher(poe2db_mods_manager)
+        poe2db_mods_file = Poe2DbModsManagerFile()
+        poe2db_mods_manager = poe2db_mods_file.load(missing_ok=False)
+        match_cache = ModMatchCacheFile(version=poe2db_mods_file.content_hash())
+        mod_matcher = ModMatcher(poe2db_mods_manager, match_cache=match_cache)
 
         poe2db_injector = _PoE2DbInjector(mod_matcher=mod_matcher)  # <-- Typo fix here
         return _ModResolver(item_mods_file=item_mods_file,
@@ -35,13 +43,10 @@ class ListingBuilder:
 
     @staticmethod
     def _build_listing_string(rp: ApiResponseParser):
-        if rp.item_properties:
-            properties_ = {
-                shared_utils.extract_from_brackets(p['name']): shared_utils.extract_values_from_text(p['values'][0][0])[0]
-                for p in rp.item_properties[1:]
-            }
-        else:
-            properties_ = {}
+        properties_ = {
+            p['name']: shared_utils.extract_values_from_text(p['values'][0][0])[0]
+            for p in rp.raw_properties[1:]
+        }
 
         att_requirements = {
             k: v for k, v in {
@@ -84,7 +89,17 @@ class ListingBuilder:
 
         return ''.join(s)
 
-    def build_listing(self, rp: ApiResponseParser):
+    def build_listings(self, rps: list[ApiResponseParser]) -> list[ModifiableListing]:
+        """
+        Builds a page of listings at once, so that all of their new mods are matched to poe2db in one batch.
+        """
+        listings_mods = self._mod_resolver.resolve_listings_mods(rps)
+        return [self.build_listing(rp, item_mods=item_mods) for rp, item_mods in zip(rps, listings_mods)]
+
+    def build_listing(self, rp: ApiResponseParser, item_mods: list[ItemMod] = None):
+        """
+        :param item_mods: The item's already resolved mods. Resolved here if not provided
+        """
         minutes_since_listed = utils.determine_minutes_since(
             relevant_date=rp.date_fetched
         )
@@ -92,7 +107,8 @@ class ListingBuilder:
             relevant_date=utils.league_start_date,
             later_date=rp.date_fetched
         )
-        item_mods = self._mod_resolver.resolve_mods(rp)
+        if item_mods is None:
+            item_mods = self._mod_resolver.resolve_mods(rp)
 
         listing = ModifiableListing(
             my_id=f"LST_{uuid.uuid4().hex[:10].upper()}",
@@ -109,6 +125,10 @@ class ListingBuilder:
             item_atype=rp.item_atype,
             rarity=rp.item_rarity,
             ilvl=rp.item_ilvl,
+            level_requirement=rp.level_requirement,
+            str_requirement=rp.str_requirement,
+            int_requirement=rp.int_requirement,
+            dex_requirement=rp.dex_requirement,
             identified=rp.is_identified,
             corrupted=rp.is_corrupted,
             implicit_mods=[mod for mod in item_mods if mod.mod_class == ModClass.IMPLICIT],
@@ -162,7 +182,7 @@ class _SubModValuesInjector:
         for sub_mod_hash, sub_mod in sub_mod_hash_to_sub_mod.items():
             sub_mod_text = sub_mod_hash_to_text[sub_mod_hash]
             values = shared_utils.extract_values_from_text(sub_mod_text)
-            parse_log.info(f"Parsed sub-mod text '{sub_mod_text}' into values {values}")
+            parse_log.debug("Parsed sub-mod text '%s' into values %s", sub_mod_text, values)
             sub_mod.actual_values = values
 
 
@@ -171,13 +191,11 @@ class _PoE2DbInjector:
     def __init__(self, mod_matcher: ModMatcher):
         self.mod_matcher = mod_matcher
 
-    def inject_poe2db_into_mod(self, mod: ItemMod) -> ItemMod:
-        # Only explicit mods and fractured mods require weighting and mod types
-        if mod.mod_class not in (ModClass.EXPLICIT, ModClass.FRACTURED):
-            return mod
-
-        poe2db_mod = self.mod_matcher.match_mod(mod)
+    # Only explicit mods and fractured mods require weighting and mod types
+    _matched_mod_classes = (ModClass.EXPLICIT, ModClass.FRACTURED)
 
+    @staticmethod
+    def _apply_poe2db_mod(mod: ItemMod, poe2db_mod: Poe2DbMod | None) -> ItemMod:
         if not poe2db_mod:
             parse_log.error(f"Was not able to match item mod:\n{pprint.pformat(mod)}")
             return mod
@@ -187,6 +205,22 @@ class _PoE2DbInjector:
 
         return mod
 
+    def inject_poe2db_into_mod(self, mod: ItemMod) -> ItemMod:
+        if mod.mod_class not in self._matched_mod_classes:
+            return mod
+
+        return self._apply_poe2db_mod(mod, self.mod_matcher.match_mod(mod))
+
+    def inject_poe2db_into_mods(self, mods: list[ItemMod]) -> list[ItemMod]:
+        """
+        Matches all of the mods in one batch - much faster than one at a time when there are many new mods.
+        """
+        matched_mods = [mod for mod in mods if mod.mod_class in self._matched_mod_classes]
+        for mod, poe2db_mod in zip(matched_mods, self.mod_matcher.match_mods(matched_mods)):
+            self._apply_poe2db_mod(mod, poe2db_mod)
+
+        return mods
+
 
 @dataclass
 class _ModMeta:
@@ -304,7 +338,9 @@ class _ModResolver:
         self._poe2db_injector = poe2db_injector
 
         self._item_mods_file = item_mods_file
-        self._mods = item_mods_file.load(default=dict())
+
+    def flush(self):
+        self._item_mods_file.flush()
 
     @staticmethod
     def _balance_same_hash_sub_mods(mods):
@@ -334,47 +370,66 @@ class _ModResolver:
             for i, sub_mod in enumerate(sub_mods):
                 sub_mod.actual_values = [round(val * range_portions[i], 2) for val in sub_mod.actual_values]
 
-    @log_errors(parse_log)
-    def resolve_mods(self, rp: ApiResponseParser) -> list[ItemMod]:
-        """
-        Attempts to pull each mod in the item's data from file. Otherwise, it manages the mod's creation and caching
-        :return: All mods from the item data
-        """
+    def _fetch_template(self, mod_id) -> ModTemplate | None:
+        template_mod = self._item_mods_file.fetch_mod(mod_id)
+        if isinstance(template_mod, ItemMod):
+            # Cached before templates were split out of ItemMod - upgrade the cached entry
+            template_mod = ModTemplate.from_mod(template_mod)
+            self._item_mods_file.save_mod(mod_id=mod_id, mod=template_mod)
 
-        mods = []
+        return template_mod
+
+    @staticmethod
+    def _iterate_mods_data(rp: ApiResponseParser):
         for mod_class in rp.mod_classes:
-            mods_data = rp.fetch_mods_data(mod_class)
-            for mod_data in mods_data:
+            for mod_data in rp.fetch_mods_data(mod_class):
                 mod_meta = _ModFactory.create_mod_meta(
                     mod_class=mod_class,
                     mod_atype=rp.item_atype,
                     mod_data=mod_data
                 )
+                yield mod_data, mod_meta
+
+    def _create_missing_templates(self, rps: list[ApiResponseParser]):
+        """
+        Creates and caches a template for every mod in the items' data that isn't cached yet. The new mods are matched
+        to poe2db in one batch.
+        """
+        new_mods = dict()
+        for rp in rps:
+            for mod_data, mod_meta in self._iterate_mods_data(rp):
                 mod_id = mod_meta.mod_id
-                sub_mod_hash_to_text = rp.fetch_sub_mod_hash_to_text(mod_class=mod_meta.mod_class)
-
-                if mod_id in self._mods:
-                    new_mod = copy.deepcopy(self._mods[mod_id])
-                else:
-                    parse_log.info(f"Could not find mod with ID {mod_id}. Creating and caching.")
-                    new_mod = _ModFactory.create_mod(
-                        mod_atype=mod_meta.mod_atype,
-                        mod_data=mod_data,
-                        mod_meta=mod_meta,
-                        sub_mod_hash_to_text=sub_mod_hash_to_text
-                    )
-                    self._poe2db_injector.inject_poe2db_into_mod(mod=new_mod)
-
-                    template_mod = copy.deepcopy(new_mod)
-                    self._mods[mod_id] = template_mod
-
-                # Mods are created as templates - which essentially just means that they have everything filled except
-                # for actual values in their sub-mods
-                _SubModValuesInjector.inject_sub_mod_values(
-                    sub_mod_hash_to_text=sub_mod_hash_to_text,
-                    current_mod=new_mod
+                if mod_id in new_mods or self._fetch_template(mod_id) is not None:
+                    continue
+
+                parse_log.info(f"Could not find mod with ID {mod_id}. Creating and caching.")
+                new_mods[mod_id] = _ModFactory.create_mod(
+                    mod_atype=mod_meta.mod_atype,
+                    mod_data=mod_data,
+                    mod_meta=mod_meta,
+                    sub_mod_hash_to_text=rp.fetch_sub_mod_hash_to_text(mod_class=mod_meta.mod_class)
                 )
-                mods.append(new_mod)
+
+        if not new_mods:
+            return
+
+        self._poe2db_injector.inject_poe2db_into_mods(list(new_mods.values()))
+
+        for mod_id, new_mod in new_mods.items():
+            self._item_mods_file.save_mod(mod_id=mod_id, mod=ModTemplate.from_mod(new_mod))
+
+    def _instantiate_mods(self, rp: ApiResponseParser) -> list[ItemMod]:
+        mods = []
+        for mod_data, mod_meta in self._iterate_mods_data(rp):
+            new_mod = self._fetch_template(mod_meta.mod_id).instantiate()
+
+            # Mods are created as templates - which essentially just means that they have everything filled except
+            # for actual values in their sub-mods
+            _SubModValuesInjector.inject_sub_mod_values(
+                sub_mod_hash_to_text=rp.fetch_sub_mod_hash_to_text(mod_class=mod_meta.mod_class),
+                current_mod=new_mod
+            )
+            mods.append(new_mod)
 
         """
          Individual mod texts on an item can be comprised of multiple different mods. The way mod creation
@@ -383,10 +438,25 @@ class _ModResolver:
         """
         self._balance_same_hash_sub_mods(mods=mods)
 
-        self._item_mods_file.save(data=self._mods)
-
         return mods
 
+    @log_errors(parse_log)
+    def resolve_mods(self, rp: ApiResponseParser) -> list[ItemMod]:
+        """
+        Attempts to pull each mod in the item's data from file. Otherwise, it manages the mod's creation and caching
+        :return: All mods from the item data
+        """
+        return self.resolve_listings_mods([rp])[0]
+
+    @log_errors(parse_log)
+    def resolve_listings_mods(self, rps: list[ApiResponseParser]) -> list[list[ItemMod]]:
+        """
+        Batch version of resolve_mods - the mods missing from the cache across all the items are matched together.
+        :return: All mods from each item's data, in order
+        """
+        self._create_missing_templates(rps)
+        return [self._instantiate_mods(rp) for rp in rps]
+
 
 class _SkillsFactory:
 
@@ -1,10 +1,12 @@
-import copy
 import re
 
+import numpy as np
 import rapidfuzz
 
+from file_management.file_managers import ModMatchCacheFile
 from instances_and_definitions import ItemMod
-from poe2db_scrape.mods_management import Poe2DbModsManager, create_mod_id, Poe2DbMod
+from poe2db_scrape.mods_management import Poe2DbModsManager, AtypeModsManager, Poe2DbMod
+from shared.enums.item_enums import AType, ModAffixType
 
 
 class _MatchScoreTracker:
@@ -64,9 +66,149 @@ def transform_text(text: str, transform_dict: dict) -> str:
     return text
 
 
+class _AtypeMatchIndex:
+    """
+    Everything ModMatcher needs from an AtypeModsManager, built once instead of on every match: the choice lists per
+    affix type, exact text lookups, the hybrid part counts, and a memo of fuzzy hybrid part results.
+    """
+
+    _affix_types = (None, ModAffixType.PREFIX, ModAffixType.SUFFIX)
+
+    def __init__(self, atype_manager: AtypeModsManager):
+        self.atype = atype_manager.atype
+
+        self._text_to_mod = {affix_type: dict() for affix_type in self._affix_types}
+        for mod in atype_manager.mods:
+            self._text_to_mod[None][mod.mod_text] = mod
+            self._text_to_mod[mod.affix_type][mod.mod_text] = mod
+
+        self._mod_texts = {affix_type: list(text_to_mod.keys()) for affix_type, text_to_mod in self._text_to_mod.items()}
+
+        self._part_to_parents = {
+            affix_type: atype_manager.fetch_hybrid_part_to_parents(affix_type) for affix_type in self._affix_types
+        }
+        self._hybrid_parts = {
+            affix_type: list(part_to_parents.keys()) for affix_type, part_to_parents in self._part_to_parents.items()
+        }
+        self._number_of_parts = {
+            mod: len(mod.mod_text.split(','))
+            for part_to_parents in self._part_to_parents.values()
+            for parents in part_to_parents.values()
+            for mod in parents
+        }
+
+        # {(affix type, mod text, min score): Poe2DbMod or None}
+        self._singleton_matches = dict()
+        # {(affix type, hybrid part text, min score): [(poe2db hybrid part, score)]}
+        self._hybrid_matches = dict()
+
+    def fetch_mod_texts(self, affix_type: ModAffixType | None) -> list[str]:
+        return self._mod_texts[affix_type]
+
+    def fetch_exact_mod(self, mod_text: str, affix_type: ModAffixType | None) -> Poe2DbMod | None:
+        return self._text_to_mod[affix_type].get(mod_text)
+
+    def match_singleton(self, mod_text: str, affix_type: ModAffixType | None, min_score: float) -> Poe2DbMod | None:
+        exact_mod = self.fetch_exact_mod(mod_text, affix_type)
+        if exact_mod:
+            return exact_mod
+
+        key = (affix_type, mod_text, min_score)
+        if key not in self._singleton_matches:
+            result = rapidfuzz.process.extractOne(mod_text, self._mod_texts[affix_type], score_cutoff=min_score)
+            self._singleton_matches[key] = self._text_to_mod[affix_type][result[0]] if result else None
+
+        return self._singleton_matches[key]
+
+    def fetch_hybrid_part_to_parents(self, affix_type: ModAffixType | None) -> dict:
+        return self._part_to_parents[affix_type]
+
+    def fetch_hybrid_parts(self, affix_type: ModAffixType | None) -> list[str]:
+        return self._hybrid_parts[affix_type]
+
+    def match_hybrid_part(self, part_text: str, affix_type: ModAffixType | None, min_score: float) -> list:
+        """
+        :return: [(poe2db hybrid part text, score)] for every hybrid part scoring at least min_score
+        """
+        key = (affix_type, part_text, min_score)
+        if key not in self._hybrid_matches:
+            matches = rapidfuzz.process.extract(part_text, self._hybrid_parts[affix_type], score_cutoff=min_score)
+            self._hybrid_matches[key] = [(match, score) for match, score, idx in matches]
+
+        return self._hybrid_matches[key]
+
+    @staticmethod
+    def _score_matrix(queries: list[str], choices: list[str], score_cutoff: float) -> np.ndarray:
+        # Same scorer as extract / extractOne, scored on every core
+        return rapidfuzz.process.cdist(queries,
+                                       choices,
+                                       scorer=rapidfuzz.fuzz.WRatio,
+                                       score_cutoff=score_cutoff,
+                                       dtype=np.float64,
+                                       workers=-1)
+
+    def prime_matches(self,
+                      mod_texts: set[str],
+                      hybrid_part_texts: set[str],
+                      affix_type: ModAffixType | None,
+                      min_scores: tuple[float, ...],
+                      extract_limit: int = 5):
+        """
+        Scores many texts in one multithreaded cdist call per choice set, and fills the same memos that
+        match_singleton / match_hybrid_part read from - so that matching afterwards doesn't score anything.
+
+        :param extract_limit: Number of matches rapidfuzz.process.extract keeps, which match_hybrid_part uses
+        """
+        mod_texts = [
+            text for text in mod_texts
+            if text not in self._text_to_mod[affix_type]
+            and any((affix_type, text, min_score) not in self._singleton_matches for min_score in min_scores)
+        ]
+        choices = self._mod_texts[affix_type]
+        if mod_texts and choices:
+            scores = self._score_matrix(mod_texts, choices, score_cutoff=min(min_scores))
+            best_idxs = scores.argmax(axis=1)
+            for text, best_idx, row in zip(mod_texts, best_idxs, scores):
+                for min_score in min_scores:
+                    match = self._text_to_mod[affix_type][choices[best_idx]] if row[best_idx] >= min_score else None
+                    self._singleton_matches[(affix_type, text, min_score)] = match
+
+        hybrid_part_texts = [
+            text for text in hybrid_part_texts
+            if any((affix_type, text, min_score) not in self._hybrid_matches for min_score in min_scores)
+        ]
+        parts = self._hybrid_parts[affix_type]
+        if hybrid_part_texts and parts:
+            scores = self._score_matrix(hybrid_part_texts, parts, score_cutoff=min(min_scores))
+            for text, row in zip(hybrid_part_texts, scores):
+                for min_score in min_scores:
+                    # extract orders by score, then by choice index
+                    match_idxs = sorted(np.flatnonzero(row >= min_score), key=lambda idx: (-row[idx], idx))
+                    self._hybrid_matches[(affix_type, text, min_score)] = [
+                        (parts[idx], float(row[idx])) for idx in match_idxs[:extract_limit]
+                    ]
+
+    def fetch_valid_parents(self, hybrid_part: str, affix_type: ModAffixType | None, number_of_parts: int) -> set:
+        """
+        :return: The poe2db hybrid mods containing the part that have the given number of parts
+        """
+        return {
+            poe2db_mod
+            for poe2db_mod in self._part_to_parents[affix_type][hybrid_part]
+            if self._number_of_parts[poe2db_mod] == number_of_parts
+        }
+
+
 class ModMatcher:
 
-    def __init__(self, poe2db_mods_manager: Poe2DbModsManager):
+    # Each score is tried without and then with the text transformations before moving to the next
+    _min_scores = (95.0, 90.0)
+
+    def __init__(self, poe2db_mods_manager: Poe2DbModsManager, match_cache: ModMatchCacheFile = None):
+        """
+        :param match_cache: Persistent cache of match results. Should be versioned on the same Poe2Db mods file as
+            poe2db_mods_manager
+        """
         self.mod_transformations = {
             '# additional': 'an additional',
             'an additional': '# additional',
@@ -74,101 +216,118 @@ class ModMatcher:
             'increased': 'reduced'
         }
 
-        self._coe_mod_parts_to_remove = {
-            '#% increased Waystones found in Area',
-            '#% reduced Waystones found in Area'
-        }
-
         self._poe2db_mods_manager = poe2db_mods_manager
+        self._match_cache = match_cache
+
+        self._atype_indexes = dict()
+        self._transformed_texts = dict()
+
+    def _fetch_index(self, atype: AType) -> _AtypeMatchIndex:
+        if atype not in self._atype_indexes:
+            atype_manager = self._poe2db_mods_manager.fetch_atype_manager(atype=atype)
+            self._atype_indexes[atype] = _AtypeMatchIndex(atype_manager)
+
+        return self._atype_indexes[atype]
 
     def _transform_text(self, text: str) -> str:
         """
         :return: Possibly transformed text
         """
-        transforms = {
-            before: after
-            for before, after in self.mod_transformations.items()
-            if before in text
-        }
-
-        for before, after in transforms.items():
-            text = re.sub(re.escape(before), after, text)
-
-        return text
+        if text not in self._transformed_texts:
+            self._transformed_texts[text] = transform_text(text, self.mod_transformations)
 
-    def _attempt_hybrid_match(self, item_mod: ItemMod, min_score: float) -> Poe2DbMod | None:
-        atype_manager = self._poe2db_mods_manager.fetch_atype_manager(atype=item_mod.atype)
-        hybrid_scores_tracker = _MatchScoreTracker()
-
-        number_of_parts = len(item_mod.sub_mods)
+        return self._transformed_texts[text]
 
+    @staticmethod
+    def _attempt_hybrid_match(index: _AtypeMatchIndex,
+                              affix_type: ModAffixType | None,
+                              sub_mod_texts: list[tuple],
+                              min_score: float) -> Poe2DbMod | None:
         """
         So this whole block works by matching individual PoE Trade hybrid mod (SubMod) texts to the possible
         hybrid poe2db mod texts of the corresponding AType. After we've found the best matches
         for each hybrid mod text, we just determine which poe2db hybrid mod is the best fit
-        """
-        for sub_mod in item_mod.sub_mods:
-            mod_part_to_parent_dict = atype_manager.fetch_hybrid_part_to_parents(item_mod.affix_type)
-            hybrid_mod_texts = list(mod_part_to_parent_dict.keys())
-
-            matches = rapidfuzz.process.extract(sub_mod.sanitized_text,
-                                                hybrid_mod_texts,
-                                                score_cutoff=min_score)
 
-            for match, score, idx in matches:
-                poe2db_mods = mod_part_to_parent_dict[match]
+        :param sub_mod_texts: [(sub-mod hash, sanitized sub-mod text)]
+        """
+        hybrid_scores_tracker = _MatchScoreTracker()
+        number_of_parts = len(sub_mod_texts)
 
+        for sub_mod_hash, sub_mod_text in sub_mod_texts:
+            for match, score in index.match_hybrid_part(sub_mod_text, affix_type, min_score):
                 # The number of parts in the Mod text has to line up with the number of parts in the poe2db mod
-                valid_poe2db_mods = {
-                    poe2db_mod
-                    for poe2db_mod in poe2db_mods
-                    if atype_manager.determine_number_of_hybrid_parts(poe2db_mod) == number_of_parts
-                }
+                valid_poe2db_mods = index.fetch_valid_parents(match, affix_type, number_of_parts)
 
                 if not valid_poe2db_mods:
                     continue
 
-                hybrid_scores_tracker.score_round(sub_mod_id=sub_mod.sub_mod_hash,
+                hybrid_scores_tracker.score_round(sub_mod_id=sub_mod_hash,
                                                   poe2db_mods=valid_poe2db_mods,
                                                   score=score)
 
-        poe2db_mod_match = hybrid_scores_tracker.determine_winner()
-        return poe2db_mod_match
+        return hybrid_scores_tracker.determine_winner()
 
-    def _attempt_singleton_match(self, item_mod: ItemMod, min_score: float) -> Poe2DbMod | None:
-        atype_manager = self._poe2db_mods_manager.fetch_atype_manager(atype=item_mod.atype)
+    def _attempt_match(self,
+                       index: _AtypeMatchIndex,
+                       affix_type: ModAffixType | None,
+                       sub_mod_texts: list[tuple],
+                       min_score: float,
+                       attempt_to_transform: bool = False) -> Poe2DbMod | None:
+        if attempt_to_transform:
+            sub_mod_texts = [(sub_mod_hash, self._transform_text(text)) for sub_mod_hash, text in sub_mod_texts]
 
-        poe2db_mod_texts = atype_manager.fetch_mod_texts(item_mod.affix_type)
+        if len(sub_mod_texts) >= 2:
+            return self._attempt_hybrid_match(index, affix_type, sub_mod_texts, min_score)
 
-        mod_text = item_mod.sub_mods[0].sanitized_text
+        return index.match_singleton(sub_mod_texts[0][1], affix_type, min_score)
 
-        result = rapidfuzz.process.extractOne(mod_text,
-                                              poe2db_mod_texts,
-                                              score_cutoff=min_score)
-        if not result:
-            return None
+    @staticmethod
+    def _match_key(item_mod: ItemMod) -> str:
+        return ModMatchCacheFile.match_key(atype=item_mod.atype,
+                                           affix_type=item_mod.affix_type,
+                                           sub_mod_texts=[sub_mod.sanitized_text for sub_mod in item_mod.sub_mods])
 
-        match, score, idx = result
+    def _load_cached_matches(self, keyed_mods: dict) -> dict:
+        """
+        :param keyed_mods: {match key: item mod}
+        :return: {match key: Poe2DbMod or None} for every item mod with a cached result
+        """
+        if not self._match_cache or not keyed_mods:
+            return dict()
+
+        cached_ids = self._match_cache.load_matches(list(keyed_mods.keys()))
+        return {
+            match_key: self._poe2db_mods_manager.fetch_mod(keyed_mods[match_key].atype, poe2db_mod_id)
+            if poe2db_mod_id else None
+            for match_key, poe2db_mod_id in cached_ids.items()
+        }
 
-        mod_id = create_mod_id(atype=atype_manager.atype,
-                               mod_text=match,
-                               affix_type=item_mod.affix_type)
-        mod = atype_manager.fetch_mod(mod_id)
+    def _save_matches(self, matches: dict):
+        """
+        :param matches: {match key: Poe2DbMod or None}
+        """
+        if not self._match_cache or not matches:
+            return
 
-        return mod
+        self._match_cache.save_matches({
+            match_key: poe2db_mod.mod_id if poe2db_mod else None for match_key, poe2db_mod in matches.items()
+        })
 
-    def _attempt_match(self, item_mod: ItemMod, min_score: float, attempt_to_transform: bool = False) -> Poe2DbMod | None:
-        if attempt_to_transform:
-            item_mod = copy.deepcopy(item_mod)
-            for sub_mod in item_mod.sub_mods:
-                sub_mod.sanitized_text = self._transform_text(sub_mod.sanitized_text)
+    def _match_uncached_mod(self, item_mod: ItemMod) -> Poe2DbMod | None:
+        index = self._fetch_index(item_mod.atype)
+        sub_mod_texts = [(sub_mod.sub_mod_hash, sub_mod.sanitized_text) for sub_mod in item_mod.sub_mods]
 
-        if item_mod.is_hybrid:
-            mod_match = self._attempt_hybrid_match(item_mod, min_score)
-        else:
-            mod_match = self._attempt_singleton_match(item_mod, min_score)
+        for min_score in self._min_scores:
+            for attempt_to_transform in (False, True):
+                poe2db_mod_match = self._attempt_match(index=index,
+                                                       affix_type=item_mod.affix_type,
+                                                       sub_mod_texts=sub_mod_texts,
+                                                       min_score=min_score,
+                                                       attempt_to_transform=attempt_to_transform)
+                if poe2db_mod_match:
+                    return poe2db_mod_match
 
-        return mod_match
+        return None
 
     def match_mod(self, item_mod: ItemMod) -> Poe2DbMod | None:
         """
@@ -176,19 +335,51 @@ class ModMatcher:
         :param item_mod:
         :return: The matching poe2db Mod ID.
         """
+        match_key = self._match_key(item_mod)
+        cached_matches = self._load_cached_matches({match_key: item_mod})
+        if match_key in cached_matches:
+            return cached_matches[match_key]
+
+        poe2db_mod_match = self._match_uncached_mod(item_mod)
+        self._save_matches({match_key: poe2db_mod_match})
+
+        return poe2db_mod_match
+
+    def match_mods(self, item_mods: list[ItemMod]) -> list[Poe2DbMod | None]:
+        """
+        Batch version of match_mod, for when many unseen mods come in at once (ex: the start of a league). Every
+        mod text is scored in one multithreaded cdist call per atype and affix type, and then each mod goes through
+        the same matching steps as match_mod.
+
+        :return: The matching poe2db mod of each item mod, in order
+        """
+        match_keys = [self._match_key(item_mod) for item_mod in item_mods]
+        keyed_mods = dict(zip(match_keys, item_mods))
+
+        matches = self._load_cached_matches(keyed_mods)
+        uncached_mods = {match_key: item_mod for match_key, item_mod in keyed_mods.items() if match_key not in matches}
+
+        # {(atype, affix type): (singleton mod texts, hybrid part texts)}
+        grouped_texts = dict()
+        for item_mod in uncached_mods.values():
+            texts = [sub_mod.sanitized_text for sub_mod in item_mod.sub_mods]
+            texts += [self._transform_text(text) for text in texts]
+
+            group_key = (item_mod.atype, item_mod.affix_type)
+            if group_key not in grouped_texts:
+                grouped_texts[group_key] = (set(), set())
 
-        poe2db_mod_match = self._attempt_match(item_mod=item_mod, min_score=95.0)
-        if poe2db_mod_match:
-            return poe2db_mod_match
+            mod_texts, hybrid_part_texts = grouped_texts[group_key]
+            (hybrid_part_texts if item_mod.is_hybrid else mod_texts).update(texts)
 
-        poe2db_mod_match = self._attempt_match(item_mod=item_mod, min_score=95.0, attempt_to_transform=True)
-        if poe2db_mod_match:
-            return poe2db_mod_match
+        for (atype, affix_type), (mod_texts, hybrid_part_texts) in grouped_texts.items():
+            self._fetch_index(atype).prime_matches(mod_texts=mod_texts,
+                                                   hybrid_part_texts=hybrid_part_texts,
+                                                   affix_type=affix_type,
+                                                   min_scores=self._min_scores)
 
-        poe2db_mod_match = self._attempt_match(item_mod=item_mod, min_score=90.0)
-        if poe2db_mod_match:
-            return poe2db_mod_match
+        new_matches = {match_key: self._match_uncached_mod(item_mod) for match_key, item_mod in uncached_mods.items()}
+        self._save_matches(new_matches)
 
-        poe2db_mod_match = self._attempt_match(item_mod=item_mod, min_score=90.0, attempt_to_transform=True)
-        if poe2db_mod_match:
-            return poe2db_mod_match
+        matches.update(new_matches)
+        return [matches[match_key] for match_key in match_keys]
@@ -1,3 +1,4 @@
 
+from .columnar_rows import ColumnarRows
 from .transforming_listings import ListingsTransforming
 
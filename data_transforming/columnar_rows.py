@@ -0,0 +1,93 @@
+from array import array
+
+
+class ColumnarRows:
+    """
+    Collects rows that each have their own subset of columns. Column names are interned to integer ids in the order
+    they first show up, and the values are kept as sparse (row, column, value) triples - adding a row only costs its
+    own values, no matter how many columns the table has. The table is materialized in one pass at the end.
+    """
+
+    def __init__(self):
+        # {column name: column id}
+        self._column_ids = dict()
+
+        self._row_ids = array('q')
+        self._col_ids = array('q')
+        self._values = []
+
+        self.n_rows = 0
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self._column_ids)
+
+    def column_id(self, column: str) -> int:
+        if column not in self._column_ids:
+            self._column_ids[column] = len(self._column_ids)
+
+        return self._column_ids[column]
+
+    def add_row(self, row: dict) -> int:
+        """
+        :param row: {column name: value}
+        :return: The row's index
+        """
+        row_id = self.n_rows
+        column_id = self.column_id
+        for column, value in row.items():
+            self._row_ids.append(row_id)
+            self._col_ids.append(column_id(column))
+            self._values.append(value)
+
+        self.n_rows += 1
+        return row_id
+
+    def to_dict(self, fill=None) -> dict[str, list]:
+        """
+        :param fill: Value of the columns a row doesn't have
+        :return: {column name: column values}
+        """
+        column_values = [[fill] * self.n_rows for _ in self._column_ids]
+        for row_id, col_id, value in zip(self._row_ids, self._col_ids, self._values):
+            column_values[col_id][row_id] = value
+
+        return dict(zip(self._column_ids, column_values))
+
+    def to_dataframe(self) -> 'pd.DataFrame':
+        """
+        Columns a row doesn't have are None, like in to_dict.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.to_dict())
+
+    def to_sparse(self, columns: list[str] = None) -> 'tuple[sp.csr_matrix, list[str]]':
+        """
+        Only numeric values are kept - None, strings and the like are left out of the matrix, so they read as 0.
+
+        :param columns: Only these columns, in this order. Defaults to every column that has a numeric value
+        :return: (rows x columns matrix, column names)
+        """
+        import numpy as np
+        import scipy.sparse as sp
+
+        if columns is None:
+            numeric_col_ids = sorted({col_id for col_id, value in zip(self._col_ids, self._values)
+                                      if isinstance(value, (int, float))})
+            id_to_column = list(self._column_ids)
+            columns = [id_to_column[col_id] for col_id in numeric_col_ids]
+
+        # {column id: matrix column}
+        matrix_cols = {self._column_ids[column]: i for i, column in enumerate(columns) if column in self._column_ids}
+
+        row_ids, col_ids, values = [], [], []
+        for row_id, col_id, value in zip(self._row_ids, self._col_ids, self._values):
+            if col_id in matrix_cols and isinstance(value, (int, float)):
+                row_ids.append(row_id)
+                col_ids.append(matrix_cols[col_id])
+                values.append(value)
+
+        matrix = sp.csr_matrix((np.array(values, dtype=np.float64), (row_ids, col_ids)),
+                               shape=(self.n_rows, len(columns)))
+        return matrix, columns
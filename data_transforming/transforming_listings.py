@@ -7,10 +7,9 @@ import core
 from core import CurrencyConverter
 from instances_and_definitions import ModifiableListing
 from program_logging import LogsHandler, LogFile, log_errors
-from shared import shared_utils
 from shared.enums import ItemEnumGroups, WhichCategoryType
 from shared.enums.item_enums import AType, LocalMod, CalculatedMod
-from shared.enums.trade_enums import Currency
+from .columnar_rows import ColumnarRows
 
 lh = LogsHandler()
 parse_log = lh.fetch_log(LogFile.API_PARSING)
@@ -167,17 +166,18 @@ class ListingsTransforming:
         *CalculatorRegistry.calculated_columns()
     }
 
-    @staticmethod
-    def to_flat_rows(listings: list[ModifiableListing]) -> dict:
-        """
+    # pformats every listing and its flattened row into the parsing log. Only worth the cost when debugging
+    log_rows = False
 
-        :param listings:
-        :return: Listings flattened into rows - used for database storage
+    @classmethod
+    def to_flat_table(cls, listings: list[ModifiableListing]) -> ColumnarRows:
+        """
+        :return: Listings flattened into a table with a row per listing
         """
-        compiled_data = dict()
-        for row, listing in enumerate(listings):
+        flat_table = ColumnarRows()
+        for listing in listings:
             flattened_data = (
-                _PricePredictTransformer(listing)
+                _PricePredictTransformer(listing, log_rows=cls.log_rows)
                 .insert_listing_properties()
                 .apply_calculators(delete_input_columns=True)
                 .insert_metadata()
@@ -188,30 +188,23 @@ class ListingsTransforming:
                 .clean_columns()
                 .flattened_data
             )
-            parse_log.info(
-                f"--- Listing ---\n{pprint.pformat(listing)}\n-> Flattened into ->\n{pprint.pformat(flattened_data)}"
-            )
+            if cls.log_rows:
+                parse_log.info(
+                    f"--- Listing ---\n{pprint.pformat(listing)}\n-> Flattened into ->\n{pprint.pformat(flattened_data)}"
+                )
 
-            # Fill in the previously missing columns with Nones up to all the rows before this loop
-            cols_missing_from_compiled = [col for col in flattened_data if col not in compiled_data]
-            compiled_data.update(
-                {
-                    missing_col: [] if row == 0 else [None] * row
-                    for missing_col in cols_missing_from_compiled
-                }
-            )
-
-            # Append None to any existing column that was not in this specific listing
-            cols_missing_from_listing = [col for col in compiled_data if col not in flattened_data]
-            for col in cols_missing_from_listing:
-                compiled_data[col].append(None)
+            flat_table.add_row(flattened_data)
 
-            for k, v in flattened_data.items():
-                compiled_data[k].append(v)
+        return flat_table
 
-            parse_log.info(f"Flattened data being inserted into PSQL:\n{pprint.pformat(flattened_data)}")
+    @classmethod
+    def to_flat_rows(cls, listings: list[ModifiableListing]) -> dict:
+        """
 
-        return compiled_data
+        :param listings:
+        :return: Listings flattened into rows - used for database storage. Columns that a listing doesn't have are None
+        """
+        return cls.to_flat_table(listings).to_dict()
 
     @classmethod
     def _determine_valid_price_predict_columns(cls, df) -> list[str]:
@@ -219,13 +212,20 @@ class ListingsTransforming:
         valid_cols = [*cls._price_predict_specific_cols, *mod_cols]
         return valid_cols
 
-    @classmethod
-    def _apply_determine_divs_price(cls, row):
-        return CurrencyConverter().convert_to_divs(
-            currency=Currency(row['currency']),
-            currency_amount=row['currency_amount'],
-            relevant_date=shared_utils.format_date_into_utc(row['date_fetched'])
-        )
+    @staticmethod
+    def _determine_divs_prices(df: 'pd.DataFrame') -> 'np.ndarray':
+        import numpy as np
+
+        divs = CurrencyConverter().convert_columns_to_divs(currencies=df['currency'],
+                                                           currency_amounts=df['currency_amount'],
+                                                           dates=df['date_fetched'])
+
+        n_unconverted = int(np.isnan(divs).sum())
+        if n_unconverted:
+            price_predict_log.warning(f"{n_unconverted} listings have a currency without conversion rates. Their "
+                                      f"divs are NaN.")
+
+        return divs
 
     @staticmethod
     @log_errors(price_predict_log)
@@ -243,12 +243,13 @@ class ListingsTransforming:
     @classmethod
     def to_price_predict_df(cls,
                             listings: list[ModifiableListing] = None,
-                            rows: dict[str: list] = None,
+                            rows: 'dict[str: list] | pd.DataFrame' = None,
                             existing_model=None) -> 'pd.DataFrame':
         """
 
         :param listings: Listings to format into a DataFrame for the PricePredict model.
-        :param rows: Rows must be provided if listings are not. Expected format: {column name : column values}
+        :param rows: Rows must be provided if listings are not. Expected format: {column name : column values}, or a
+            DataFrame of them (ex: from LongFormatListingStore.fetch_wide_df)
         :param existing_model: If using this method to predict from an existing PricePredict model, that model should be provided
             here. The model is used in this function to format the columns so that you can just feed the DataFrame output straight into the model.
         :return: Data formatted into a DataFrame for the PricePredict model
@@ -256,13 +257,10 @@ class ListingsTransforming:
 
         import pandas as pd
 
-        if not rows:
-            rows = cls.to_flat_rows(listings)
-
-        df = pd.DataFrame(rows)
+        df = cls.to_flat_table(listings).to_dataframe() if rows is None else pd.DataFrame(rows)
         df = df.drop_duplicates()
 
-        df['divs'] = df.apply(cls._apply_determine_divs_price, axis=1)
+        df['divs'] = cls._determine_divs_prices(df)
 
         cols = cls._determine_valid_price_predict_columns(df)
 
@@ -289,9 +287,14 @@ class ListingsTransforming:
 class _PricePredictTransformer:
     _non_mod_cols = {'minutes_since_league_start', 'atype'}
 
-    def __init__(self, listing: ModifiableListing):
+    def __init__(self, listing: ModifiableListing, log_rows: bool = False):
+        """
+        :param log_rows: Log the listing and each step's columns
+        """
         self.listing = listing
-        parse_log.info(f"NEW LISTING DATA\n{pprint.pformat(listing)}")
+        self.log_rows = log_rows
+        if log_rows:
+            parse_log.info(f"NEW LISTING DATA\n{pprint.pformat(listing)}")
 
         self.flattened_data = dict()
 
@@ -328,7 +331,8 @@ class _PricePredictTransformer:
             for calc in calculators
             for col_e, val in calc.calculate(self.listing).items()
         }
-        parse_log.info(f"Listing calculations:\n{pprint.pformat(derived_col_values)}\n")
+        if self.log_rows:
+            parse_log.info(f"Listing calculations:\n{pprint.pformat(derived_col_values)}\n")
         self.flattened_data.update(derived_col_values)
 
         if delete_input_columns:
@@ -383,14 +387,16 @@ class _PricePredictTransformer:
                 # we assign it a 1 to indicate to the model that it's an active mod
                 summed_sub_mods[mod_text] = 1
 
-        parse_log.info(f"Summed sub-mods:\n{pprint.pformat(summed_sub_mods)}\n")
+        if self.log_rows:
+            parse_log.info(f"Summed sub-mods:\n{pprint.pformat(summed_sub_mods)}\n")
         self.flattened_data.update(summed_sub_mods)
         return self
 
     def insert_skills(self):
         skills_dict = {item_skill.name: item_skill.level for item_skill in self.listing.item_skills}
         skills_dict = {skill_name: lvl for skill_name, lvl in skills_dict.items()}
-        parse_log.info(f"Skills:\n{pprint.pformat(skills_dict)}")
+        if self.log_rows:
+            parse_log.info(f"Skills:\n{pprint.pformat(skills_dict)}")
         self.flattened_data.update(skills_dict)
         return self
 
@@ -1,13 +1,21 @@
+import atexit
+import hashlib
+import itertools
 import json
 import os
+import pickle
+import sqlite3
 import tempfile
+import threading
+import time
 from abc import ABC
+from datetime import datetime, timezone
 from decimal import Decimal
 from pathlib import Path
 from typing import Any, Optional
 
 from shared.enums.item_enums import AType
-from . import i_o_utils
+from . import i_o_utils, json_codec
 
 
 class RawListingsFile:
@@ -15,19 +23,442 @@ class RawListingsFile:
     def __init__(self, path: Path = None):
         self._path = path or Path.cwd() / 'file_management/dynamic_files/raw_listings.jsonl'
 
+    def exists(self) -> bool:
+        return self._path.exists()
+
     def save(self, new_records: list[dict]):
         self._path.parent.mkdir(parents=True, exist_ok=True)
         self._path.touch(exist_ok=True)
 
-        with open(self._path, 'a', encoding='utf-8') as f:
-            for record in new_records:
-                json.dump(record, f)
-                f.write('\n')
+        with open(self._path, 'ab') as f:
+            f.write(b''.join(json_codec.dumpb(record) + b'\n' for record in new_records))
 
     def load(self) -> 'Generator[dict[str, Any], None, None]':
-        with open(self._path, 'r', encoding='utf-8') as f:
-            for i, line in enumerate(f):
-                yield json.loads(line)
+        with open(self._path, 'rb') as f:
+            for line in f:
+                yield json_codec.loads(line)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def size(self) -> int:
+        return self._path.stat().st_size
+
+    def shard_ranges(self, n_shards: int, start: int = 0, end: int = None) -> list[tuple[int, int]]:
+        """
+        Splits [start, end) into byte ranges of about the same size. Every range starts at the beginning of a line.
+
+        :param end: Defaults to the current size of the file
+        """
+        end = self.size() if end is None else end
+
+        boundaries = [start]
+        with open(self._path, 'rb') as f:
+            for i in range(1, n_shards):
+                f.seek(start + (end - start) * i // n_shards)
+                # Move past the line the seek landed in, unless it landed right at the start of one
+                f.seek(max(f.tell() - 1, 0))
+                f.readline()
+                boundaries.append(min(max(f.tell(), boundaries[-1]), end))
+        boundaries.append(end)
+
+        return [(shard_start, shard_end) for shard_start, shard_end in zip(boundaries, boundaries[1:])
+                if shard_start < shard_end]
+
+    def load_range(self, start: int, end: int) -> 'Generator[tuple[int, dict[str, Any]], None, None]':
+        """
+        :param start: Byte offset of the start of a line
+        :return: (byte offset, record) of every line that starts in [start, end)
+        """
+        with open(self._path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            while offset < end:
+                line = f.readline()
+                if not line:
+                    return
+                if line.strip():
+                    yield offset, json_codec.loads(line)
+                offset += len(line)
+
+    def load_at(self, offsets: list[int]) -> list[dict[str, Any]]:
+        """
+        :param offsets: Byte offsets of line starts, as yielded by load_range
+        """
+        records = []
+        with open(self._path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                records.append(json_codec.loads(f.readline()))
+        return records
+
+
+class RawListingsArchive:
+    """
+    Segmented, zstd-compressed replacement for the RawListingsFile.
+
+    Each save() is compressed into its own zstd frame and appended to the current segment file. Segments are rotated
+    once they reach segment_max_bytes, or when the day of the save changes. A SQLite sidecar index maps every record
+    to its frame along with its listing id, indexed date, price and the fields that its atype is classified from, so
+    single listings and date / atype ranges are read without decompressing the rest of the archive. Atypes are only
+    classified when they're queried.
+
+    Records are addressed by position: (frame id << 16) | line in the frame. Positions only grow as records are
+    appended, so they stand in for the byte offsets of the RawListingsFile (see RawListingsBackfill).
+    """
+
+    segment_max_bytes = 256 * 1024 ** 2
+    rotate_daily = True
+    frame_max_records = 1000
+    compression_level = 3
+
+    _line_bits = 16
+
+    # Every column of the records table besides the position
+    _index_columns = {
+        'listing_id': 'TEXT',
+        'indexed': 'INTEGER',
+        'base_type': 'TEXT',
+        'category': 'TEXT',
+        'attribute_mask': 'INTEGER',
+        'currency': 'TEXT',
+        'amount': 'REAL'
+    }
+
+    # Attribute requirement bits of attribute_mask
+    _str_bit, _dex_bit, _int_bit = 1, 2, 4
+
+    def __init__(self, folder_path: Path = None):
+        self._folder_path = folder_path or Path.cwd() / 'file_management/dynamic_files/raw_listings'
+
+        # Opened on first use, so that the archive can be handed to worker processes
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        return self.__class__, (self._folder_path,)
+
+    @property
+    def path(self) -> Path:
+        return self._folder_path
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is not None:
+            return self._connection
+
+        self._folder_path.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self._folder_path / 'index.sqlite'),
+                                           timeout=60,
+                                           check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS segments ('
+                'segment INTEGER PRIMARY KEY, file_name TEXT NOT NULL, day TEXT NOT NULL)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS frames ('
+                'frame INTEGER PRIMARY KEY, segment INTEGER NOT NULL, offset INTEGER NOT NULL, '
+                'length INTEGER NOT NULL, n_records INTEGER NOT NULL)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS records (frame INTEGER NOT NULL, line INTEGER NOT NULL, '
+                + ''.join(f'{column} {column_type}, ' for column, column_type in self._index_columns.items())
+                + 'PRIMARY KEY (frame, line)) WITHOUT ROWID'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS records_listing_id_idx ON records (listing_id)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS records_indexed_idx ON records (indexed)')
+
+        return self._connection
+
+    def exists(self) -> bool:
+        return (self._folder_path / 'index.sqlite').exists()
+
+    def count(self) -> int:
+        if not self.exists():
+            return 0
+
+        with self._lock:
+            return self._connect().execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    @classmethod
+    def _index_row(cls, record: dict) -> tuple:
+        """
+        :return: The record's values of the _index_columns. Only the few fields these need are read and sanitized
+        """
+        from data_handling import ApiResponseParser
+        from shared import shared_utils
+
+        listing_id = record.get('id')
+
+        try:
+            indexed = int(shared_utils.format_date_into_utc(record['listing']['indexed']).timestamp())
+        except (KeyError, TypeError, ValueError):
+            indexed = None
+
+        try:
+            parser = ApiResponseParser(record)
+        except (KeyError, TypeError):
+            return listing_id, indexed, None, None, None, None, None
+
+        try:
+            base_type, category = parser.item_btype, parser.item_category
+            attribute_mask = ((cls._str_bit if parser.str_requirement else 0)
+                              | (cls._dex_bit if parser.dex_requirement else 0)
+                              | (cls._int_bit if parser.int_requirement else 0))
+        except (KeyError, IndexError, TypeError, ValueError):
+            base_type, category, attribute_mask = None, None, None
+
+        try:
+            currency, amount = parser.price.currency.value, parser.price.amount
+        except (KeyError, TypeError, ValueError):
+            currency, amount = None, None
+
+        return listing_id, indexed, base_type, category, attribute_mask, currency, amount
+
+    @classmethod
+    def _classify_atype(cls, category: str, base_type: str, attribute_mask: int) -> str | None:
+        from data_handling import ApiResponseParser
+
+        atype = ApiResponseParser.classify_atype(item_category=category,
+                                                 item_btype=base_type,
+                                                 str_req=attribute_mask & cls._str_bit,
+                                                 int_req=attribute_mask & cls._int_bit,
+                                                 dex_req=attribute_mask & cls._dex_bit)
+        # Wands are classified into plain strings
+        return getattr(atype, 'value', atype)
+
+    def _atype_keys(self, atypes: list[str]) -> list[tuple]:
+        """
+        :return: The (category, base_type, attribute_mask) of the indexed records that are one of the atypes
+        """
+        atypes = set(atypes)
+        return [key for key in self._connection.execute(
+            'SELECT DISTINCT category, base_type, attribute_mask FROM records WHERE category IS NOT NULL'
+        ) if self._classify_atype(*key) in atypes]
+
+    def price_counts(self) -> list[tuple]:
+        """
+        Read from the index alone, without decompressing any records.
+
+        :return: (atype value, currency, whole price amount, number of listings) of every indexed price
+        """
+        if not self.exists():
+            return []
+
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT category, base_type, attribute_mask, currency, CAST(amount AS INTEGER), COUNT(*) FROM records '
+                'WHERE category IS NOT NULL AND currency IS NOT NULL AND amount IS NOT NULL '
+                'GROUP BY category, base_type, attribute_mask, currency, CAST(amount AS INTEGER)'
+            ).fetchall()
+
+        return [(self._classify_atype(category, base_type, attribute_mask), currency, amount, count)
+                for category, base_type, attribute_mask, currency, amount, count in rows]
+
+    def _current_segment(self, day: str) -> tuple[int, str]:
+        row = self._connection.execute(
+            'SELECT segment, file_name, day FROM segments ORDER BY segment DESC LIMIT 1'
+        ).fetchone()
+
+        if row:
+            segment, file_name, segment_day = row
+            segment_path = self._folder_path / file_name
+            segment_size = segment_path.stat().st_size if segment_path.exists() else 0
+            if segment_size < self.segment_max_bytes and (segment_day == day or not self.rotate_daily):
+                return segment, file_name
+
+        segment = row[0] + 1 if row else 0
+        file_name = f'raw_listings_{day}_{segment:06d}.jsonl.zst'
+        with self._connection:
+            self._connection.execute('INSERT INTO segments (segment, file_name, day) VALUES (?, ?, ?)',
+                                     (segment, file_name, day))
+
+        return segment, file_name
+
+    def _append_frame(self, records: list[dict], compressor: 'zstandard.ZstdCompressor'):
+        # Serialized before indexing, since ApiResponseParser cleans up the response in place
+        frame_data = compressor.compress(b'\n'.join(json_codec.dumpb(record) for record in records))
+        index_rows = [self._index_row(record) for record in records]
+
+        # Rotated on the day of the save - old and new listings are often saved together
+        day = datetime.now(timezone.utc).strftime('%Y%m%d')
+
+        segment, file_name = self._current_segment(day)
+        with open(self._folder_path / file_name, 'ab') as f:
+            offset = f.tell()
+            f.write(frame_data)
+
+        # A frame that was written but never indexed (ex: a crash in between) is skipped by every read
+        with self._connection:
+            frame = self._connection.execute(
+                'INSERT INTO frames (segment, offset, length, n_records) VALUES (?, ?, ?, ?)',
+                (segment, offset, len(frame_data), len(records))
+            ).lastrowid
+            self._connection.executemany(
+                f"INSERT INTO records (frame, line, {', '.join(self._index_columns)}) "
+                f"VALUES ({', '.join('?' * (len(self._index_columns) + 2))})",
+                [(frame, line, *index_row) for line, index_row in enumerate(index_rows)]
+            )
+
+    def save(self, new_records: list[dict]):
+        import zstandard
+
+        if not new_records:
+            return
+
+        compressor = zstandard.ZstdCompressor(level=self.compression_level)
+        with self._lock:
+            self._connect()
+            for i in range(0, len(new_records), self.frame_max_records):
+                self._append_frame(new_records[i:i + self.frame_max_records], compressor)
+
+    def _read_frames(self, frame_rows: list[tuple]) -> 'Generator[tuple[int, list[bytes]], None, None]':
+        """
+        :param frame_rows: (frame, segment file name, offset, length) of each frame to read
+        :return: (frame, lines) of each frame
+        """
+        import zstandard
+
+        decompressor = zstandard.ZstdDecompressor()
+        for file_name, file_frames in itertools.groupby(frame_rows, key=lambda frame_row: frame_row[1]):
+            with open(self._folder_path / file_name, 'rb') as f:
+                for frame, _, offset, length in file_frames:
+                    f.seek(offset)
+                    yield frame, decompressor.decompress(f.read(length)).split(b'\n')
+
+    def _fetch_frame_rows(self, where_clause: str = '', params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._connect().execute(
+                'SELECT f.frame, s.file_name, f.offset, f.length FROM frames f '
+                f'JOIN segments s ON s.segment = f.segment{where_clause} ORDER BY f.frame',
+                params
+            ).fetchall()
+
+    def _load_positions(self, positions: list[int]) -> 'Generator[tuple[int, dict[str, Any]], None, None]':
+        """
+        :param positions: Sorted record positions
+        """
+        if not positions:
+            return
+
+        lines_by_frame = {frame: [position & ((1 << self._line_bits) - 1) for position in frame_positions]
+                          for frame, frame_positions in itertools.groupby(positions,
+                                                                          key=lambda p: p >> self._line_bits)}
+
+        frame_rows = []
+        frames = list(lines_by_frame)
+        for i in range(0, len(frames), 500):
+            chunk = frames[i:i + 500]
+            frame_rows += self._fetch_frame_rows(f" WHERE f.frame IN ({', '.join('?' * len(chunk))})", tuple(chunk))
+
+        for frame, lines in self._read_frames(frame_rows):
+            for line in lines_by_frame[frame]:
+                yield (frame << self._line_bits) | line, json_codec.loads(lines[line])
+
+    def load(self,
+             date_range: tuple[datetime, datetime] = None,
+             atypes: list[str] = None) -> 'Generator[dict[str, Any], None, None]':
+        """
+        :param date_range: (start, end) - only load listings indexed in [start, end)
+        :param atypes: Only load listings of these atypes
+        """
+        if not self.exists():
+            return
+
+        if date_range is None and atypes is None:
+            for _, lines in self._read_frames(self._fetch_frame_rows()):
+                for line in lines:
+                    yield json_codec.loads(line)
+            return
+
+        conditions = []
+        params = []
+        if date_range is not None:
+            conditions.append('indexed >= ? AND indexed < ?')
+            params += [int(date_range[0].timestamp()), int(date_range[1].timestamp())]
+
+        with self._lock:
+            self._connect()
+            if atypes is not None:
+                atype_keys = self._atype_keys(atypes)
+                if not atype_keys:
+                    return
+                conditions.append(f"(category, base_type, attribute_mask) IN "
+                                  f"(VALUES {', '.join(['(?, ?, ?)'] * len(atype_keys))})")
+                params += [value for key in atype_keys for value in key]
+
+            positions = [(frame << self._line_bits) | line for frame, line in self._connection.execute(
+                f"SELECT frame, line FROM records WHERE {' AND '.join(conditions)} ORDER BY frame, line",
+                params
+            )]
+
+        for _, record in self._load_positions(positions):
+            yield record
+
+    def fetch(self, listing_id: str) -> list[dict[str, Any]]:
+        """
+        :return: Every saved fetch of the listing, oldest first
+        """
+        if not self.exists():
+            return []
+
+        with self._lock:
+            positions = [(frame << self._line_bits) | line for frame, line in self._connect().execute(
+                'SELECT frame, line FROM records WHERE listing_id = ? ORDER BY frame, line',
+                (listing_id,)
+            )]
+
+        return [record for _, record in self._load_positions(positions)]
+
+    def size(self) -> int:
+        """
+        :return: The position after the last saved record
+        """
+        with self._lock:
+            last_frame = self._connect().execute('SELECT MAX(frame) FROM frames').fetchone()[0]
+        return 0 if last_frame is None else (last_frame + 1) << self._line_bits
+
+    def shard_ranges(self, n_shards: int, start: int = 0, end: int = None) -> list[tuple[int, int]]:
+        """
+        Splits the positions in [start, end) into ranges of about the same number of frames.
+
+        :param end: Defaults to the position after the last saved record
+        """
+        end = self.size() if end is None else end
+
+        with self._lock:
+            frames = [frame for frame, in self._connect().execute(
+                'SELECT frame FROM frames WHERE frame >= ? AND frame < ? ORDER BY frame',
+                (start >> self._line_bits, end >> self._line_bits)
+            )]
+
+        boundaries = sorted({start} | {frames[len(frames) * i // n_shards] << self._line_bits
+                                       for i in range(1, n_shards) if frames})
+        boundaries.append(end)
+
+        return [(shard_start, shard_end) for shard_start, shard_end in zip(boundaries, boundaries[1:])
+                if shard_start < shard_end]
+
+    def load_range(self, start: int, end: int) -> 'Generator[tuple[int, dict[str, Any]], None, None]':
+        """
+        :return: (position, record) of every record in [start, end)
+        """
+        frame_rows = self._fetch_frame_rows(' WHERE f.frame >= ? AND f.frame <= ?',
+                                            (start >> self._line_bits, end >> self._line_bits))
+
+        for frame, lines in self._read_frames(frame_rows):
+            for line, data in enumerate(lines):
+                position = (frame << self._line_bits) | line
+                if start <= position < end:
+                    yield position, json_codec.loads(data)
+
+    def load_at(self, offsets: list[int]) -> list[dict[str, Any]]:
+        """
+        :param offsets: Record positions, as yielded by load_range
+        """
+        records = dict(self._load_positions(sorted(offsets)))
+        return [records[offset] for offset in offsets]
 
 
 class _JsonDictFile(ABC):
@@ -42,6 +473,14 @@ class _JsonDictFile(ABC):
         return i_o_utils.load_json(path=self._path, default=default)
 
 
+class BackfillCheckpointFile(_JsonDictFile):
+    def __init__(self, path: Path = None):
+        super().__init__(path or Path.cwd() / 'file_management/dynamic_files/raw_listings_backfill_checkpoint.json')
+
+    def exists(self) -> bool:
+        return self._path.exists()
+
+
 class ListingStringsFile(_JsonDictFile):
     def __init__(self, path: Path = None):
         super().__init__(path or Path.cwd() / 'file_management/dynamic_files/listing_strings.json')
@@ -115,10 +554,120 @@ class PickleFile(ABC):
         return self._data
 
 
-class ItemModsFile(PickleFile):
+class ItemModsFile:
+    """
+    Cache of item mod templates, keyed by mod id. Each template is its own pickled row in a SQLite table, so adding a
+    template never rewrites the others.
+
+    Templates are looked up lazily and kept in memory once seen. New templates are written behind - they are buffered
+    and written in one transaction once flush_every are pending or flush_seconds have passed, and on interpreter exit.
+    """
+
+    def __init__(self, path: Path = None, flush_every: int = 100, flush_seconds: float = 30):
+        self._path = path or Path.cwd() / 'file_management/dynamic_files/item_mods.sqlite'
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+
+        self._connection = sqlite3.connect(str(self._path), timeout=60, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS item_mods (mod_id TEXT PRIMARY KEY, mod BLOB)')
+        self._lock = threading.Lock()
+
+        self._mods = dict()
+        self._pending_mods = dict()
+        self._last_flush = time.monotonic()
+
+        self._import_legacy_pickle(self._path.with_suffix('.pkl'))
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _mod_key(mod_id: tuple) -> str:
+        # Mod ids are tuples of enums, strings and ints - stored as text for the SQLite primary key
+        return '|'.join(str(getattr(part, 'value', part)) for part in mod_id)
+
+    def _import_legacy_pickle(self, pickle_path: Path):
+        """
+        Mod templates used to be stored as one pickled dict. Imports it once if this store is still empty.
+        """
+        if not pickle_path.exists() or not pickle_path.stat().st_size:
+            return
+
+        if self._connection.execute('SELECT 1 FROM item_mods LIMIT 1').fetchone():
+            return
+
+        with open(pickle_path, 'rb') as file:
+            legacy_mods = pickle.load(file)
+
+        with self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO item_mods (mod_id, mod) VALUES (?, ?)',
+                                         [(self._mod_key(mod_id), pickle.dumps(mod))
+                                          for mod_id, mod in legacy_mods.items()])
+
+    def fetch_mod(self, mod_id: tuple) -> 'ModTemplate | None':
+        if mod_id in self._mods:
+            return self._mods[mod_id]
+
+        with self._lock:
+            row = self._connection.execute('SELECT mod FROM item_mods WHERE mod_id = ?',
+                                           (self._mod_key(mod_id),)).fetchone()
+
+        if not row:
+            return None
+
+        self._mods[mod_id] = pickle.loads(row[0])
+        return self._mods[mod_id]
+
+    def save_mod(self, mod_id: tuple, mod: 'ModTemplate'):
+        self._mods[mod_id] = mod
+        self._pending_mods[mod_id] = mod
+
+        if (len(self._pending_mods) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending_mods:
+            return
+
+        pending_mods, self._pending_mods = self._pending_mods, dict()
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO item_mods (mod_id, mod) VALUES (?, ?)',
+                                         [(self._mod_key(mod_id), pickle.dumps(mod))
+                                          for mod_id, mod in pending_mods.items()])
+
+    def load(self, default: Any = None, missing_ok: bool = True) -> dict:
+        """
+        :return: Every cached mod template - {stored mod key: mod}
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute('SELECT mod_id, mod FROM item_mods').fetchall()
+
+        if not rows:
+            if not missing_ok:
+                raise ValueError(f"No mod templates are cached in {self._path}.")
+            return default
+
+        return {mod_id: pickle.loads(mod) for mod_id, mod in rows}
+
+
+class ListingIdIndexFile(PickleFile):
+
+    def __init__(self, path: Path = None):
+        super().__init__(path or Path.cwd() / 'file_management/dynamic_files/listing_id_index.pkl')
+
+    def load(self, default: Any = None, missing_ok: bool = True) -> dict:
+        return super().load(default=default, missing_ok=missing_ok)
+
+
+class BackfillPlanFile(PickleFile):
 
     def __init__(self, path: Path = None):
-        super().__init__(path or Path.cwd() / 'file_management/dynamic_files/item_mods.pkl')
+        super().__init__(path or Path.cwd() / 'file_management/dynamic_files/raw_listings_backfill_plan.pkl')
 
     def load(self, default: Any = None, missing_ok: bool = True) -> dict:
         return super().load(default=default, missing_ok=missing_ok)
@@ -134,6 +683,77 @@ class Poe2DbModsManagerFile(PickleFile):
     def load(self, default: Any = None, missing_ok: bool = True) -> 'Poe2DbModsManager':
         return super().load(default=default, missing_ok=missing_ok)
 
+    def content_hash(self) -> str:
+        """
+        :return: Hash of the file's contents - changes whenever Poe2Db is re-scraped
+        """
+        return hashlib.blake2b(self._path.read_bytes(), digest_size=16).hexdigest()
+
+
+class ModMatchCacheFile:
+    """
+    Results of ModMatcher.match_mod, keyed by what they depend on: the atype, the affix type and the sanitized sub-mod
+    texts. Stored in SQLite so that every worker process shares one cache.
+
+    Results are tagged with the version of the Poe2Db mods they were matched against, and results from any other
+    version are deleted on load - so a re-scrape invalidates the cache automatically.
+    """
+
+    def __init__(self, version: str, path: Path = None):
+        """
+        :param version: Ex: Poe2DbModsManagerFile.content_hash()
+        """
+        self._path = path or Path.cwd() / 'file_management/dynamic_files/mod_match_cache.sqlite'
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.version = version
+
+        self._connection = sqlite3.connect(str(self._path), timeout=60, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS mod_matches ('
+                'version TEXT, match_key TEXT, poe2db_mod_id TEXT, PRIMARY KEY (version, match_key))'
+            )
+            self._connection.execute('DELETE FROM mod_matches WHERE version != ?', (version,))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def match_key(atype: AType, affix_type, sub_mod_texts: list[str]) -> str:
+        return json.dumps([atype.value, affix_type.value if affix_type else None, sorted(sub_mod_texts)])
+
+    def load_matches(self, match_keys: list[str]) -> dict:
+        """
+        :return: {match key: poe2db mod id, or None if the mod was not matchable} for every cached key
+        """
+        matches = dict()
+        with self._lock:
+            # Chunked to stay under SQLite's bound parameter limit
+            for i in range(0, len(match_keys), 500):
+                chunk = match_keys[i:i + 500]
+                placeholders = ', '.join('?' for _ in chunk)
+                rows = self._connection.execute(
+                    f'SELECT match_key, poe2db_mod_id FROM mod_matches '
+                    f'WHERE version = ? AND match_key IN ({placeholders})',
+                    [self.version, *chunk]
+                ).fetchall()
+                matches.update({
+                    match_key: tuple(json.loads(poe2db_mod_id)) if poe2db_mod_id else None
+                    for match_key, poe2db_mod_id in rows
+                })
+
+        return matches
+
+    def save_matches(self, matches: dict):
+        """
+        :param matches: {match key: poe2db mod id, or None if the mod was not matchable}
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO mod_matches (version, match_key, poe2db_mod_id) VALUES (?, ?, ?)',
+                [(self.version, match_key, json.dumps(poe2db_mod_id) if poe2db_mod_id else None)
+                 for match_key, poe2db_mod_id in matches.items()]
+            )
+
 
 class PricePredictModelFiles:
 
@@ -0,0 +1,118 @@
+"""
+JSON encoding and decoding for every file and API path.
+
+orjson is used when it's installed and the stdlib json module otherwise. Both backends write the same compact UTF-8
+JSON. msgspec, when installed, validates the trade API responses against their full schema - without it only the
+top level keys are checked. Either way the decoded response is exactly what the API sent, keys the schema doesn't
+declare included, since fetched responses are archived as they are.
+"""
+import json
+from decimal import Decimal
+from typing import Any, NotRequired, TypedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+
+class SearchResponse(TypedDict):
+    """
+    Trade API search (POST) response.
+    """
+    id: str
+    result: list[str]
+    total: int
+    complexity: NotRequired[int]
+    inexact: NotRequired[bool]
+
+
+class FetchResult(TypedDict):
+    """
+    One listing of a trade API fetch (GET) response - what ApiResponseParser reads. The listing and item blocks are
+    decoded as plain dicts.
+    """
+    id: str
+    listing: dict[str, Any]
+    item: dict[str, Any]
+    gone: NotRequired[bool]
+
+
+class FetchResponse(TypedDict):
+    # Ids that no longer have a listing come back as null
+    result: list[FetchResult | None]
+
+
+def _default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumpb(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """
+    :param indent: Indent by 2 spaces
+    """
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=option)
+
+    return json.dumps(obj,
+                      default=_default,
+                      ensure_ascii=False,
+                      indent=2 if indent else None,
+                      separators=None if indent else (',', ':'),
+                      sort_keys=sort_keys).encode('utf-8')
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    return dumpb(obj, indent=indent, sort_keys=sort_keys).decode('utf-8')
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    :raises ValueError: If data isn't valid JSON
+    """
+    if orjson:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def _decode_typed(data: bytes | str, response_type: type) -> dict:
+    decoded = loads(data)
+
+    if msgspec:
+        # Only used to validate - msgspec drops the keys the schema doesn't declare from what it returns
+        msgspec.convert(decoded, response_type)
+    elif not isinstance(decoded, dict) or not response_type.__required_keys__ <= decoded.keys():
+        raise ValueError(f"Response doesn't match the {response_type.__name__} schema.")
+
+    return decoded
+
+
+def decode_search_response(data: bytes | str) -> SearchResponse:
+    """
+    :raises ValueError: If data isn't valid JSON or doesn't match the schema
+    """
+    return _decode_typed(data, SearchResponse)
+
+
+def decode_fetch_response(data: bytes | str) -> FetchResponse:
+    """
+    :raises ValueError: If data isn't valid JSON or doesn't match the schema
+    """
+    return _decode_typed(data, FetchResponse)
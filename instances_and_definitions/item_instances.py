@@ -7,18 +7,85 @@ from shared.enums.item_enums import ModAffixType, AType
 from shared.enums.trade_enums import ModClass, Rarity, Currency
 
 
+class _Frozen:
+    """
+    Base for template objects that are shared between every listing they appear in, and so must never be modified.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable.")
+
+    def _init_slots(self, **slot_values):
+        for name, value in slot_values.items():
+            object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        return self.__class__, tuple(getattr(self, name) for name in self.__slots__)
+
+
+class SubModTemplate(_Frozen):
+    __slots__ = ('sub_mod_hash', 'sanitized_text', 'values_ranges')
+
+    def __init__(self,
+                 sub_mod_hash: str,
+                 sanitized_text: str,
+                 values_ranges: tuple[tuple[float, float], ...] | tuple[tuple[int, int], ...] = None):
+        self._init_slots(sub_mod_hash=sub_mod_hash,
+                         sanitized_text=sanitized_text,
+                         values_ranges=tuple(tuple(value_range) for value_range in values_ranges)
+                         if values_ranges else ())
+
+
 class SubMod:
+    """
+    A sub-mod on a specific listing. Everything except its actual values is read from its shared SubModTemplate.
+    """
+    __slots__ = ('template', 'actual_values')
+
     def __init__(self,
                  sub_mod_hash: str,
                  sanitized_text: str,
                  actual_values: list = None,
                  values_ranges: list[tuple[float, float]] | list[tuple[int, int]] = None):
-        self.sub_mod_hash = sub_mod_hash
-        self.sanitized_text = sanitized_text
+        self.template = SubModTemplate(sub_mod_hash=sub_mod_hash,
+                                       sanitized_text=sanitized_text,
+                                       values_ranges=values_ranges)
 
         # When the ItemMod is stored as a template, its sub-mod values are empty
         self.actual_values = actual_values
-        self.values_ranges = values_ranges
+
+    @classmethod
+    def from_template(cls, template: SubModTemplate) -> 'SubMod':
+        sub_mod = cls.__new__(cls)
+        sub_mod.template = template
+        sub_mod.actual_values = None
+        return sub_mod
+
+    def __setstate__(self, state):
+        # Sub-mods pickled before SubMod had __slots__ hold all of their fields in a plain attribute dict
+        if isinstance(state, dict):
+            self.__init__(**state)
+            return
+
+        _, slot_state = state
+        for name, value in slot_state.items():
+            setattr(self, name, value)
+
+    @property
+    def sub_mod_hash(self) -> str:
+        return self.template.sub_mod_hash
+
+    @property
+    def sanitized_text(self) -> str:
+        return self.template.sanitized_text
+
+    @property
+    def values_ranges(self) -> tuple:
+        return self.template.values_ranges
 
 
 def generate_mod_id(mod_class: ModClass,
@@ -33,6 +100,8 @@ def generate_mod_id(mod_class: ModClass,
 
 
 class ItemMod:
+    __slots__ = ('atype', 'mod_class', 'mod_name', 'affix_type', 'mod_tier', 'mod_ilvl', 'sub_mods', 'mod_types',
+                 'weighting')
 
     def __init__(self,
                  atype: AType,
@@ -54,6 +123,14 @@ class ItemMod:
         self.mod_types = None
         self.weighting = None
 
+    def __setstate__(self, state):
+        # Mods pickled before ItemMod had __slots__ hold all of their fields in a plain attribute dict
+        if isinstance(state, tuple):
+            state = {**(state[0] or dict()), **state[1]}
+
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __eq__(self, other):
         if not isinstance(other, ItemMod):
             return False
@@ -86,6 +163,64 @@ class ItemMod:
         return self.sub_mods
 
 
+class ModTemplate(_Frozen):
+    """
+    Everything about a mod that is the same on every listing it rolls on. Cached once per mod id and shared by every
+    listing, so that each listing only allocates an ItemMod and its SubMods' actual values.
+    """
+    __slots__ = ('atype', 'mod_class', 'mod_name', 'affix_type', 'mod_tier', 'mod_ilvl', 'sub_mods', 'mod_types',
+                 'weighting')
+
+    def __init__(self,
+                 atype: AType,
+                 mod_class: ModClass,
+                 mod_name: str,
+                 affix_type: ModAffixType,
+                 mod_tier: int,
+                 mod_ilvl: int,
+                 sub_mods: tuple[SubModTemplate, ...],
+                 mod_types: tuple[str, ...] = None,
+                 weighting: float = None):
+        self._init_slots(atype=atype,
+                         mod_class=mod_class,
+                         mod_name=mod_name,
+                         affix_type=affix_type,
+                         mod_tier=mod_tier,
+                         mod_ilvl=mod_ilvl,
+                         sub_mods=tuple(sub_mods),
+                         mod_types=tuple(mod_types) if mod_types is not None else None,
+                         weighting=weighting)
+
+    @classmethod
+    def from_mod(cls, mod: ItemMod) -> 'ModTemplate':
+        return cls(atype=mod.atype,
+                   mod_class=mod.mod_class,
+                   mod_name=mod.mod_name,
+                   affix_type=mod.affix_type,
+                   mod_tier=mod.mod_tier,
+                   mod_ilvl=mod.mod_ilvl,
+                   sub_mods=tuple(sub_mod.template for sub_mod in mod.sub_mods),
+                   mod_types=mod.mod_types,
+                   weighting=mod.weighting)
+
+    def instantiate(self) -> ItemMod:
+        """
+        :return: A new ItemMod sharing this template's fields, with empty sub-mod values
+        """
+        mod = ItemMod.__new__(ItemMod)
+        mod.atype = self.atype
+        mod.mod_class = self.mod_class
+        mod.mod_name = self.mod_name
+        mod.affix_type = self.affix_type
+        mod.mod_tier = self.mod_tier
+        mod.mod_ilvl = self.mod_ilvl
+        # Template sub-mods are already sorted by hash
+        mod.sub_mods = [SubMod.from_template(sub_mod_template) for sub_mod_template in self.sub_mods]
+        mod.mod_types = self.mod_types
+        mod.weighting = self.weighting
+        return mod
+
+
 class ItemSkill:
 
     def __init__(self,
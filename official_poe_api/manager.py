@@ -3,6 +3,7 @@ from urllib.parse import urljoin
 
 import requests
 
+from file_management import json_codec
 from program_logging import LogsHandler, LogFile
 from shared import shared_utils
 
@@ -37,7 +38,7 @@ class OfficialApiPuller:
         response.raise_for_status()
         api_log.info("\tSuccessfully loaded stat modifiers from PoE API.")
 
-        json_data = response.json()
+        json_data = json_codec.loads(response.content)
         return json_data
 
     def _verify_endpoint(self, endpoint: str):
@@ -0,0 +1,222 @@
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator
+
+from data_handling import ListingBuilder, ApiResponseParser
+from data_transforming import ListingsTransforming
+from program_logging import LogsHandler, LogFile
+
+overview_log = LogsHandler().fetch_log(LogFile.PROGRAM_OVERVIEW)
+
+# Each worker process builds its own ListingBuilder, since its file caches hold SQLite connections that can't be
+# shared across a fork
+_worker_listing_builder = None
+
+
+def _init_worker():
+    global _worker_listing_builder
+    _worker_listing_builder = ListingBuilder()
+
+
+def _build_page(responses: list[dict]) -> tuple[dict, list[tuple[str, str]]]:
+    """
+    The CPU stages of the pipeline: parse -> build -> flatten.
+
+    :return: The page's flattened rows, and (my_id, listing string) for each listing
+    """
+    parsers = [ApiResponseParser(response) for response in responses]
+    listings = _worker_listing_builder.build_listings(parsers)
+
+    # Worker processes don't run atexit handlers, so new mod templates are written out after every page
+    _worker_listing_builder.flush()
+
+    listing_strings = [(listing.my_id, str(listing)) for listing in listings]
+    return ListingsTransforming.to_flat_rows(listings), listing_strings
+
+
+class _InlineExecutor:
+    """
+    Runs pages in the calling process - used when the pipeline is given a single process.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    @staticmethod
+    def submit(func, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class _FetchFailed:
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+_FETCH_DONE = object()
+
+
+def _create_build_executor(processes: int, listing_builder: ListingBuilder = None):
+    """
+    :param processes: With 1, pages are built in this process with listing_builder
+    """
+    global _worker_listing_builder
+
+    if processes == 1:
+        _worker_listing_builder = listing_builder or ListingBuilder()
+        return _InlineExecutor()
+
+    # Fork so that scripts without a __main__ guard aren't re-run by the workers
+    return ProcessPoolExecutor(max_workers=processes,
+                               mp_context=multiprocessing.get_context('fork'),
+                               initializer=_init_worker)
+
+
+class ListingBuildPipeline:
+    """
+    Staged listing pipeline: fetch -> parse -> build -> flatten -> insert.
+
+    Pages of API responses are pulled from the fetch iterator on a background thread while a process pool parses,
+    builds and flattens the pages that were already fetched. The caller inserts each finished page as it's yielded.
+    The queue between the stages is bounded, so a slow stage holds back the ones before it instead of letting pages
+    pile up in memory.
+    """
+
+    def __init__(self,
+                 processes: int = None,
+                 max_pending_pages: int = None,
+                 ordered: bool = True,
+                 listing_builder: ListingBuilder = None):
+        """
+        :param processes: Number of worker processes for the CPU stages. Defaults to the number of cores. With 1,
+            the pages are built in this process with listing_builder
+        :param max_pending_pages: Maximum number of pages fetched or being built that haven't been yielded yet
+        :param ordered: Yield pages in the order they were fetched. Otherwise pages are yielded as soon as they're built
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_pending_pages = max_pending_pages or self.processes * 2
+        self.ordered = ordered
+
+        self._listing_builder = listing_builder
+
+    def _create_executor(self):
+        return _create_build_executor(processes=self.processes, listing_builder=self._listing_builder)
+
+    @staticmethod
+    def _put_page(page_queue: queue.Queue, item, stop_event: threading.Event) -> bool:
+        """
+        :return: False if the pipeline stopped before there was room for the item
+        """
+        while not stop_event.is_set():
+            try:
+                page_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    @classmethod
+    def _feed_pages(cls, pages: Iterable[list[dict]], page_queue: queue.Queue, stop_event: threading.Event):
+        try:
+            for page in pages:
+                if stop_event.is_set():
+                    return
+
+                if page and not cls._put_page(page_queue, page, stop_event):
+                    return
+        except Exception as e:
+            cls._put_page(page_queue, _FetchFailed(e), stop_event)
+            return
+
+        cls._put_page(page_queue, _FETCH_DONE, stop_event)
+
+    @staticmethod
+    def _drain(page_queue: queue.Queue):
+        while True:
+            try:
+                page_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _finished_pages(self, pending: deque, block: bool) -> Iterator[tuple[dict, list]]:
+        if not pending:
+            return
+
+        if self.ordered:
+            if block:
+                pending[0].result()
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+            return
+
+        done = [future for future in pending if future.done()]
+        if not done and block:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            pending.remove(future)
+            yield future.result()
+
+    def run(self, pages: Iterable[list[dict]]) -> Iterator[tuple[dict, list]]:
+        """
+        :param pages: Pages of raw API responses. Iterated on a background thread, so any state it touches should
+            only be touched by it
+        :return: For each page: its flattened rows, and (my_id, listing string) for each of its listings
+        """
+        page_queue = queue.Queue(maxsize=self.max_pending_pages)
+        stop_event = threading.Event()
+
+        with self._create_executor() as executor:
+            if isinstance(executor, ProcessPoolExecutor):
+                # Start the forked workers before the fetch thread exists - forking a process with threads is unsafe
+                executor.submit(int).result()
+
+            fetch_thread = threading.Thread(target=self._feed_pages,
+                                            args=(pages, page_queue, stop_event),
+                                            daemon=True)
+            fetch_thread.start()
+
+            pending = deque()
+            try:
+                while True:
+                    try:
+                        page = page_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        yield from self._finished_pages(pending, block=False)
+                        continue
+
+                    if page is _FETCH_DONE:
+                        break
+
+                    if isinstance(page, _FetchFailed):
+                        raise page.error
+
+                    pending.append(executor.submit(_build_page, page))
+                    overview_log.info(f"Submitted a page of {len(page)} responses. {len(pending)} pages pending.")
+
+                    yield from self._finished_pages(pending, block=len(pending) >= self.max_pending_pages)
+
+                while pending:
+                    yield from self._finished_pages(pending, block=True)
+
+                fetch_thread.join()
+            finally:
+                # Only does anything if a stage failed or the caller stopped iterating early. The fetch thread stops at
+                # its next page instead of blocking on the full queue, and the executor doesn't build pages nobody
+                # will read
+                stop_event.set()
+                for future in pending:
+                    future.cancel()
+                self._drain(page_queue)
@@ -8,8 +8,9 @@ import psql
 import trade_api
 from core import env_loading
 from data_handling import ListingBuilder, ApiResponseParser
-from data_transforming import ListingsTransforming
-from file_management.file_managers import RawListingsFile, ListingStringsFile
+from file_management.file_managers import RawListingsArchive
+from operations_coordination.listing_pipeline import ListingBuildPipeline
+from operations_coordination.raw_listings_backfill import RawListingsBackfill
 from program_logging import LogsHandler, LogFile
 from trade_api.listing_gatekeeper import ListingImportGatekeeper
 from trade_api.query import QueryPresets
@@ -27,48 +28,88 @@ class TrainingDataPopulator:
 
     def __init__(self,
                  listing_builder: ListingBuilder,
-                 psql_manager: psql.PostgreSqlManager):
-        self.trade_api_handler = trade_api.TradeApiHandler()
+                 psql_manager: psql.PostgreSqlManager,
+                 trade_api_handler: trade_api.TradeApiHandler = None,
+                 processes: int = None,
+                 ordered: bool = True):
+        """
+        :param processes: Number of processes building listings while fetching. Defaults to the number of cores
+        :param ordered: Insert fetched pages in the order they were fetched
+        """
+        self.trade_api_handler = trade_api_handler or trade_api.TradeApiHandler()
         self.psql_manager = psql_manager
 
         self.listing_builder = listing_builder
-
-        self._listing_gatekeeper = ListingImportGatekeeper(psql_manager=self.psql_manager)
-        self._raw_listings_file = RawListingsFile()
+        self._pipeline = ListingBuildPipeline(processes=processes, ordered=ordered, listing_builder=listing_builder)
 
         self.env_loader = env_loading.EnvLoader()
 
-    def _process_and_insert(self, responses: list[ApiResponseParser]):
-        listings = [self.listing_builder.build_listing(api_r) for api_r in responses]
-
-        for listing in listings:
-            self.psql_manager.insert_listing_string(table_name='listing_strings',
-                                                    my_id=listing.my_id,
-                                                    listing_str=str(listing)
-                                                    )
-
-        overview_log.info(f"Inserted {len(listings)} listing strings into Psql.")
-
-        row_data = ListingsTransforming.to_flat_rows(listings)
-        self.psql_manager.insert_listing(
-            table_name=self.env_loader.get_env("PSQL_TRAINING_TABLE"),
-            data=row_data
-        )
+        # Set LISTING_STORAGE to 'long' to store mods as (listing, mod column, value) rows instead of one column each
+        wide_table = self.env_loader.get_env("PSQL_TRAINING_TABLE") or 'listings'
+        if self.env_loader.get_env("LISTING_STORAGE") == 'long':
+            self._listings_writer = psql.LongFormatListingStore(psql_manager=self.psql_manager,
+                                                                wide_table=wide_table)
+            self._listings_table = self._listings_writer.metadata_table
+        else:
+            self._listings_table = wide_table
+            self._listings_writer = psql.BatchedListingWriter(psql_manager=self.psql_manager,
+                                                              table_name=self._listings_table)
+
+        self._listing_gatekeeper = ListingImportGatekeeper(psql_manager=self.psql_manager,
+                                                           table_name=self._listings_table)
+        self.trade_api_handler.use_listing_gatekeeper(self._listing_gatekeeper)
+        self._raw_listings_archive = RawListingsArchive()
+
+    def _insert_page(self, row_data: dict, listing_strings: list[tuple[str, str]]):
+        self.psql_manager.insert_listing_strings(table_name='listing_strings', listing_strings=listing_strings)
+        self._listings_writer.add_rows(row_data)
+
+        # The listing strings are already committed, so their rows go in with them rather than waiting in the buffer
+        rows_written = self._listings_writer.flush()
+        overview_log.info(f"Inserted {len(listing_strings)} listing strings and {rows_written} listing rows into Psql.")
+
+    def fill_training_data_from_listings_file(self,
+                                              raw_listings_file: 'RawListingsFile | RawListingsArchive' = None,
+                                              resume: bool = False,
+                                              shards: int = None) -> int:
+        """
+        :param raw_listings_file: Defaults to the RawListingsArchive that fetched responses are saved to
+        :param resume: Continue from the last backfill checkpoint instead of the beginning of the file
+        :param shards: Number of offset ranges the file is split into. Defaults to 4 per process
+        :return: The number of listings inserted
+        """
+        # The file holds listings from long before the refetch window, so the full id history is needed
+        listing_gatekeeper = ListingImportGatekeeper(psql_manager=self.psql_manager,
+                                                     window_only=False,
+                                                     table_name=self._listings_table)
+
+        backfill = RawListingsBackfill(psql_manager=self.psql_manager,
+                                       listings_writer=self._listings_writer,
+                                       listing_gatekeeper=listing_gatekeeper,
+                                       raw_listings_file=raw_listings_file or self._raw_listings_archive,
+                                       processes=self._pipeline.processes,
+                                       shards=shards,
+                                       listing_builder=self.listing_builder)
+        return backfill.run(resume=resume)
+
+    def _fetch_valid_pages(self, training_queries: list) -> 'Iterator[list[dict]]':
+        """
+        The fetch stage of the pipeline - runs on its own thread, and is the only user of the gatekeeper while running.
+        """
+        for responses in self.trade_api_handler.fetch_responses(training_queries):
+            self._raw_listings_archive.save(responses)
 
-    def fill_training_data_from_listings_file(self, raw_listings_file: RawListingsFile):
-        all_responses = 0
-        valid_responses = 0
-        for response in raw_listings_file.load():
-            all_responses += 1
-            parser = ApiResponseParser(response)
-            if not self._listing_gatekeeper.listing_is_valid(listing_id=parser.listing_id,
-                                                             date_fetched=parser.date_fetched):
-                continue
+            valid_responses = []
+            for response in responses:
+                rp = ApiResponseParser(response)
+                if self._listing_gatekeeper.listing_is_valid(listing_id=rp.listing_id, date_fetched=rp.date_fetched):
+                    valid_responses.append(response)
 
-            valid_responses += 1
-            self._process_and_insert(responses=[parser])
+            _log_memory_usage()
+            print(f"{len(valid_responses)} valid API responses out of {len(responses)} total API responses. "
+                  f"Processing and inserting into PSQL.")
 
-            overview_log.info(f"JsonL Insert\nValid responses: {valid_responses}\nAll responses: {all_responses}")
+            yield valid_responses
 
     def fill_training_data(self):
         program_start = datetime.datetime.now()
@@ -77,20 +118,12 @@ class TrainingDataPopulator:
         random.shuffle(training_queries)
 
         responses_fetched = 0
-        for responses in self.trade_api_handler.fetch_responses(training_queries):
-            self._raw_listings_file.save(responses)
-
-            parsers = [ApiResponseParser(response) for response in responses]
-            valid_parsers = [rp for rp in parsers
-                             if self._listing_gatekeeper.listing_is_valid(listing_id=rp.listing_id,
-                                                                          date_fetched=rp.date_fetched)]
-
-            _log_memory_usage()
-            responses_fetched += len(valid_parsers)
-            print(f"{len(valid_parsers)} valid API responses out of {len(parsers)} total API responses. "
-                  f"Processing and inserting into PSQL.")
+        for row_data, listing_strings in self._pipeline.run(self._fetch_valid_pages(training_queries)):
+            responses_fetched += len(listing_strings)
+            self._insert_page(row_data=row_data, listing_strings=listing_strings)
 
-            self._process_and_insert(valid_parsers)
+        self._listings_writer.flush()
+        self._listing_gatekeeper.save_snapshot()
 
         print(f"fill_training_data fetched {responses_fetched} in "
               f"{(datetime.datetime.now() - program_start).seconds / 60} minutes.")
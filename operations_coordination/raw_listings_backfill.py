@@ -0,0 +1,273 @@
+import multiprocessing
+import time
+import uuid
+from array import array
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+import psql
+from data_handling import ListingBuilder
+from file_management.file_managers import (RawListingsFile, RawListingsArchive, BackfillCheckpointFile,
+                                           BackfillPlanFile)
+from operations_coordination.listing_pipeline import _build_page, _create_build_executor
+from program_logging import LogsHandler, LogFile
+from shared import shared_utils
+from trade_api.listing_gatekeeper import ListingImportGatekeeper
+
+overview_log = LogsHandler().fetch_log(LogFile.PROGRAM_OVERVIEW)
+
+
+def _scan_shard(raw_listings_file: 'RawListingsFile | RawListingsArchive',
+                start: int,
+                end: int) -> tuple[array, list[str], array]:
+    """
+    :return: The offset, listing id and fetch epoch of every response in [start, end)
+    """
+    offsets = array('q')
+    listing_ids = []
+    fetch_epochs = array('q')
+
+    # Only the id and fetch date are needed to gate a response, so it isn't run through ApiResponseParser here
+    for offset, response in raw_listings_file.load_range(start, end):
+        offsets.append(offset)
+        listing_ids.append(response['id'])
+        fetch_epochs.append(int(shared_utils.format_date_into_utc(response['listing']['indexed']).timestamp()))
+
+    return offsets, listing_ids, fetch_epochs
+
+
+def _build_chunk(raw_listings_file: 'RawListingsFile | RawListingsArchive',
+                 offsets: list[int]) -> tuple[dict, list[tuple[str, str]]]:
+    return _build_page(raw_listings_file.load_at(offsets))
+
+
+class _Shard:
+
+    def __init__(self, start: int, end: int, next_offset: int = None):
+        """
+        :param next_offset: Every response before this offset has been inserted
+        """
+        self.start = start
+        self.end = end
+        self.next_offset = start if next_offset is None else next_offset
+
+        # Offsets of the shard's responses that passed the gatekeeper. None until the shard has been gated
+        self.valid_offsets = None
+
+        # (offsets, end offset) of the chunks left to build. Only one chunk of a shard is built at a time, so that
+        # next_offset never moves past a chunk that isn't inserted yet
+        self.chunks = deque()
+
+    @property
+    def is_done(self) -> bool:
+        return self.next_offset >= self.end
+
+    def to_dict(self) -> dict:
+        return {'start': self.start, 'end': self.end, 'next_offset': self.next_offset}
+
+
+class RawListingsBackfill:
+    """
+    Imports the RawListingsArchive (or a legacy RawListingsFile) into Psql across a process pool.
+
+    The file is split by offset into shards - byte offsets of a RawListingsFile, record positions of the archive. The
+    workers first scan each shard for the id and fetch date of its responses, which this process runs through the
+    gatekeeper in file order. The valid responses are then built in chunks by the workers, and each finished chunk is
+    copied into Psql in one batch.
+
+    After each chunk is written, the offset up to which every response of its shard is in Psql is saved to the
+    checkpoint file, so an interrupted backfill can be resumed without reprocessing the whole file. The gatekeeper's
+    decisions are saved to the plan file and reused on resume - by then Psql holds later fetches from the other shards,
+    which would make the gatekeeper reject the earlier fetches that are left. Both files carry the id of the backfill
+    run that wrote them, so a plan left behind by an earlier run is never applied to a resumed one.
+    """
+
+    def __init__(self,
+                 psql_manager: psql.PostgreSqlManager,
+                 listings_writer: 'psql.BatchedListingWriter | psql.LongFormatListingStore',
+                 listing_gatekeeper: ListingImportGatekeeper,
+                 raw_listings_file: 'RawListingsFile | RawListingsArchive' = None,
+                 checkpoint_file: BackfillCheckpointFile = None,
+                 plan_file: BackfillPlanFile = None,
+                 processes: int = None,
+                 shards: int = None,
+                 chunk_size: int = 2000,
+                 listing_builder: ListingBuilder = None):
+        """
+        :param listing_gatekeeper: Should hold the full listing id history (window_only=False)
+        :param processes: Number of worker processes. Defaults to the number of cores. With 1, everything runs in this
+            process with listing_builder
+        :param raw_listings_file: Defaults to the RawListingsArchive
+        :param shards: Number of offset ranges the file is split into. Defaults to 4 per process
+        :param chunk_size: Number of valid responses built and written per batch
+        """
+        self.psql_manager = psql_manager
+        self._listings_writer = listings_writer
+        self._listing_gatekeeper = listing_gatekeeper
+
+        self.raw_listings_file = raw_listings_file or RawListingsArchive()
+        self.checkpoint_file = checkpoint_file or BackfillCheckpointFile()
+        self.plan_file = plan_file or BackfillPlanFile()
+
+        self.processes = processes or multiprocessing.cpu_count()
+        self.n_shards = shards or self.processes * 4
+        self.chunk_size = chunk_size
+
+        self._listing_builder = listing_builder
+
+        # Set by _load_shards - a new id for a fresh run, the checkpoint's id when resuming
+        self._run_id = None
+
+    def _load_shards(self, resume: bool) -> list[_Shard]:
+        file_size = self.raw_listings_file.size()
+        checkpoint = self.checkpoint_file.load(default={}) if resume and self.checkpoint_file.exists() else None
+
+        if checkpoint and checkpoint.get('path') != str(self.raw_listings_file.path):
+            overview_log.warning(f"Backfill checkpoint is for {checkpoint.get('path')}, not "
+                                 f"{self.raw_listings_file.path}. Starting from the beginning of the file.")
+            checkpoint = None
+
+        if not checkpoint:
+            self._run_id = uuid.uuid4().hex
+            return [_Shard(start, end) for start, end in self.raw_listings_file.shard_ranges(self.n_shards)]
+
+        self._run_id = checkpoint.get('run_id') or uuid.uuid4().hex
+        shards = [_Shard(**shard) for shard in checkpoint['shards']]
+
+        # The run can stop before its plan is saved, and the plan file would then still hold an earlier run's plan
+        plan = self.plan_file.load(default={})
+        if plan.get('run_id') == self._run_id:
+            for shard in shards:
+                shard.valid_offsets = plan['valid_offsets'].get(shard.start)
+
+        # The file is append-only, so anything past the last checkpointed shard was saved after the checkpoint
+        covered_until = max((shard.end for shard in shards), default=0)
+        if file_size > covered_until:
+            shards += [_Shard(start, end)
+                       for start, end in self.raw_listings_file.shard_ranges(self.n_shards, start=covered_until)]
+
+        overview_log.info(f"Resuming backfill with {sum(not shard.is_done for shard in shards)} of {len(shards)} "
+                          f"shards left.")
+        return shards
+
+    def _save_checkpoint(self, shards: list[_Shard]):
+        self.checkpoint_file.save(data={
+            'run_id': self._run_id,
+            'path': str(self.raw_listings_file.path),
+            'shards': [shard.to_dict() for shard in shards]
+        })
+
+    def _save_plan(self, shards: list[_Shard]):
+        self.plan_file.save(data={
+            'run_id': self._run_id,
+            'path': str(self.raw_listings_file.path),
+            'valid_offsets': {shard.start: shard.valid_offsets for shard in shards if shard.valid_offsets is not None}
+        })
+
+    def _gate_shard(self, shard: _Shard, scan: tuple[array, list[str], array]) -> list[int]:
+        """
+        :return: Offsets of the shard's responses that still have to be inserted
+        """
+        offsets, listing_ids, fetch_epochs = scan
+
+        if shard.valid_offsets is not None:
+            # Already gated by the run that is being resumed - only the gatekeeper's index has to catch up
+            planned_offsets = set(shard.valid_offsets)
+            for listing_id, fetch_epoch in zip(listing_ids, fetch_epochs):
+                self._listing_gatekeeper.record_fetch(listing_id=listing_id,
+                                                      date_fetched=datetime.fromtimestamp(fetch_epoch, tz=timezone.utc))
+            return [offset for offset in offsets if offset in planned_offsets]
+
+        valid_offsets = []
+        for offset, listing_id, fetch_epoch in zip(offsets, listing_ids, fetch_epochs):
+            date_fetched = datetime.fromtimestamp(fetch_epoch, tz=timezone.utc)
+            if self._listing_gatekeeper.listing_is_valid(listing_id=listing_id, date_fetched=date_fetched):
+                valid_offsets.append(offset)
+
+        shard.valid_offsets = array('q', valid_offsets)
+        return valid_offsets
+
+    def _split_into_chunks(self, shard: _Shard, valid_offsets: list[int]) -> list[tuple[list[int], int]]:
+        """
+        :return: (offsets, end offset) of each chunk. A chunk ends where the next one starts, or at the end of the shard
+        """
+        chunk_offsets = [valid_offsets[i:i + self.chunk_size] for i in range(0, len(valid_offsets), self.chunk_size)]
+        chunk_ends = [offsets[0] for offsets in chunk_offsets[1:]] + [shard.end]
+        return list(zip(chunk_offsets, chunk_ends))
+
+    def _insert_chunk(self, row_data: dict, listing_strings: list[tuple[str, str]]):
+        self.psql_manager.insert_listing_strings(table_name='listing_strings', listing_strings=listing_strings)
+        self._listings_writer.add_rows(row_data)
+
+        # The checkpoint can only move past rows that are in Psql
+        self._listings_writer.flush()
+
+    def run(self, resume: bool = False) -> int:
+        """
+        :param resume: Continue from the checkpoint file instead of the beginning of the raw listings file
+        :return: The number of listings inserted
+        """
+        start_time = time.perf_counter()
+
+        shards = self._load_shards(resume)
+        self._save_checkpoint(shards)
+        open_shards = [shard for shard in shards if not shard.is_done]
+
+        responses_scanned = 0
+        listings_inserted = 0
+
+        with _create_build_executor(processes=self.processes, listing_builder=self._listing_builder) as executor:
+            # Scan every shard in parallel, but gate them in file order - the gatekeeper compares each fetch with the
+            # latest fetch it has seen of the listing
+            scan_futures = [executor.submit(_scan_shard, self.raw_listings_file, shard.next_offset, shard.end) for shard in open_shards]
+
+            for shard, scan_future in zip(open_shards, scan_futures):
+                scan = scan_future.result()
+                responses_scanned += len(scan[0])
+
+                shard.chunks.extend(self._split_into_chunks(shard, self._gate_shard(shard, scan)))
+                if not shard.chunks:
+                    shard.next_offset = shard.end
+
+            self._save_plan(shards)
+            self._save_checkpoint(shards)
+
+            valid_responses = sum(len(offsets) for shard in open_shards for offsets, _ in shard.chunks)
+            overview_log.info(f"Scanned {responses_scanned} responses in {time.perf_counter() - start_time:.1f}s. "
+                              f"{valid_responses} are valid.")
+
+            # Shards take turns, so that every shard's checkpoint moves forward
+            ready_shards = deque(shard for shard in open_shards if shard.chunks)
+            pending = dict()
+            max_pending = self.processes * 2
+
+            while ready_shards or pending:
+                while ready_shards and len(pending) < max_pending:
+                    shard = ready_shards.popleft()
+                    offsets, chunk_end = shard.chunks.popleft()
+                    pending[executor.submit(_build_chunk, self.raw_listings_file, offsets)] = (shard, chunk_end)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard, chunk_end = pending.pop(future)
+                    row_data, listing_strings = future.result()
+
+                    self._insert_chunk(row_data=row_data, listing_strings=listing_strings)
+                    shard.next_offset = chunk_end
+                    self._save_checkpoint(shards)
+                    listings_inserted += len(listing_strings)
+
+                    if shard.chunks:
+                        ready_shards.append(shard)
+
+                elapsed = time.perf_counter() - start_time
+                overview_log.info(f"Backfilled {listings_inserted} of {valid_responses} listings "
+                                  f"({listings_inserted / elapsed:.1f} listings/s).")
+
+        self._listing_gatekeeper.save_snapshot()
+
+        elapsed = time.perf_counter() - start_time
+        print(f"Backfill inserted {listings_inserted} listings out of {responses_scanned} responses in {elapsed:.1f}s "
+              f"({listings_inserted / elapsed if elapsed else 0:.1f} listings/s).")
+
+        return listings_inserted
@@ -1,11 +1,12 @@
 
-import json
 import re
 from enum import Enum
 from urllib.parse import urljoin
 
 import requests
 
+from file_management import json_codec
+
 
 def _normalize_data(bases_data: dict):
     bases_data['base'] = {
@@ -79,7 +80,7 @@ class PoecdDataPuller:
 
         content = response.content.decode('utf-8')
         content = re.sub(r'^[^{]*', '', content)
-        json_data = json.loads(content)
+        json_data = json_codec.loads(content)
 
         if endpoint == PoecdEndpoint.BASES:
             _normalize_data(json_data)
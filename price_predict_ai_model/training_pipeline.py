@@ -5,9 +5,10 @@ from sklearn.metrics import mean_squared_error
 from sklearn.model_selection import train_test_split
 
 from data_transforming import ListingsTransforming
+from core.env_loading import EnvLoader
 from file_management.file_managers import PricePredictModelFiles, PricePredictCacheFile, PricePredictPerformanceFile
 from program_logging import LogFile, LogsHandler
-from psql import PostgreSqlManager
+from psql import PostgreSqlManager, LongFormatListingStore
 from price_predict_ai_model.dataframe_prep import DataFramePrep
 from .stats_prep import StatsPrep
 from .utils import ModelLifeCycle
@@ -28,7 +29,10 @@ class PricePredictModelPipeline:
 
         self._model_lifecycles = []
 
-    def _load_training_data(self, from_cache: bool) -> pd.DataFrame:
+    def _load_training_data(self, from_cache: bool, atypes: list[str] = None) -> pd.DataFrame:
+        """
+        :param atypes: Only load the listings of these atype values. Defaults to every atype
+        """
         training_cache = PricePredictCacheFile()
         model_df = None
         if from_cache:
@@ -36,15 +40,22 @@ class PricePredictModelPipeline:
 
             if model_df is None:
                 print("Raw training cache data is missing / empty.")
+            elif atypes:
+                model_df = model_df[model_df['atype'].isin(atypes)]
 
         if model_df is None:
             print("Fetching PSQL table data.")
-            raw_data = self._psql_manager.fetch_table_data(table_name='listings')
+            if EnvLoader().get_env("LISTING_STORAGE") == 'long':
+                raw_data = LongFormatListingStore(psql_manager=self._psql_manager).fetch_wide_df(atypes=atypes)
+            else:
+                raw_data = self._psql_manager.fetch_table_data(table_name='listings', atypes=atypes)
 
             print("Converting PSQL table to PricePredict DataFrame.")
             model_df = ListingsTransforming.to_price_predict_df(rows=raw_data)
 
-            training_cache.save(model_df)
+            # The cache is meant to hold every atype
+            if not atypes:
+                training_cache.save(model_df)
 
         return model_df
 
@@ -79,8 +90,12 @@ class PricePredictModelPipeline:
         return pd.DataFrame(cols)
 
     def run(self,
-            load_model_from_cache: bool = False):
-        model_df = self._load_training_data(from_cache=load_model_from_cache)
+            load_model_from_cache: bool = False,
+            atypes: list[str] = None):
+        """
+        :param atypes: Only train models for these atype values. Defaults to every atype
+        """
+        model_df = self._load_training_data(from_cache=load_model_from_cache, atypes=atypes)
         model_df['days_since_league_start'] = (model_df['minutes_since_league_start'] / (60 * 24)).astype(int)
 
         stratified_dfs = self._stratify_dataframe(model_df)
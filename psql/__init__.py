@@ -1 +1,3 @@
 from .manager import PostgreSqlManager
+from .batch_writer import BatchedListingWriter
+from .long_format_store import LongFormatListingStore
@@ -0,0 +1,112 @@
+import csv
+import io
+
+from program_logging import LogsHandler, LogFile
+from . import utils
+from .manager import PostgreSqlManager
+
+psql_log = LogsHandler().fetch_log(LogFile.PSQL)
+
+# Marks NULL values in the COPY stream, since an unquoted empty CSV field can't be told apart from an empty string
+_COPY_NULL = '\\N'
+
+
+class BatchedListingWriter:
+    """
+    Buffers flattened listing rows (the output of ListingsTransforming.to_flat_rows) and writes them to Psql in
+    batches with COPY FROM STDIN, which is far faster than parameterized INSERTs for large backfills.
+
+    Use as a context manager, or call flush() when done, so that the last partial batch is written.
+    """
+
+    def __init__(self, psql_manager: PostgreSqlManager, table_name: str, batch_size: int = 5000):
+        self._psql_manager = psql_manager
+        self.table_name = table_name
+        self.batch_size = batch_size
+
+        # {column: [values]} - every list is the same length
+        self._buffer = dict()
+        self._buffered_rows = 0
+
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not exc_type:
+            self.flush()
+
+    def add_rows(self, data: dict):
+        """
+        :param data: {column name: column values}, as produced by ListingsTransforming.to_flat_rows
+        """
+        if self._psql_manager.skip_sql or not data:
+            return
+
+        data = self._psql_manager.shorten_column_names(table_name=self.table_name, data=data)
+        utils.validate_dict_lists(data)
+
+        n_new_rows = len(next(iter(data.values())))
+
+        for col in data:
+            if col not in self._buffer:
+                self._buffer[col] = [None] * self._buffered_rows
+
+        for col, values in self._buffer.items():
+            values.extend(data[col] if col in data else [None] * n_new_rows)
+
+        self._buffered_rows += n_new_rows
+
+        if self._buffered_rows >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def _format_copy_value(value):
+        return _COPY_NULL if value is None else value
+
+    def _write_csv(self, columns: list[str]) -> io.StringIO:
+        csv_buffer = io.StringIO()
+        writer = csv.writer(csv_buffer)
+        for row in zip(*(self._buffer[col] for col in columns)):
+            writer.writerow([self._format_copy_value(value) for value in row])
+
+        csv_buffer.seek(0)
+        return csv_buffer
+
+    def flush(self) -> int:
+        """
+        :return: The number of rows written
+        """
+        if not self._buffered_rows:
+            return 0
+
+        # The manager caches the table's columns, so this only hits the database when the batch has new columns
+        self._psql_manager.add_missing_columns(table_name=self.table_name, new_data=self._buffer)
+
+        columns = list(self._buffer.keys())
+        csv_buffer = self._write_csv(columns)
+
+        quoted_columns = ', '.join(f'"{col}"' for col in columns)
+        copy_stmt = (f'COPY {self.table_name} ({quoted_columns}) '
+                     f"FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')")
+
+        raw_connection = self._psql_manager.engine.raw_connection()
+        try:
+            with raw_connection.cursor() as cursor:
+                cursor.copy_expert(copy_stmt, csv_buffer)
+                rows_copied = cursor.rowcount
+            raw_connection.commit()
+        except Exception:
+            raw_connection.rollback()
+            raise
+        finally:
+            raw_connection.close()
+
+        self.rows_written += rows_copied
+        psql_log.info(f"Copied {rows_copied} rows into '{self.table_name}' ({self.rows_written} total).")
+
+        self._buffer = dict()
+        self._buffered_rows = 0
+
+        return rows_copied
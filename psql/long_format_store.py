@@ -0,0 +1,173 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from program_logging import LogsHandler, LogFile
+from .batch_writer import BatchedListingWriter
+from .manager import PostgreSqlManager
+
+psql_log = LogsHandler().fetch_log(LogFile.PSQL)
+
+
+class LongFormatListingStore:
+    """
+    Alternative to the wide listings table. Every non-mod column of a flattened listing row goes into the metadata
+    table, and each mod value is stored as a (my_id, mod column, value) triple in the mods table. Listings only have
+    a handful of the hundreds of possible mods, so this skips storing and transferring all of the NULL mod columns.
+
+    Has the same add_rows / flush interface as BatchedListingWriter.
+    """
+
+    mod_column_prefix = 'mod_'
+
+    def __init__(self,
+                 psql_manager: PostgreSqlManager,
+                 metadata_table: str = 'listing_metadata',
+                 mods_table: str = 'listing_mods',
+                 wide_table: str = 'listings',
+                 batch_size: int = 5000):
+        """
+        :param wide_table: The wide listings table whose column names are used - mods that are too long for a Psql
+            column name get the same shortened name in both storages
+        """
+        self._psql_manager = psql_manager
+        self.metadata_table = metadata_table
+        self.mods_table = mods_table
+        self.wide_table = wide_table
+
+        self._metadata_writer = BatchedListingWriter(psql_manager=psql_manager,
+                                                     table_name=metadata_table,
+                                                     batch_size=batch_size)
+        self._mods_writer = BatchedListingWriter(psql_manager=psql_manager,
+                                                 table_name=mods_table,
+                                                 batch_size=batch_size)
+
+        if not psql_manager.skip_sql:
+            self._create_tables()
+
+    def _create_tables(self):
+        # The metadata table gains the rest of its columns as they show up, just like the wide listings table
+        with self._psql_manager.engine.begin() as conn:
+            conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS {self.metadata_table} ('
+                'my_id TEXT, listing_id TEXT, date_fetched TIMESTAMP, atype TEXT)'
+            ))
+            conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS {self.mods_table} ('
+                'my_id TEXT NOT NULL, mod_column TEXT NOT NULL, value DOUBLE PRECISION)'
+            ))
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {self.metadata_table}_atype_idx ON {self.metadata_table} (atype)'
+            ))
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {self.metadata_table}_date_fetched_idx '
+                f'ON {self.metadata_table} (date_fetched)'
+            ))
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {self.metadata_table}_my_id_idx ON {self.metadata_table} (my_id)'
+            ))
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {self.mods_table}_my_id_idx ON {self.mods_table} (my_id)'
+            ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not exc_type:
+            self.flush()
+
+    @property
+    def rows_written(self) -> int:
+        return self._metadata_writer.rows_written
+
+    def add_rows(self, data: dict):
+        """
+        :param data: {column name: column values}, as produced by ListingsTransforming.to_flat_rows
+        """
+        if self._psql_manager.skip_sql or not data:
+            return
+
+        data = self._psql_manager.shorten_column_names(table_name=self.wide_table, data=data)
+
+        metadata = {col: values for col, values in data.items() if not col.startswith(self.mod_column_prefix)}
+        mod_triples = {'my_id': [], 'mod_column': [], 'value': []}
+
+        for col, values in data.items():
+            if not col.startswith(self.mod_column_prefix):
+                continue
+
+            for my_id, value in zip(data['my_id'], values):
+                if value is None:
+                    continue
+
+                mod_triples['my_id'].append(my_id)
+                mod_triples['mod_column'].append(col)
+                mod_triples['value'].append(value)
+
+        self._metadata_writer.add_rows(metadata)
+        if mod_triples['my_id']:
+            self._mods_writer.add_rows(mod_triples)
+
+    def flush(self) -> int:
+        """
+        :return: The number of listing rows written
+        """
+        rows_written = self._metadata_writer.flush()
+        self._mods_writer.flush()
+        return rows_written
+
+    def fetch_wide_df(self, atypes: list[str] = None, date_range: tuple[datetime, datetime] = None) -> 'pd.DataFrame':
+        """
+        Pivots the stored listings back into the wide format that ListingsTransforming.to_price_predict_df expects.
+        Mods that a listing doesn't have are NaN, just like NULL columns in the wide listings table. The mod columns
+        are sparse, so only the values listings actually have take up memory.
+
+        :param atypes: Only load listings of these atypes
+        :param date_range: (start, end) - only load listings fetched in [start, end)
+        """
+        import numpy as np
+        import pandas as pd
+
+        if self._psql_manager.skip_sql:
+            return pd.DataFrame()
+
+        where_clause, params = self._psql_manager.build_where_clause(atypes=atypes,
+                                                                     date_range=date_range,
+                                                                     table_alias='l')
+
+        with self._psql_manager.engine.connect() as conn:
+            metadata_df = pd.read_sql_query(text(f'SELECT l.* FROM {self.metadata_table} l{where_clause}'),
+                                            conn,
+                                            params=params)
+            mods_df = pd.read_sql_query(
+                text(f'SELECT m.my_id, m.mod_column, m.value FROM {self.mods_table} m '
+                     f'JOIN {self.metadata_table} l ON l.my_id = m.my_id{where_clause}'),
+                conn,
+                params=params
+            )
+
+        metadata_df = metadata_df.drop_duplicates(subset='my_id').reset_index(drop=True)
+
+        row_codes = pd.Index(metadata_df['my_id']).get_indexer(mods_df['my_id'])
+        col_codes, mod_columns = pd.factorize(mods_df['mod_column'])
+        values = mods_df['value'].to_numpy(dtype=float)
+
+        # Group the triples by mod column, and build each sparse column in one reused dense buffer - the full
+        # (listing x mod column) matrix is never allocated
+        by_column = np.argsort(col_codes, kind='stable')
+        column_bounds = np.searchsorted(col_codes[by_column], np.arange(len(mod_columns) + 1))
+
+        column_buffer = np.full(len(metadata_df), np.nan)
+        mod_arrays = dict()
+        for col_code, mod_column in enumerate(mod_columns):
+            triples = by_column[column_bounds[col_code]:column_bounds[col_code + 1]]
+            column_buffer[row_codes[triples]] = values[triples]
+            mod_arrays[mod_column] = pd.arrays.SparseArray(column_buffer, fill_value=np.nan)
+            column_buffer[row_codes[triples]] = np.nan
+
+        psql_log.info(f"Pivoted {len(mods_df)} mod values into {len(metadata_df)} listings x "
+                      f"{len(mod_columns)} mod columns.")
+
+        wide_df = pd.concat([metadata_df, pd.DataFrame(mod_arrays, index=metadata_df.index)], axis=1)
+        return wide_df
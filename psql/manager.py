@@ -1,3 +1,4 @@
+import hashlib
 import json
 
 import sqlalchemy
@@ -9,6 +10,10 @@ from . import utils
 
 psql_log = LogsHandler().fetch_log(LogFile.PSQL)
 
+# Psql column names have a character limit of 63
+_MAX_COLUMN_NAME_LENGTH = 55
+_COLUMN_HASH_LENGTH = 8
+
 
 class PostgreSqlManager:
     _instance = None
@@ -46,28 +51,117 @@ class PostgreSqlManager:
         self.connection = self.engine.connect()
         self.inspector = inspect(self.engine)
 
+        # {table name: set of column names} - only re-inspected when a column looks to be missing
+        self._table_columns = dict()
+        # {table name: {full column name: Psql column name}} for column names that had to be shortened
+        self._column_name_maps = dict()
+
+        self._create_column_name_map_table()
+
         psql_log.info(f"Connected to PSQL database at: {db_url}")
 
-    def _add_missing_columns(self, table_name: str, new_data: dict):
+    def _create_column_name_map_table(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                'CREATE TABLE IF NOT EXISTS column_name_map ('
+                'table_name TEXT NOT NULL, '
+                'full_name TEXT NOT NULL, '
+                'column_name TEXT NOT NULL, '
+                'PRIMARY KEY (table_name, full_name), '
+                'UNIQUE (table_name, column_name))'
+            ))
+
+    def _fetch_column_name_map(self, table_name: str) -> dict:
+        if table_name not in self._column_name_maps:
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    text('SELECT full_name, column_name FROM column_name_map WHERE table_name = :table_name'),
+                    {'table_name': table_name}
+                )
+                self._column_name_maps[table_name] = {full_name: column_name for full_name, column_name in rows}
+
+        return self._column_name_maps[table_name]
+
+    def _claim_column_name(self, table_name: str, full_name: str) -> str:
+        """
+        Maps a column name that is too long for Psql to a shortened name. The first full name to need a shortened
+        name gets the plain truncation (which is what columns were named before the mapping existed), and any later
+        full name that truncates to the same name gets a hash suffix instead of silently sharing the column.
+        """
+        name_map = self._fetch_column_name_map(table_name)
+        taken_names = set(name_map.values())
+
+        column_name = full_name[:_MAX_COLUMN_NAME_LENGTH]
+        if column_name in taken_names:
+            name_hash = hashlib.blake2b(full_name.encode('utf-8'), digest_size=_COLUMN_HASH_LENGTH // 2).hexdigest()
+            column_name = f"{full_name[:_MAX_COLUMN_NAME_LENGTH - _COLUMN_HASH_LENGTH - 1]}_{name_hash}"
 
-        table_col_names = self._fetch_column_names(table_name)
+        with self.engine.begin() as conn:
+            conn.execute(
+                text('INSERT INTO column_name_map (table_name, full_name, column_name) '
+                     'VALUES (:table_name, :full_name, :column_name) ON CONFLICT DO NOTHING'),
+                {'table_name': table_name, 'full_name': full_name, 'column_name': column_name}
+            )
+            # Another process may have claimed a name for this column first - theirs wins
+            column_name = conn.execute(
+                text('SELECT column_name FROM column_name_map '
+                     'WHERE table_name = :table_name AND full_name = :full_name'),
+                {'table_name': table_name, 'full_name': full_name}
+            ).scalar()
+
+        if column_name is None:
+            # Lost a race for the plain truncation to a different full name - reload and pick again
+            del self._column_name_maps[table_name]
+            return self._claim_column_name(table_name=table_name, full_name=full_name)
+
+        name_map[full_name] = column_name
+        if column_name != full_name[:_MAX_COLUMN_NAME_LENGTH]:
+            psql_log.info(f"Column '{full_name}' collides with another column once truncated. "
+                          f"Mapped it to '{column_name}'.")
+
+        return column_name
+
+    def shorten_column_names(self, table_name: str, data: dict) -> dict:
+        """
+        :param data: {full column name: values}
+        :return: The same data, keyed by the Psql column names
+        """
+        if self.skip_sql:
+            return data
+
+        name_map = self._fetch_column_name_map(table_name)
+        shortened_data = dict()
+        for col, values in data.items():
+            if len(col) > _MAX_COLUMN_NAME_LENGTH:
+                col = name_map.get(col) or self._claim_column_name(table_name=table_name, full_name=col)
+            shortened_data[col] = values
+
+        return shortened_data
 
-        new_cols = set(new_data.keys())
-        missing_col_names = set(col for col in new_cols if col not in table_col_names)
+    def add_missing_columns(self, table_name: str, new_data: dict):
+        """
+        Adds the columns of new_data that the table doesn't have yet, typed from their values, in a single ALTER.
+
+        :param new_data: {column name: values}
+        """
+        missing_col_names = set(new_data.keys()) - self._fetch_column_names(table_name)
+        if not missing_col_names:
+            return
 
+        # The cache may just be stale - another process could have added the columns
+        missing_col_names &= set(new_data.keys()) - self._fetch_column_names(table_name, refresh=True)
         if not missing_col_names:
             return
 
         missing_col_data = {k: v for k, v in new_data.items() if k in missing_col_names}
         missing_col_dtypes = utils.determine_col_dtypes(raw_data=missing_col_data)
 
+        add_columns = ', '.join(f'ADD COLUMN IF NOT EXISTS "{col}" {dtype}' for col, dtype in missing_col_dtypes.items())
         with self.engine.begin() as conn:
             psql_log.info(f"Adding missing '{table_name}' col names: {missing_col_names}")
-            for col, dtype in missing_col_dtypes.items():
-                alter_stmt = text(f'ALTER TABLE {table_name} ADD COLUMN "{col}" {dtype};')
-                conn.execute(alter_stmt)
+            conn.execute(text(f'ALTER TABLE {table_name} {add_columns};'))
 
-        self.inspector = inspect(self.engine)
+        self._table_columns[table_name] |= missing_col_names
 
     def _count_table_rows(self, table_name: str):
         with self.connection.begin():
@@ -76,8 +170,13 @@ class PostgreSqlManager:
 
         return count
 
-    def _fetch_column_names(self, table_name: str):
-        return set(col['name'] for col in self.inspector.get_columns(table_name))
+    def _fetch_column_names(self, table_name: str, refresh: bool = False) -> set:
+        if refresh or table_name not in self._table_columns:
+            # The inspector caches its reflection results, so a fresh one is needed to see new columns
+            self.inspector = inspect(self.engine)
+            self._table_columns[table_name] = set(col['name'] for col in self.inspector.get_columns(table_name))
+
+        return self._table_columns[table_name]
 
     def insert_listing(self, table_name: str, data: dict):
         if self.skip_sql:
@@ -86,11 +185,10 @@ class PostgreSqlManager:
         if not data:
             return
 
-        # Psql column names have a character limit of 63
-        data = {col[:55]: val for col, val in data.items()}
+        data = self.shorten_column_names(table_name=table_name, data=data)
 
         utils.validate_dict_lists(data)
-        self._add_missing_columns(table_name=table_name,
+        self.add_missing_columns(table_name=table_name,
                                   new_data=data)
 
         cols = ', '.join(f'"{k}"' for k in data.keys())
@@ -100,40 +198,144 @@ class PostgreSqlManager:
         # When inserting into psql via SqlAlchemy, the data has to be a list of dicts
         formatted_data = utils.format_data_into_rows(data)
 
-        rows_before = self._count_table_rows(table_name)
         with self.engine.begin() as conn:
-            conn.execute(insert_stmt, formatted_data)
-        psql_log.info(f"{table_name} PSQL rows {rows_before} -> {self._count_table_rows(table_name)}")
+            result = conn.execute(insert_stmt, formatted_data)
+        psql_log.info(f"Inserted {result.rowcount} rows into {table_name}.")
 
     def insert_listing_string(self,
                               table_name: str,
                               my_id: str,
                               listing_str: str
                               ):
+        self.insert_listing_strings(table_name=table_name, listing_strings=[(my_id, listing_str)])
+
+    def insert_listing_strings(self, table_name: str, listing_strings: list[tuple[str, str]]):
+        """
+        Batch version of insert_listing_string.
+
+        :param listing_strings: [(my_id, listing string)]
+        """
+        if self.skip_sql or not listing_strings:
+            return
+
         with self.engine.begin() as conn:
             conn.execute(
-                f"INSERT INTO {table_name} (my_id, listing_str) VALUES (%s, %s) "
-                "ON CONFLICT (my_id) DO UPDATE SET listing_str = EXCLUDED.listing_str",
-                (my_id, listing_str)  # just the string here, no json.dumps
+                text(f"INSERT INTO {table_name} (my_id, listing_str) VALUES (:my_id, :listing_str) "
+                     "ON CONFLICT (my_id) DO UPDATE SET listing_str = EXCLUDED.listing_str"),
+                [{'my_id': my_id, 'listing_str': listing_str} for my_id, listing_str in listing_strings]
             )
 
-    def fetch_table_data(self, table_name: str) -> dict:
+    @staticmethod
+    def build_where_clause(atypes: list[str] = None,
+                           date_range: tuple = None,
+                           min_values: dict = None,
+                           table_alias: str = None) -> tuple[str, dict]:
+        """
+        :param atypes: Only rows with one of these atype values
+        :param date_range: (start, end) - only rows fetched in [start, end)
+        :param min_values: {column name: value} - only rows where each column is strictly greater than its value
+        :param table_alias: Prefixed to every column, for queries that join tables
+        :return: The WHERE clause (empty if there are no conditions) and its bound parameters
+        """
+        prefix = f'{table_alias}.' if table_alias else ''
+        conditions = []
+        params = dict()
+
+        if atypes:
+            conditions.append(f'{prefix}"atype" = ANY(:atypes)')
+            params['atypes'] = list(atypes)
+
+        if date_range:
+            conditions.append(f'{prefix}"date_fetched" >= :date_start AND {prefix}"date_fetched" < :date_end')
+            params['date_start'], params['date_end'] = date_range
+
+        for i, (col, min_value) in enumerate((min_values or dict()).items()):
+            conditions.append(f'{prefix}"{col}" > :min_{i}')
+            params[f"min_{i}"] = min_value
+
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    @staticmethod
+    def _numpy_dtype(sql_type) -> str:
+        if isinstance(sql_type, (sqlalchemy.Integer, sqlalchemy.Float, sqlalchemy.Numeric)):
+            # Float so that NULLs can be held as NaN
+            return 'float64'
+        if isinstance(sql_type, sqlalchemy.DateTime) and not sql_type.timezone:
+            return 'datetime64[us]'
+        return 'object'
+
+    @staticmethod
+    def _to_column_array(values: tuple, dtype: str):
+        import numpy as np
+
+        if dtype != 'object':
+            return np.array(values, dtype=dtype)
+
+        # Assigned element-wise so that list / tuple values don't turn into extra array dimensions
+        column_array = np.empty(len(values), dtype=object)
+        column_array[:] = values
+        return column_array
+
+    def fetch_table_data(self,
+                         table_name: str,
+                         columns: list[str] = None,
+                         atypes: list[str] = None,
+                         date_range: tuple = None,
+                         chunk_size: int = 20000) -> dict:
+        """
+        Streams the table through a server-side cursor chunk_size rows at a time, and converts each chunk straight into
+        typed NumPy column arrays. Only one chunk of row objects is ever held in memory.
+
+        :param columns: Only load these columns. Defaults to every column
+        :param atypes: Only load rows with one of these atype values
+        :param date_range: (start, end) - only load rows fetched in [start, end)
+        :return: {column name: NumPy array of column values}
+        """
+        import numpy as np
+
         if self.skip_sql:
             return dict()
-        with self.engine.connect() as conn:
-            # Select * from your table
-            result = list(conn.execute(text(f'SELECT * FROM {table_name}')).mappings())
 
-            cols = list(result[0].keys())
-            data_dict = {col: [] for col in cols}
+        column_types = {col['name']: col['type'] for col in inspect(self.engine).get_columns(table_name)}
 
-            for row in result:
-                for col in cols:
-                    data_dict[col].append(row[col])
+        if columns:
+            missing_cols = [col for col in columns if col not in column_types]
+            if missing_cols:
+                psql_log.info(f"{missing_cols} missing from Psql table '{table_name}'. Skipping those columns.")
+            select_cols = [col for col in columns if col in column_types]
+        else:
+            select_cols = list(column_types.keys())
+
+        if not select_cols:
+            return dict()
+
+        col_dtypes = {col: self._numpy_dtype(column_types[col]) for col in select_cols}
 
-            return data_dict
+        where_clause, params = self.build_where_clause(atypes=atypes, date_range=date_range)
+        quoted_columns = ', '.join(f'"{col}"' for col in select_cols)
+        query = text(f'SELECT {quoted_columns} FROM "{table_name}"{where_clause}')
 
-    def fetch_columns_data(self, table_name: str, columns: list[str]) -> dict:
+        column_chunks = {col: [] for col in select_cols}
+        rows_fetched = 0
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(query, params)
+            for rows in result.partitions(chunk_size):
+                for col, values in zip(select_cols, zip(*rows)):
+                    column_chunks[col].append(self._to_column_array(values, dtype=col_dtypes[col]))
+                rows_fetched += len(rows)
+
+        psql_log.info(f"Fetched {rows_fetched} rows x {len(select_cols)} columns from '{table_name}'.")
+
+        return {
+            col: np.concatenate(chunks) if chunks else np.array([], dtype=col_dtypes[col])
+            for col, chunks in column_chunks.items()
+        }
+
+    def fetch_columns_data(self, table_name: str, columns: list[str], min_values: dict = None) -> dict:
+        """
+        :param min_values: {column name: value} - only rows where each column is strictly greater than its value
+            are returned
+        """
         if self.skip_sql:
             return dict()
         
@@ -157,10 +359,11 @@ class PostgreSqlManager:
         quoted_columns = ', '.join(f'"{col}"' for col in present_cols)
         quoted_table = f'"{table_name}"'
 
-        query = text(f'SELECT {quoted_columns} FROM {quoted_table}')
+        where_clause, params = self.build_where_clause(min_values=min_values)
+        query_str = f'SELECT {quoted_columns} FROM {quoted_table}{where_clause}'
 
         with self.engine.connect() as conn:
-            result = list(conn.execute(query).mappings())
+            result = list(conn.execute(text(query_str), params).mappings())
 
             if not result:
                 return cols_dict
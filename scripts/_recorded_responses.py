@@ -0,0 +1,25 @@
+"""
+Command line options and loading of the recorded trade API responses that the benchmark scripts run on.
+"""
+import argparse
+import itertools
+
+from file_management.file_managers import RawListingsArchive, RawListingsFile
+
+
+def add_recorded_responses_args(parser: argparse.ArgumentParser, default_records: int = 5000):
+    parser.add_argument('--records', type=int, default=default_records)
+    parser.add_argument('--jsonl', action='store_true', help="Read the legacy raw_listings.jsonl instead of the archive.")
+
+
+def load_recorded_responses(args: argparse.Namespace) -> list[dict]:
+    """
+    :param args: Parsed by a parser that was given to add_recorded_responses_args
+    :return: The first args.records recorded responses
+    """
+    raw_listings_file = RawListingsFile() if args.jsonl else RawListingsArchive()
+    responses = list(itertools.islice(raw_listings_file.load(), args.records))
+    if not responses:
+        raise SystemExit("No recorded responses to benchmark with.")
+
+    return responses
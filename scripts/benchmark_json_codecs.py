@@ -0,0 +1,48 @@
+"""
+Compares the decode throughput of the JSON backends on recorded trade API fetch responses.
+"""
+import argparse
+import json
+import time
+
+from file_management import json_codec
+from scripts._recorded_responses import add_recorded_responses_args, load_recorded_responses
+
+parser = argparse.ArgumentParser()
+add_recorded_responses_args(parser)
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+records = load_recorded_responses(args)
+
+# Pages of 10 listings, like the bodies of the fetch GETs
+pages = [json.dumps({'result': records[i:i + 10]}).encode('utf-8') for i in range(0, len(records), 10)]
+total_mb = sum(len(page) for page in pages) / 1024 ** 2
+
+decoders = {'json': json.loads}
+
+try:
+    import orjson
+    decoders['orjson'] = orjson.loads
+except ImportError:
+    print("orjson isn't installed.")
+
+try:
+    import msgspec
+    decoders['msgspec'] = msgspec.json.Decoder().decode
+    decoders['msgspec typed'] = msgspec.json.Decoder(json_codec.FetchResponse).decode
+except ImportError:
+    print("msgspec isn't installed.")
+
+decoders['json_codec typed'] = json_codec.decode_fetch_response
+
+print(f"Decoding {len(records)} recorded responses in {len(pages)} pages ({total_mb:.1f} MB), best of {args.repeat}.")
+for name, decode in decoders.items():
+    best = float('inf')
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for page in pages:
+            decode(page)
+        best = min(best, time.perf_counter() - start)
+
+    print(f"{name:>24}: {len(records) / best:>10.0f} responses/s  {total_mb / best:>8.1f} MB/s")
@@ -0,0 +1,75 @@
+"""
+Measures the per-listing cost of ApiResponseParser on recorded trade API responses, reading the fields the way
+ListingBuilder.build_listing does.
+"""
+import argparse
+import copy
+import time
+
+from data_handling import ApiResponseParser
+from scripts._recorded_responses import add_recorded_responses_args, load_recorded_responses
+from shared.enums.trade_enums import ModClass
+
+parser = argparse.ArgumentParser()
+add_recorded_responses_args(parser)
+args = parser.parse_args()
+
+
+def read_listing_fields(rp: ApiResponseParser):
+    # The string, the listing and the mod resolver all read some of the same fields
+    for _ in range(2):
+        rp.item_properties, rp.raw_properties
+        rp.str_requirement, rp.dex_requirement, rp.int_requirement, rp.level_requirement
+        rp.item_name, rp.item_btype, rp.item_category, rp.item_ilvl
+        rp.price, rp.account_name, rp.date_fetched, rp.listing_id
+        rp.skills_data
+
+    for mod_class in (ModClass.IMPLICIT, ModClass.ENCHANT, ModClass.FRACTURED, ModClass.EXPLICIT):
+        rp.fetch_tiered_mod_strings(mod_class=mod_class, mod_abbrev=ApiResponseParser.mod_class_to_abbrev[mod_class])
+
+    rp.item_atype, rp.item_rarity, rp.is_identified, rp.is_corrupted
+    for mod_class in rp.mod_classes:
+        rp.fetch_sub_mod_hash_to_text(mod_class=mod_class)
+        for _ in rp.fetch_mods_data(mod_class):
+            rp.item_atype
+
+
+responses = load_recorded_responses(args)
+
+# The parser cleans up responses in place, so every pass gets its own copy
+first_pass_responses = copy.deepcopy(responses)
+second_pass_responses = copy.deepcopy(responses)
+
+start = time.perf_counter()
+parsers = [ApiResponseParser(response) for response in first_pass_responses]
+construct_seconds = time.perf_counter() - start
+
+failed = 0
+start = time.perf_counter()
+for rp in parsers:
+    try:
+        read_listing_fields(rp)
+    except (KeyError, IndexError, TypeError, ValueError):
+        failed += 1
+first_read_seconds = time.perf_counter() - start
+
+start = time.perf_counter()
+for rp in parsers:
+    try:
+        read_listing_fields(rp)
+    except (KeyError, IndexError, TypeError, ValueError):
+        pass
+cached_read_seconds = time.perf_counter() - start
+
+start = time.perf_counter()
+for response in second_pass_responses:
+    rp = ApiResponseParser(response)
+    rp.listing_id, rp.date_fetched
+id_and_date_seconds = time.perf_counter() - start
+
+n = len(responses)
+print(f"{n} recorded responses ({failed} couldn't be fully parsed).")
+print(f"Construct:                   {construct_seconds / n * 1e6:8.1f} us/listing")
+print(f"First read of every field:   {first_read_seconds / n * 1e6:8.1f} us/listing")
+print(f"Cached read of every field:  {cached_read_seconds / n * 1e6:8.1f} us/listing")
+print(f"Listing id + date only:      {id_and_date_seconds / n * 1e6:8.1f} us/listing")
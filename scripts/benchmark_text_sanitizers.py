@@ -0,0 +1,97 @@
+"""
+Compares the text sanitizers of shared.text_normalization against the previous uncompiled versions on the texts of
+recorded trade API responses, and checks that both produce the same output.
+"""
+import argparse
+import re
+import time
+
+from scripts._recorded_responses import add_recorded_responses_args, load_recorded_responses
+from shared import text_normalization
+
+parser = argparse.ArgumentParser()
+add_recorded_responses_args(parser)
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+
+
+# The previous implementations, minus the print and log line sanitize_mod_text wrote for every call
+def old_extract_values_from_text(text) -> list:
+    matches = re.findall(r'-?\d+(?:\.\d+)?(?:\s*[–-]\s*-?\d+(?:\.\d+)?)?', text)
+    result = []
+    for match in matches:
+        clean = re.sub(r'[–—−-]', '-', match).strip()
+
+        if '-' in clean[1:]:
+            left_str, right_str = clean.split('-', 1)
+            left = float(left_str) if '.' in left_str else int(left_str)
+            right = float(right_str) if '.' in right_str else int(right_str)
+            result.append((left, right))
+        else:
+            val = float(clean) if '.' in clean else int(clean)
+            result.append(val)
+    return result
+
+
+def old_sanitize_text(text: str):
+    result = re.sub(r'\[(.*?)\]', text_normalization.extract_from_brackets, text)
+    return result.strip().lower().replace(' ', '_')
+
+
+def old_sanitize_dict_texts(d):
+    if isinstance(d, dict):
+        return {k: old_sanitize_dict_texts(v) for k, v in d.items()}
+    elif isinstance(d, list):
+        return [old_sanitize_dict_texts(item) for item in d]
+    elif isinstance(d, str):
+        return old_sanitize_text(d)
+    else:
+        return d
+
+
+def old_sanitize_mod_text(mod_text: str):
+    mod_text = mod_text.strip().lower()
+    result = re.sub(r'(-?\d+(?:\.\d+)?)\s*[–—−-]\s*(-?\d+(?:\.\d+)?)', r'\1_to_\2', mod_text)
+    result = re.sub(r'\d+', 'n', result)
+    result = result.replace('.n', '').replace('%', 'p')
+    result = re.sub(r'[^a-zA-Z]', '_', result)
+    result = re.sub(r'_+', '_', result)
+    result = re.sub(r'\[(.*?)\]', text_normalization.extract_from_brackets, result)
+    return result.strip(' _')
+
+
+def collect_mod_texts(response: dict) -> list[str]:
+    item = response['item']
+    mod_texts = []
+    for key in ('implicitMods', 'enchantMods', 'fracturedMods', 'explicitMods', 'runeMods'):
+        mod_texts.extend(item.get(key, []))
+    return mod_texts
+
+
+def best_seconds(func, inputs) -> float:
+    best = float('inf')
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for value in inputs:
+            func(value)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+responses = load_recorded_responses(args)
+
+mod_texts = [mod_text for response in responses for mod_text in collect_mod_texts(response)]
+print(f"{len(responses)} recorded responses, {len(mod_texts)} mod texts ({len(set(mod_texts))} distinct).")
+
+comparisons = [
+    ('sanitize_mod_text', old_sanitize_mod_text, text_normalization.sanitize_mod_text, mod_texts),
+    ('extract_values_from_text', old_extract_values_from_text, text_normalization.extract_values_from_text, mod_texts),
+    ('sanitize_dict_texts', old_sanitize_dict_texts, text_normalization.sanitize_dict_texts, responses)
+]
+for name, old_func, new_func, inputs in comparisons:
+    mismatches = sum(old_func(value) != new_func(value) for value in inputs)
+
+    old_seconds = best_seconds(old_func, inputs)
+    new_seconds = best_seconds(new_func, inputs)
+    print(f"{name:>26}: {old_seconds / len(inputs) * 1e6:8.2f} -> {new_seconds / len(inputs) * 1e6:8.2f} us/call "
+          f"({old_seconds / new_seconds:5.1f}x), {mismatches} mismatches")
@@ -0,0 +1,52 @@
+"""
+Compares the sync and async trade fetch pipelines against a local MockTradeServer serving recorded responses.
+No requests are sent to the real trade API.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from file_management.file_managers import RawListingsArchive
+from trade_api import TradeApiHandler, AsyncTradeApiHandler
+from trade_api.async_trade_items_fetcher import AsyncTradeItemsFetcher
+from trade_api.mock_trade_server import MockTradeServer
+from trade_api.query import QueryPresets
+from trade_api.request_throttler import RequestThrottler
+from trade_api.trade_items_fetcher import TradeItemsFetcher
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--queries', type=int, default=10)
+parser.add_argument('--records', type=int, default=500)
+parser.add_argument('--latency', type=float, default=0.05)
+args = parser.parse_args()
+
+records = list(itertools.islice(RawListingsArchive().load(), args.records))
+print(f"Serving {len(records)} recorded responses with {args.latency}s of latency per request.")
+
+server = MockTradeServer(items=records, latency=args.latency).start()
+queries = QueryPresets().training_fills[:args.queries]
+
+TradeItemsFetcher.post_url = server.post_url
+TradeItemsFetcher.get_url = server.get_url
+TradeItemsFetcher.request_throttler = RequestThrottler()
+
+start = time.perf_counter()
+sync_items = sum(len(responses) for responses in TradeApiHandler().fetch_responses(queries))
+sync_seconds = time.perf_counter() - start
+
+
+async def _run_async() -> int:
+    fetcher = AsyncTradeItemsFetcher(request_throttler=RequestThrottler(),
+                                     post_url=server.post_url,
+                                     get_url=server.get_url)
+    return sum([len(responses) async for responses in AsyncTradeApiHandler(fetcher=fetcher).fetch_responses(queries)])
+
+start = time.perf_counter()
+async_items = asyncio.run(_run_async())
+async_seconds = time.perf_counter() - start
+
+server.stop()
+
+print(f"Sync:  {sync_items} items in {sync_seconds:.2f}s ({sync_items / sync_seconds:.1f} items/s)")
+print(f"Async: {async_items} items in {async_seconds:.2f}s ({async_items / async_seconds:.1f} items/s)")
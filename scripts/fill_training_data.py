@@ -2,13 +2,27 @@ from data_handling import ListingBuilder
 
 print("Entered Python file for fill_training_data.py")
 
+import argparse
 import logging
 
 import psql
 from operations_coordination.populate_training_data import TrainingDataPopulator
+from trade_api import TradeApiHandler
+from trade_api.response_cache import TradeResponseCache
 
 logging.basicConfig(level=logging.INFO)
 
+parser = argparse.ArgumentParser()
+parser.add_argument('--cache', action='store_true', help="Cache trade search / fetch results on disk.")
+parser.add_argument('--replay', action='store_true', help="Serve every query from the cache without any requests.")
+parser.add_argument('--processes', type=int, default=None,
+                    help="Processes building listings while fetching. Defaults to the number of cores.")
+parser.add_argument('--unordered', action='store_true', help="Insert pages as soon as they're built.")
+args = parser.parse_args()
+
+response_cache = TradeResponseCache() if args.cache or args.replay else None
+trade_api_handler = TradeApiHandler(response_cache=response_cache, replay=args.replay)
+
 print("Loading PSQL manager.")
 psql_manager = psql.PostgreSqlManager(skip_sql=False)
 
@@ -16,7 +30,10 @@ listing_builder = ListingBuilder()
 
 print("Loading TrainingDataPopulator class object.")
 tdp = TrainingDataPopulator(listing_builder=listing_builder,
-                            psql_manager=psql_manager)
+                            psql_manager=psql_manager,
+                            trade_api_handler=trade_api_handler,
+                            processes=args.processes,
+                            ordered=not args.unordered)
 
 print("Starting TrainingDataPopulator.fill_training_data function")
 tdp.fill_training_data()
@@ -1,17 +1,30 @@
+print("Entered Python file for load_from_raw_listings.py")
 
-print("Entered Python file for fill_training_data.py")
+import argparse
+import logging
 
-import program_logging
 import psql
-from file_management.file_managers import RawListingsFile
+from data_handling import ListingBuilder
+from file_management.file_managers import RawListingsFile, RawListingsArchive
 from operations_coordination.populate_training_data import TrainingDataPopulator
 
-program_logging.basicConfig(level=program_logging.INFO)
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resume', action='store_true', help="Continue from the last backfill checkpoint.")
+parser.add_argument('--processes', type=int, default=None,
+                    help="Processes building listings. Defaults to the number of cores.")
+parser.add_argument('--shards', type=int, default=None,
+                    help="Number of offset ranges the file is split into. Defaults to 4 per process.")
+parser.add_argument('--jsonl', action='store_true',
+                    help="Load the legacy raw_listings.jsonl instead of the raw listings archive.")
+args = parser.parse_args()
 
 print("Loading PSQL manager.")
 psql_m = psql.PostgreSqlManager(skip_sql=False)
 
-file = RawListingsFile()
-populator = TrainingDataPopulator(psql_manager=psql_m)
-populator.fill_training_data(file)
-
+populator = TrainingDataPopulator(listing_builder=ListingBuilder(),
+                                  psql_manager=psql_m,
+                                  processes=args.processes)
+raw_listings_file = RawListingsFile() if args.jsonl else RawListingsArchive()
+populator.fill_training_data_from_listings_file(raw_listings_file, resume=args.resume, shards=args.shards)
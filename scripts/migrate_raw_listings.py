@@ -0,0 +1,42 @@
+"""
+Copies the legacy raw_listings.jsonl into the segmented RawListingsArchive. The jsonl file is left in place.
+"""
+import argparse
+import time
+
+from file_management.file_managers import RawListingsFile, RawListingsArchive
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch-size', type=int, default=RawListingsArchive.frame_max_records,
+                    help="Records compressed into each archive frame.")
+parser.add_argument('--force', action='store_true', help="Append even if the archive already holds records.")
+args = parser.parse_args()
+
+raw_listings_file = RawListingsFile()
+archive = RawListingsArchive()
+
+if not raw_listings_file.exists():
+    raise SystemExit(f"No raw listings file at {raw_listings_file.path}.")
+
+if archive.count() and not args.force:
+    raise SystemExit(f"The archive at {archive.path} already holds {archive.count()} records. "
+                     f"Pass --force to append to it anyway.")
+
+start_time = time.perf_counter()
+records_migrated = 0
+
+batch = []
+for record in raw_listings_file.load():
+    batch.append(record)
+    if len(batch) >= args.batch_size:
+        archive.save(batch)
+        records_migrated += len(batch)
+        batch = []
+        print(f"Migrated {records_migrated} records.")
+
+archive.save(batch)
+records_migrated += len(batch)
+
+archive_bytes = sum(path.stat().st_size for path in archive.path.iterdir() if path.is_file())
+print(f"Migrated {records_migrated} records in {time.perf_counter() - start_time:.1f}s. "
+      f"{raw_listings_file.size() / 1024 ** 2:.1f} MB -> {archive_bytes / 1024 ** 2:.1f} MB (including the index).")
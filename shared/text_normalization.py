@@ -0,0 +1,94 @@
+"""
+Text normalization for trade API, poe2db and poecd texts.
+
+Every pattern is compiled once at import. Sanitized texts are memoized, since the vocabulary of mod texts, property
+names and enum-like values is small and repeats on every listing. Nothing here logs or prints - these run for every
+sub mod of every listing.
+"""
+import re
+from functools import lru_cache
+
+_BRACKETS_PATTERN = re.compile(r'\[(.*?)\]')
+_VALUE_PATTERN = re.compile(r'-?\d+(?:\.\d+)?(?:\s*[–-]\s*-?\d+(?:\.\d+)?)?')
+_DASH_PATTERN = re.compile(r'[–—−-]')
+_RANGE_PATTERN = re.compile(r'(-?\d+(?:\.\d+)?)\s*[–—−-]\s*(-?\d+(?:\.\d+)?)')
+_DIGITS_PATTERN = re.compile(r'\d+')
+_NON_ALPHA_PATTERN = re.compile(r'[^a-zA-Z]')
+_UNDERSCORES_PATTERN = re.compile(r'_+')
+
+_MEMO_SIZE = 2 ** 16
+
+
+def extract_from_brackets(match: re.Match) -> str:
+    parts = match.group(1).split('|')
+    return parts[-1] if len(parts) > 1 else parts[0]
+
+
+def _parse_number(text: str) -> int | float:
+    return float(text) if '.' in text else int(text)
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def _extract_values(text: str) -> tuple:
+    result = []
+    for match in _VALUE_PATTERN.findall(text):
+        clean = _DASH_PATTERN.sub('-', match).strip()
+
+        if '-' in clean[1:]:  # if there's a dash not at the start, it's a range
+            left_str, right_str = clean.split('-', 1)
+            result.append((_parse_number(left_str), _parse_number(right_str)))
+        else:
+            result.append(_parse_number(clean))
+
+    return tuple(result)
+
+
+def extract_values_from_text(text: str) -> list:
+    """
+    :return: Every number in the text. Ranges ('10-20') are (low, high) tuples
+    """
+    return list(_extract_values(text))
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def sanitize_text(text: str) -> str:
+    result = _BRACKETS_PATTERN.sub(extract_from_brackets, text)
+    return result.strip().lower().replace(' ', '_')
+
+
+def sanitize_dict_texts(d):
+    """
+    :return: A copy of d with every string run through sanitize_text
+    """
+    # Exact type checks first - decoded JSON only holds these
+    value_type = type(d)
+    if value_type is str:
+        return sanitize_text(d)
+    if value_type is dict:
+        return {k: sanitize_dict_texts(v) for k, v in d.items()}
+    if value_type is list:
+        return [sanitize_dict_texts(item) for item in d]
+
+    if isinstance(d, dict):
+        return {k: sanitize_dict_texts(v) for k, v in d.items()}
+    if isinstance(d, list):
+        return [sanitize_dict_texts(item) for item in d]
+    if isinstance(d, str):
+        return sanitize_text(d)
+    return d
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def sanitize_mod_text(mod_text: str) -> str:
+    # Replace any #-# with #_to_#
+    mod_text = mod_text.strip().lower()
+    result = _RANGE_PATTERN.sub(r'\1_to_\2', mod_text)
+    result = _DIGITS_PATTERN.sub('n', result)
+    result = result.replace('.n', '').replace('%', 'p')
+
+    # Replace all non-alphabet characters with an underscore - this also removes any brackets
+    result = _NON_ALPHA_PATTERN.sub('_', result)
+    # Filter multiple underscores into a singular underscore
+    result = _UNDERSCORES_PATTERN.sub('_', result)
+
+    return result.strip(' _')
@@ -1,3 +1,3 @@
-from .handler import TradeApiHandler
+from .handler import TradeApiHandler, AsyncTradeApiHandler
 from .listing_gatekeeper import ListingImportGatekeeper
 from .query import Query, StatsFiltersGroup, StatFilter, MetaFilter
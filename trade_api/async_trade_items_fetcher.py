@@ -0,0 +1,186 @@
+import asyncio
+
+from core import env_loader
+from file_management import json_codec
+from program_logging import LogsHandler, LogFile
+from trade_api.request_throttler import RequestThrottler
+from .response_cache import TradeResponseCache
+from .trade_items_fetcher import TradeItemsFetcher, chunk_list
+
+api_log = LogsHandler().fetch_log(LogFile.EXTERNAL_APIS)
+
+
+class AsyncTradeItemsFetcher:
+    """
+    asyncio version of TradeItemsFetcher. All requests go through one pooled keep-alive (HTTP/2 when the server
+    supports it) client, and the fetch GETs of a search id are sent concurrently as fast as the rate budget allows.
+
+    Use as an async context manager so that the connection pool is opened and closed:
+
+        async with AsyncTradeItemsFetcher() as fetcher:
+            items, total = await fetcher.fetch_items_response(query)
+    """
+
+    def __init__(self,
+                 request_throttler: RequestThrottler = None,
+                 post_url: str = None,
+                 get_url: str = None,
+                 max_connections: int = 10,
+                 http2: bool = True,
+                 response_cache: TradeResponseCache = None,
+                 replay: bool = False):
+        """
+        :param request_throttler: Defaults to TradeItemsFetcher's throttler so that sync and async fetching share
+            one rate budget
+        :param post_url: Override to point at a local mock server
+        :param get_url: Override to point at a local mock server
+        :param max_connections: Maximum number of concurrent in-flight requests
+        :param response_cache: If provided, search and fetch results are served from / saved to this cache
+        :param replay: Serve everything from the response cache regardless of age, and never send a request.
+            Searches or items that aren't cached are skipped
+        """
+        if replay and not response_cache:
+            raise ValueError("Replay mode requires a response cache.")
+
+        self.response_cache = response_cache
+        self.replay = replay
+
+        self.request_throttler = request_throttler or TradeItemsFetcher.fetch_request_throttler()
+        self.post_url = post_url or TradeItemsFetcher.post_url
+        self.get_url = get_url or TradeItemsFetcher.get_url
+
+        self.max_connections = max_connections
+        self.http2 = http2
+
+        self._client = None
+        self._connections_semaphore = None
+
+        # Set through AsyncTradeApiHandler.use_listing_gatekeeper so that recently fetched listings are never downloaded
+        self.listing_gatekeeper = None
+
+        # The first request of each kind is sent alone, since we don't know its rate limits until it returns
+        self._limits_locks = {'post': asyncio.Lock(), 'get': asyncio.Lock()}
+
+    @property
+    def _headers(self) -> dict:
+        # httpx sets Host / Connection itself, and the mock server isn't www.pathofexile.com
+        return {k: v for k, v in TradeItemsFetcher.headers.items() if k not in ('Host', 'Connection')}
+
+    async def __aenter__(self):
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_connections)
+        self._client = httpx.AsyncClient(http2=self.http2,
+                                         headers=self._headers,
+                                         cookies={'POSSESSID': env_loader.get_env("POSSESSID") or ''},
+                                         limits=limits,
+                                         timeout=30)
+        self._connections_semaphore = asyncio.Semaphore(self.max_connections)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._client.aclose()
+        self._client = None
+
+    async def _send_request(self, func_name: str, method: str, url: str, **kwargs):
+        throttler = self.request_throttler
+
+        if not throttler.has_limits(func_name):
+            async with self._limits_locks[func_name]:
+                if not throttler.has_limits(func_name):
+                    response = await self._client.request(method, url, **kwargs)
+                    response.raise_for_status()
+                    await asyncio.to_thread(throttler.update_limits,
+                                            func_name=func_name,
+                                            response_headers=response.headers)
+                    return response
+
+        async with self._connections_semaphore:
+            # The throttler blocks on a condition variable and its backend, so wait for the slot off the event loop
+            await asyncio.to_thread(throttler.wait_for_slot, func_name)
+            response = await self._client.request(method, url, **kwargs)
+
+        # Shared rate limit backends (SQLite, Postgres) block on their queries
+        await asyncio.to_thread(throttler.update_limits, func_name=func_name, response_headers=response.headers)
+        response.raise_for_status()
+        return response
+
+    async def _post_for_search_id(self, query: dict) -> dict:
+        response = await self._send_request('post', 'POST', self.post_url, json=query)
+        return json_codec.decode_search_response(response.content)
+
+    async def post_for_search_id(self, query: dict) -> dict | None:
+        """
+        :return: None in replay mode if the search isn't cached
+        """
+        # The cache is SQLite, so it's read and written off the event loop
+        if self.response_cache:
+            post_response = await asyncio.to_thread(self.response_cache.load_search, query, ignore_ttl=self.replay)
+            if post_response:
+                return post_response
+
+        if self.replay:
+            api_log.info(f"Replay: no cached search for query key {TradeResponseCache.query_key(query)}. Skipping.")
+            return None
+
+        post_response = await self._post_for_search_id(query)
+
+        if self.response_cache:
+            await asyncio.to_thread(self.response_cache.save_search, query, post_response)
+
+        return post_response
+
+    async def _get_chunk(self, search_id: str, chunked_ids: list[str]) -> list:
+        response = await self._send_request(
+            'get', 'GET', f"{self.get_url}{','.join(chunked_ids)}",
+            params={
+                'query': search_id,
+                'realm': 'poe2'
+            }
+        )
+        return [item for item in json_codec.decode_fetch_response(response.content)['result'] if item]
+
+    async def _get_items(self, search_id: str, item_ids: list[str]) -> list:
+        chunk_results = await asyncio.gather(
+            *[self._get_chunk(search_id=search_id, chunked_ids=chunked_ids)
+              for chunked_ids in chunk_list(items=item_ids, chunk_size=10)]
+        )
+
+        # gather keeps the order of the chunks
+        return [item for result in chunk_results for item in result]
+
+    async def get_with_item_ids(self, post_response: dict, item_ids: list[str]) -> list:
+        # A replayed session's ids were imported when it was recorded, so the gatekeeper would skip all of them
+        if self.listing_gatekeeper and not self.replay:
+            unseen_ids = self.listing_gatekeeper.filter_unseen_ids(item_ids)
+            api_log.info(f"Skipping {len(item_ids) - len(unseen_ids)} of {len(item_ids)} recently fetched item ids.")
+            item_ids = unseen_ids
+
+        if not item_ids:
+            return []
+
+        if not self.response_cache:
+            return await self._get_items(search_id=post_response['id'], item_ids=item_ids)
+
+        items_by_id = await asyncio.to_thread(self.response_cache.load_items, item_ids, ignore_ttl=self.replay)
+        missing_ids = [item_id for item_id in item_ids if item_id not in items_by_id]
+
+        if missing_ids and not self.replay:
+            fetched_items = await self._get_items(search_id=post_response['id'], item_ids=missing_ids)
+            await asyncio.to_thread(self.response_cache.save_items, fetched_items)
+            items_by_id.update({item['id']: item for item in fetched_items})
+
+        api_log.info(f"{len(item_ids) - len(missing_ids)} of {len(item_ids)} items served from the response cache.")
+
+        return [items_by_id[item_id] for item_id in item_ids if item_id in items_by_id]
+
+    async def fetch_items_response(self, query: dict) -> tuple[list, int]:
+        post_response = await self.post_for_search_id(query=query)
+
+        if not post_response:
+            return [], 0
+
+        get_response = await self.get_with_item_ids(post_response=post_response,
+                                                    item_ids=post_response['result'])
+        return get_response, post_response['total']
@@ -1,12 +1,18 @@
+import asyncio
 import math
+from collections import Counter
 from copy import deepcopy
 from datetime import datetime
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
+from file_management.file_managers import RawListingsArchive
 from program_logging import LogsHandler, LogFile
-from shared import shared_utils
+from shared.enums import trade_enums
 from . import query_construction
+from .async_trade_items_fetcher import AsyncTradeItemsFetcher
+from .listing_gatekeeper import ListingImportGatekeeper
 from .query import Query, MetaFilter
+from .response_cache import TradeResponseCache
 from .trade_items_fetcher import TradeItemsFetcher
 
 api_log = LogsHandler().fetch_log(LogFile.EXTERNAL_APIS)
@@ -55,11 +61,44 @@ class _FilterSplitter:
 
         return ranges
 
+    @staticmethod
+    def _split_range_by_density(value_range: tuple, num_parts: int, value_counts: list[tuple]) -> list[tuple]:
+        """
+        Splits the range so that each part holds roughly the same number of the observed values.
+
+        :param value_counts: Sorted (value, count) pairs observed within the value range
+        """
+        start, end = value_range
+        total_count = sum(count for _, count in value_counts)
+        part_size = total_count / num_parts
+
+        ranges = []
+        current_min = start
+        cumulative_count = 0
+        for value, count in value_counts:
+            cumulative_count += count
+
+            # Cut after this value once it fills up the current part. The last part always runs to the end
+            if cumulative_count >= part_size * (len(ranges) + 1) and value < end and len(ranges) < num_parts - 1:
+                ranges.append((current_min, value))
+                current_min = value + 1
+
+        ranges.append((current_min, end))
+        return ranges
+
     @classmethod
-    def split_filter(cls, n_items: int, meta_filter: MetaFilter) -> list[MetaFilter] | None:
+    def split_filter(cls,
+                     n_items: int,
+                     meta_filter: MetaFilter,
+                     results_cap: int = 100,
+                     value_counts: list[tuple] = None) -> list[MetaFilter] | None:
         """
-        Evenly splits a singular query filter (ex: price range) into separate parts. This is used when
-        we fetch too many results and have to split up the query to capture all possible results.
+        Splits a singular query filter (ex: price range) into separate parts. This is used when we fetch too many
+        results and have to split up the query to capture all possible results.
+
+        :param results_cap: Maximum number of item ids the API returns for one search
+        :param value_counts: Sorted (value, count) pairs of previously seen values within the filter's range. If
+            given, the parts are balanced by these counts instead of being equal width
         """
         filter_copy = deepcopy(meta_filter)
         filter_range = cls._fetch_filter_range(filter_copy)
@@ -71,9 +110,19 @@ class _FilterSplitter:
             return
 
         # Can only split as many whole numbers are within the range
-        num_parts = min(math.floor(n_items / 100), (filter_range[1] + 1 - filter_range[0]))
+        num_parts = min(math.ceil(n_items / results_cap), (filter_range[1] + 1 - filter_range[0]))
+
+        if num_parts < 2:
+            return
+
+        if value_counts and sum(count for _, count in value_counts) >= num_parts:
+            ranges = cls._split_range_by_density(filter_range, num_parts=num_parts, value_counts=value_counts)
+        else:
+            ranges = cls._split_range_into_parts(filter_range, num_parts=num_parts)
+
+        if len(ranges) < 2:
+            return
 
-        ranges = cls._split_range_into_parts(filter_range, num_parts=num_parts)
         api_log.info(f"{n_items} responses split {meta_filter.filter_type} from {filter_range} into {ranges}")
 
         filters = []
@@ -99,25 +148,162 @@ class _FilterSplitter:
         return None
 
 
+class _PriceHistograms:
+    """
+    Counts of listed price amounts per (trade item category, currency). Seeded from the RawListingsArchive's index and
+    kept up to date with every fetched response.
+    """
+
+    def __init__(self, raw_listings_archive: RawListingsArchive = None):
+        self._raw_listings_archive = raw_listings_archive or RawListingsArchive()
+        self.loaded = False
+
+        # {(category, currency): Counter({amount: count})}
+        self._histograms = dict()
+
+    def observe(self, category: str, currency: str, amount: float, count: int = 1):
+        key = (category, currency)
+        if key not in self._histograms:
+            self._histograms[key] = Counter()
+
+        self._histograms[key][math.floor(amount)] += count
+
+    def observe_responses(self, category: str, responses: list[dict]):
+        for response in responses:
+            price = response.get('listing', dict()).get('price')
+            if price and price.get('amount') is not None:
+                self.observe(category=category, currency=price['currency'], amount=price['amount'])
+
+    def load(self):
+        """
+        Seeds the histograms from the archive's index. Blocks on SQLite, so async callers should run it in a thread.
+        """
+        from shared.enums import ItemEnumGroups
+
+        if self.loaded:
+            return
+        self.loaded = True
+
+        # The archive's atypes are plain strings
+        atype_value_to_trade = {getattr(atype, 'value', atype): trade_category
+                                for atype, trade_category in ItemEnumGroups.atype_to_trade_map.items()}
+
+        for atype, currency, amount, count in self._raw_listings_archive.price_counts():
+            trade_category = atype_value_to_trade.get(atype)
+            if trade_category:
+                self.observe(category=trade_category.value, currency=currency, amount=amount, count=count)
+
+        api_log.info(f"Loaded price histograms for {len(self._histograms)} (category, currency) pairs.")
+
+    def fetch_value_counts(self, category: str, currency: str, value_range: tuple) -> list[tuple]:
+        """
+        :return: Sorted (amount, count) pairs within the value range
+        """
+        if not self.loaded:
+            self.load()
+
+        histogram = self._histograms.get((category, currency))
+        if not histogram:
+            return []
+
+        start, end = value_range
+        return sorted((amount, count) for amount, count in histogram.items() if start <= amount <= end)
+
+
+class _QuerySplitter:
+
+    def __init__(self, results_cap: int = 100, price_histograms: _PriceHistograms = None):
+        """
+        :param results_cap: Maximum number of item ids the API returns for one search
+        """
+        self.results_cap = results_cap
+        self.price_histograms = price_histograms or _PriceHistograms()
+
+    @staticmethod
+    def _fetch_filter(query: Query, filter_type_enum) -> MetaFilter | None:
+        return next((mf for mf in query.meta_filters if mf.filter_type == filter_type_enum.value), None)
+
+    def query_category(self, query: Query) -> str | None:
+        category_filter = self._fetch_filter(query, trade_enums.TypeFilters.ITEM_CATEGORY)
+        return category_filter.filter_value if category_filter else None
+
+    def observe_responses(self, query: Query, responses: list[dict]):
+        category = self.query_category(query)
+        if category:
+            self.price_histograms.observe_responses(category=category, responses=responses)
+
+    def _price_value_counts(self, query: Query, meta_filter: MetaFilter) -> list[tuple] | None:
+        category = self.query_category(query)
+        if meta_filter.filter_type != trade_enums.TradeFilters.PRICE.value or not category:
+            return None
+
+        return self.price_histograms.fetch_value_counts(category=category,
+                                                        currency=meta_filter.filter_value,
+                                                        value_range=meta_filter.currency_amount)
+
+    def split_query(self, query: Query, n_items: int) -> list[Query]:
+        """
+        Splits the query along one of its range filters into parts that should each fit under the results cap. The
+        price filter is preferred since its listing density is known - other filters are only split once the price
+        range can't be narrowed any further.
+        """
+        filter_indices = sorted(range(len(query.meta_filters)),
+                                key=lambda i: query.meta_filters[i].filter_type != trade_enums.TradeFilters.PRICE.value)
+
+        for i in filter_indices:
+            meta_filter = query.meta_filters[i]
+            filter_splits = _FilterSplitter.split_filter(n_items=n_items,
+                                                         meta_filter=meta_filter,
+                                                         results_cap=self.results_cap,
+                                                         value_counts=self._price_value_counts(query, meta_filter))
+            if not filter_splits:  # Skip if we weren't able to split this filter up into parts
+                continue
+
+            split_queries = []
+            for new_filter in filter_splits:
+                query_copy = deepcopy(query)
+                query_copy.meta_filters[i] = new_filter
+                split_queries.append(query_copy)
+
+            return split_queries
+
+        api_log.info(f"Could not split query with {n_items} results any further.")
+        return []
+
+
 def _key_response(listing_id, date_fetched: str):
     return f"listing_{listing_id}_fetched_{date_fetched}"
 
 
 class TradeApiHandler:
 
-    def __init__(self):
-        self.fetcher = TradeItemsFetcher()
+    def __init__(self, response_cache: TradeResponseCache = None, replay: bool = False):
+        """
+        :param response_cache: Caches search and fetch results on disk so repeated queries don't spend rate budget
+        :param replay: Serve the queries entirely from the response cache without sending any requests
+        """
+        self.fetcher = TradeItemsFetcher(response_cache=response_cache, replay=replay)
 
+        # Searches with more results than this are missing listings, and get split up
         self.split_threshold = 175
+        self._query_splitter = _QuerySplitter()
 
         self.program_start = datetime.now()
 
+    def use_listing_gatekeeper(self, listing_gatekeeper: ListingImportGatekeeper):
+        """
+        Item ids returned by a search that the gatekeeper has seen recently are skipped instead of fetched. Replay
+        mode serves every cached item regardless.
+        """
+        self.fetcher.listing_gatekeeper = listing_gatekeeper
+
     def fetch_responses(self, queries: list[Query]) -> Generator[list[dict], None, None]:
+        self._query_splitter.price_histograms.load()
+
         for i, query in enumerate(queries):
             api_log.info(f"Processing query {i + 1} of {len(queries)} queries.")
             print(f"Processing query {i + 1} of {len(queries)} queries.")
             for responses, response_results_count in self._process_query(query):
-                responses = [shared_utils.sanitize_dict_texts(response) for response in responses]
                 yield responses
 
     def _process_query(self, query: Query):
@@ -125,29 +311,97 @@ class TradeApiHandler:
 
         responses, response_results_count = self.fetcher.fetch_items_response(query_dict)
 
-        if not responses:
-            return
-
-        yield responses, response_results_count
+        # Responses can be empty even when the search had results, if all of them were fetched recently
+        if responses:
+            self._query_splitter.observe_responses(query=query, responses=responses)
+            yield responses, response_results_count
 
-        # If we didn't fetch a ton of raw responses then just end the query
+        # If the search fit under the results cap then we already have all of its listings
         if response_results_count < self.split_threshold:
             api_log.info(f"Only fetched {len(responses)} from initial query. Will not split. Returning.")
             return
 
-        for i in list(range(len(query.meta_filters))):
-            query_copy = deepcopy(query)
-            filter_splits = _FilterSplitter.split_filter(n_items=response_results_count, meta_filter=query.meta_filters[i])
-            if not filter_splits:  # Skip if we weren't able to split this filter up into parts
-                continue
+        # Only the split parts that still overflow the cap are split again
+        for split_query in self._query_splitter.split_query(query=query, n_items=response_results_count):
+            yield from self._process_query(split_query)
 
-            # For each split portion of the metafilter, insert the split portion into the copied query and fetch those results
-            for new_filter in filter_splits:
-                query_copy.meta_filters[i] = new_filter
-                query_dict = query_construction.create_trade_query(query=query_copy)
-                responses, response_results_count = self.fetcher.fetch_items_response(query_dict)
 
-                if not responses:
-                    continue
+class AsyncTradeApiHandler:
+    """
+    asyncio version of TradeApiHandler. The search POSTs run ahead of the fetch GETs: while the items of one search
+    id are being fetched, the next searches (including filter splits) are already being posted.
+    """
+
+    def __init__(self,
+                 fetcher: AsyncTradeItemsFetcher = None,
+                 searches_ahead: int = 2,
+                 response_cache: TradeResponseCache = None,
+                 replay: bool = False):
+        """
+        :param fetcher: Override to use a different throttler or a local mock server
+        :param searches_ahead: How many posted searches may wait for their GETs at once
+        :param response_cache: Caches search and fetch results on disk so repeated queries don't spend rate budget.
+            Ignored if a fetcher is given
+        :param replay: Serve the queries entirely from the response cache without sending any requests
+        """
+        self.fetcher = fetcher or AsyncTradeItemsFetcher(response_cache=response_cache, replay=replay)
+
+        self.split_threshold = 175
+        self._query_splitter = _QuerySplitter()
+        self.searches_ahead = searches_ahead
+
+    def use_listing_gatekeeper(self, listing_gatekeeper: ListingImportGatekeeper):
+        """
+        Item ids returned by a search that the gatekeeper has seen recently are skipped instead of fetched. Replay
+        mode serves every cached item regardless.
+        """
+        self.fetcher.listing_gatekeeper = listing_gatekeeper
+
+    async def _post_query(self, query: Query, search_queue: asyncio.Queue):
+        post_response = await self.fetcher.post_for_search_id(query_construction.create_trade_query(query=query))
+        if post_response is None:
+            return
+
+        await search_queue.put((query, post_response))
+
+        if post_response['total'] < self.split_threshold:
+            return
 
-                yield responses, response_results_count
+        for split_query in self._query_splitter.split_query(query=query, n_items=post_response['total']):
+            await self._post_query(split_query, search_queue)
+
+    async def _post_searches(self, queries: list[Query], search_queue: asyncio.Queue):
+        try:
+            for i, query in enumerate(queries):
+                api_log.info(f"Posting query {i + 1} of {len(queries)} queries.")
+                await self._post_query(query, search_queue)
+        finally:
+            # Lets the consumer finish even if posting failed. The exception is re-raised when the task is awaited
+            await search_queue.put(None)
+
+    async def fetch_responses(self, queries: list[Query]) -> AsyncGenerator[list[dict], None]:
+        search_queue = asyncio.Queue(maxsize=self.searches_ahead)
+
+        # Loaded before any search is posted, so that splitting never reads the archive on the event loop
+        await asyncio.to_thread(self._query_splitter.price_histograms.load)
+
+        async with self.fetcher:
+            poster = asyncio.create_task(self._post_searches(queries, search_queue))
+            try:
+                while (search := await search_queue.get()) is not None:
+                    query, post_response = search
+                    if not post_response['result']:
+                        continue
+
+                    responses = await self.fetcher.get_with_item_ids(post_response=post_response,
+                                                                     item_ids=post_response['result'])
+                    if not responses:
+                        continue
+
+                    self._query_splitter.observe_responses(query=query, responses=responses)
+                    yield responses
+            finally:
+                if not poster.done():
+                    poster.cancel()
+
+            await poster
@@ -1,36 +1,238 @@
-from datetime import datetime
+import bisect
+import hashlib
+import time
+from array import array
+from datetime import datetime, timezone
 
+from file_management.file_managers import ListingIdIndexFile
+from program_logging import LogsHandler, LogFile
 from psql import PostgreSqlManager
 from shared import shared_utils
 
+psql_log = LogsHandler().fetch_log(LogFile.PSQL)
+
+
+def _hash_listing_id(listing_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(listing_id.encode('utf-8'), digest_size=8).digest(),
+                          byteorder='little',
+                          signed=True)
+
+
+class _ListingIdIndex:
+    """
+    Maps 64-bit hashes of listing ids to the epoch second of their latest fetch. The keys are kept sorted in an
+    array('q') alongside an array('q') of epochs - 16 bytes per listing, much smaller than keeping the id strings and
+    datetimes around. New fetches are buffered in a dict and merged into the arrays in batches.
+    """
+
+    # Buffered fetches are merged into the arrays once there are this many
+    merge_every = 50_000
+
+    def __init__(self, covers_since: int | None = None):
+        """
+        :param covers_since: Epoch second from which on the index holds every fetch in the database. None if it holds
+            the full history
+        """
+        self._keys = array('q')
+        self._epochs = array('q')
+
+        # {key: fetch epoch} of fetches that aren't merged into the arrays yet
+        self._pending = dict()
+
+        self.covers_since = covers_since
+        # Latest database fetch date that has been loaded - the next refresh loads rows from a window before it
+        self.high_water_mark = None
+
+    def __len__(self):
+        self._merge()
+        return len(self._keys)
+
+    def _stored_epoch(self, key: int) -> int | None:
+        i = bisect.bisect_left(self._keys, key)
+        return self._epochs[i] if i < len(self._keys) and self._keys[i] == key else None
+
+    def _latest_key_fetch(self, key: int) -> int | None:
+        pending_epoch = self._pending.get(key)
+        return pending_epoch if pending_epoch is not None else self._stored_epoch(key)
+
+    def latest_fetch(self, listing_id: str) -> int | None:
+        return self._latest_key_fetch(_hash_listing_id(listing_id))
+
+    def record(self, listing_id: str, fetch_epoch: int):
+        key = _hash_listing_id(listing_id)
+        latest_epoch = self._latest_key_fetch(key)
+        if latest_epoch is not None and fetch_epoch <= latest_epoch:
+            return
+
+        self._pending[key] = fetch_epoch
+        if len(self._pending) >= self.merge_every:
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+
+        import numpy as np
+
+        keys = np.frombuffer(self._keys, dtype=np.int64).copy()
+        epochs = np.frombuffer(self._epochs, dtype=np.int64).copy()
+
+        new_keys = np.fromiter(self._pending.keys(), dtype=np.int64, count=len(self._pending))
+        new_epochs = np.fromiter(self._pending.values(), dtype=np.int64, count=len(self._pending))
+        order = np.argsort(new_keys)
+        new_keys, new_epochs = new_keys[order], new_epochs[order]
+
+        # Keys that are already stored are updated in place, the rest are inserted at their sorted position
+        positions = np.searchsorted(keys, new_keys)
+        is_stored = positions < len(keys)
+        is_stored[is_stored] = keys[positions[is_stored]] == new_keys[is_stored]
+
+        # Pending epochs are only ever newer than the stored ones
+        epochs[positions[is_stored]] = new_epochs[is_stored]
+
+        is_new = ~is_stored
+        keys = np.insert(keys, positions[is_new], new_keys[is_new])
+        epochs = np.insert(epochs, positions[is_new], new_epochs[is_new])
+
+        self._keys = array('q', keys.tobytes())
+        self._epochs = array('q', epochs.tobytes())
+        self._pending = dict()
+
+    def prune(self, older_than: int):
+        import numpy as np
+
+        self._merge()
+        keys = np.frombuffer(self._keys, dtype=np.int64)
+        epochs = np.frombuffer(self._epochs, dtype=np.int64)
+        keep = epochs >= older_than
+        self._keys, self._epochs = array('q', keys[keep].tobytes()), array('q', epochs[keep].tobytes())
+        del keys, epochs
+
+        self.covers_since = older_than if self.covers_since is None else max(self.covers_since, older_than)
+
+    def to_snapshot(self) -> dict:
+        self._merge()
+        return {
+            'keys': self._keys,
+            'epochs': self._epochs,
+            'covers_since': self.covers_since,
+            'high_water_mark': self.high_water_mark
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> '_ListingIdIndex':
+        index = cls(covers_since=snapshot['covers_since'])
+        index._keys = snapshot['keys']
+        index._epochs = snapshot['epochs']
+        index.high_water_mark = snapshot['high_water_mark']
+        return index
+
 
 class ListingImportGatekeeper:
 
-    def __init__(self, psql_manager: PostgreSqlManager):
+    # Listings fetched within this many minutes of their last fetch are not imported again
+    refetch_minutes = 180
+
+    def __init__(self,
+                 psql_manager: PostgreSqlManager,
+                 index_file: ListingIdIndexFile = None,
+                 window_only: bool = True,
+                 table_name: str = 'listings'):
+        """
+        :param index_file: Snapshot of the listing id index, used for fast warm starts
+        :param window_only: Only load listings fetched within the refetch window of now. Anything older can't block
+            a newly fetched listing. Set to False when importing old listings (ex: from the RawListingsFile)
+        :param table_name: Table holding the listing_id / date_fetched of every imported listing
+        """
+        self._psql_manager = psql_manager
+        self._table_name = table_name
+        self._index_file = index_file or ListingIdIndexFile()
+
+        load_since = int(time.time()) - self.refetch_minutes * 60 if window_only else None
+        self._index = _ListingIdIndex(covers_since=load_since)
+
         if psql_manager.skip_sql:
-            self.id_fetch_dates = dict()
             return
 
-        dates_and_ids = psql_manager.fetch_columns_data(table_name='listings',
-                                                        columns=['date_fetched', 'listing_id'])
-        dates = [shared_utils.format_date_into_utc(date_str) for date_str in dates_and_ids['date_fetched']]
-        ids = dates_and_ids['listing_id']
+        snapshot = self._index_file.load(default=None)
+        if snapshot and (snapshot['covers_since'] is None
+                         or (load_since is not None and snapshot['covers_since'] <= load_since)):
+            self._index = _ListingIdIndex.from_snapshot(snapshot)
+            psql_log.info(f"Loaded listing id index snapshot with {len(self._index)} ids.")
+
+        if load_since is not None:
+            self._index.prune(older_than=load_since)
+
+        self.refresh()
+        self.save_snapshot()
+
+    def refresh(self):
+        """
+        Loads the listings inserted since the last refresh.
+
+        Rows are found by date_fetched, which is when the listing was indexed and not when the row was inserted. Rows
+        inserted after the last refresh can have an older date (old listings fetched now, other workers, backfills),
+        so the refresh reads back a refetch window from the high water mark. An older fetch than that can't block a
+        listing fetched after the high water mark anyway.
+        """
+        if self._psql_manager.skip_sql:
+            return
+
+        if self._index.high_water_mark is not None:
+            lower_bound = self._index.high_water_mark - self.refetch_minutes * 60
+            if self._index.covers_since is not None:
+                lower_bound = max(lower_bound, self._index.covers_since)
+        else:
+            lower_bound = self._index.covers_since
+        min_values = {'date_fetched': datetime.fromtimestamp(lower_bound, tz=timezone.utc)} if lower_bound else None
+
+        dates_and_ids = self._psql_manager.fetch_columns_data(table_name=self._table_name,
+                                                              columns=['date_fetched', 'listing_id'],
+                                                              min_values=min_values)
+
+        for date, listing_id in zip(dates_and_ids['date_fetched'], dates_and_ids['listing_id']):
+            fetch_epoch = int(shared_utils.format_date_into_utc(date).timestamp())
+            self._index.record(listing_id, fetch_epoch)
+
+            if self._index.high_water_mark is None or fetch_epoch > self._index.high_water_mark:
+                self._index.high_water_mark = fetch_epoch
 
-        self.id_fetch_dates = dict()
-        for date, listing_id in zip(dates, ids):
-            if listing_id not in self.id_fetch_dates:
-                self.id_fetch_dates[listing_id] = date
-            else:
-                if date > self.id_fetch_dates[listing_id]:
-                    self.id_fetch_dates[listing_id] = date
+        psql_log.info(f"Loaded {len(dates_and_ids['listing_id'])} listing ids from Psql. "
+                      f"Listing id index holds {len(self._index)} ids.")
+
+    def save_snapshot(self):
+        self._index_file.save(data=self._index.to_snapshot())
 
     def listing_is_valid(self, listing_id: str, date_fetched: datetime) -> bool:
-        if listing_id not in self.id_fetch_dates:
-            self.id_fetch_dates[listing_id] = date_fetched
+        fetch_epoch = int(date_fetched.timestamp())
+        latest_fetch_epoch = self._index.latest_fetch(listing_id)
+
+        self._index.record(listing_id, fetch_epoch)
+
+        if latest_fetch_epoch is None:
             return True
 
-        latest_fetch_date = self.id_fetch_dates[listing_id]
-        minutes_since_last_fetch = (date_fetched - latest_fetch_date).total_seconds() / 60
+        minutes_since_last_fetch = (fetch_epoch - latest_fetch_epoch) / 60
+        return minutes_since_last_fetch > self.refetch_minutes
+
+    def record_fetch(self, listing_id: str, date_fetched: datetime):
+        """
+        Records a fetch that was already let through, without checking it again.
+        """
+        self._index.record(listing_id, int(date_fetched.timestamp()))
+
+    def filter_unseen_ids(self, listing_ids: list[str], now: datetime = None) -> list[str]:
+        """
+        Used before fetching listings - a listing whose last fetch date is within the refetch window of now can't
+        have a newer fetch date that is outside of it, so listing_is_valid would reject it anyway.
+
+        :return: The listing ids that are worth fetching
+        """
+        now_epoch = (now or datetime.now(timezone.utc)).timestamp()
+        unseen_ids = []
+        for listing_id in listing_ids:
+            latest_fetch_epoch = self._index.latest_fetch(listing_id)
+            if latest_fetch_epoch is None or (now_epoch - latest_fetch_epoch) / 60 > self.refetch_minutes:
+                unseen_ids.append(listing_id)
 
-        self.id_fetch_dates[listing_id] = date_fetched
-        return minutes_since_last_fetch > 180
+        return unseen_ids
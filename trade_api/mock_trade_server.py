@@ -0,0 +1,116 @@
+import itertools
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from file_management import json_codec
+
+
+class _MockTradeRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep their connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data: dict):
+        body = json_codec.dumpb(data)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in self.server.rate_limit_headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def do_POST(self):
+        content_length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(content_length)
+        time.sleep(self.server.latency)
+
+        item_ids = self.server.next_item_ids()
+        self._send_json({
+            'id': uuid.uuid4().hex[:10],
+            'result': item_ids,
+            'total': self.server.total_per_search
+        })
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+
+        item_ids = urlparse(self.path).path.rsplit('/', 1)[-1].split(',')
+        self._send_json({
+            'result': [self.server.items_by_id[item_id] for item_id in item_ids if item_id in self.server.items_by_id]
+        })
+
+
+class MockTradeServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the trade search / fetch endpoints, serving recorded responses so that fetching can be
+    benchmarked offline. Point a fetcher at post_url and get_url.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 items: list[dict],
+                 port: int = 0,
+                 results_per_search: int = 100,
+                 total_per_search: int = None,
+                 latency: float = 0.05,
+                 rate_limit_headers: dict = None):
+        """
+        :param items: Recorded fetch responses (ex: lines of RawListingsFile). Each needs an 'id'
+        :param port: 0 picks a free port
+        :param results_per_search: How many item ids each search returns (the real API caps this at 100)
+        :param total_per_search: The 'total' each search reports. Defaults to results_per_search
+        :param latency: Seconds each request takes to answer, to mimic the round trip to the real API
+        :param rate_limit_headers: Rate limit headers attached to every response
+        """
+        super().__init__(('127.0.0.1', port), _MockTradeRequestHandler)
+
+        self.items_by_id = {item['id']: item for item in items}
+        self.results_per_search = results_per_search
+        self.total_per_search = total_per_search or results_per_search
+        self.latency = latency
+        self.rate_limit_headers = rate_limit_headers or {
+            'X-Rate-Limit-Account': '1000:5:60',
+            'x-rate-limit-account-state': '0:5:0',
+            'X-Rate-Limit-Ip': '1000:10:60',
+            'x-rate-limit-ip-state': '0:10:0'
+        }
+
+        self._ids_cycle = itertools.cycle(list(self.items_by_id.keys()))
+        self._ids_lock = threading.Lock()
+        self._thread = None
+
+    def next_item_ids(self) -> list[str]:
+        with self._ids_lock:
+            n_ids = min(self.results_per_search, len(self.items_by_id))
+            return [next(self._ids_cycle) for _ in range(n_ids)]
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def post_url(self) -> str:
+        return f"{self.base_url}/api/trade2/search/poe2/mock"
+
+    @property
+    def get_url(self) -> str:
+        return f"{self.base_url}/api/trade2/fetch/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
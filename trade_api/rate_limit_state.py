@@ -0,0 +1,359 @@
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from program_logging import LogFile, LogsHandler
+
+api_log = LogsHandler().fetch_log(LogFile.EXTERNAL_APIS)
+
+
+@dataclass
+class RatePolicy:
+    name: str
+    maximum_requests: int
+    seconds_interval: int
+
+
+@dataclass
+class Reservation:
+    """
+    Result of trying to reserve a request slot. If wait_seconds is 0 then the request was registered and can be sent.
+    """
+    wait_seconds: float
+    limiting_policy: str | None = None
+    # {policy name: number of requests currently within the policy's window}
+    usage: dict = field(default_factory=dict)
+
+
+def _next_ready_time(timestamps: list, maximum_requests: int, seconds_interval: int, now: float) -> float:
+    """
+    :param timestamps: Sorted timestamps of the requests that are still within the window
+    """
+    if len(timestamps) < maximum_requests:
+        return now
+
+    # Enough of the oldest requests have to expire so that one slot opens up
+    blocking_request = timestamps[len(timestamps) - maximum_requests]
+    return blocking_request + seconds_interval
+
+
+class Deque:
+
+    def __init__(self, maximum_requests: int, seconds_interval: int, current_requests: int, policy_name: str = None):
+        """
+
+        :param maximum_requests:
+        :param seconds_interval:
+        :param current_requests: The number of requests that have been made within the seconds_interval -
+            often requests will have been made from this IP outside of this program instance. So we need to take that into account.
+        :param policy_name: Name used when reporting this window's metrics (ex: 'ip:10s')
+        """
+        self.maximum_requests = maximum_requests
+        self.seconds_interval = seconds_interval
+        self.policy_name = policy_name or f"{maximum_requests}:{seconds_interval}"
+
+        self.requests = deque()
+
+        now = time.time()
+        for _ in list(range(current_requests)):
+            self.register_request(now=now)
+
+    def remove_expired_timestamps(self, now):
+        while self.requests and (now - self.requests[0]) >= self.seconds_interval:
+            self.requests.popleft()
+
+    def register_request(self, now):
+        self.requests.append(now)
+
+    def is_ready(self, now):
+        self.remove_expired_timestamps(now=now)
+        num_requests_in_queue = len(self.requests)
+        return num_requests_in_queue < self.maximum_requests
+
+    def next_ready_time(self, now) -> float:
+        """
+        :return: The earliest timestamp at which this window will accept another request
+        """
+        self.remove_expired_timestamps(now=now)
+        return _next_ready_time(timestamps=self.requests,
+                                maximum_requests=self.maximum_requests,
+                                seconds_interval=self.seconds_interval,
+                                now=now)
+
+
+class RateLimitStateBackend(ABC):
+    """
+    Holds the request history of every rate limit policy. Backends other than the in-process one are shared between
+    processes, so that all workers draw from the same account / IP budget.
+    """
+
+    def __init__(self):
+        # {func.__name__: [RatePolicy]}
+        self._policies = dict()
+
+    def has_policies(self, func_name: str) -> bool:
+        return func_name in self._policies
+
+    def fetch_policies(self, func_name: str) -> list[RatePolicy]:
+        return self._policies[func_name]
+
+    def set_policies(self, func_name: str, policies: list[RatePolicy], current_requests: list[int], now: float):
+        self._policies[func_name] = policies
+        self.sync_state(func_name=func_name, current_requests=current_requests, now=now)
+
+    @abstractmethod
+    def try_acquire(self, func_name: str, now: float) -> Reservation:
+        """
+        Atomically checks every policy window and, if all of them have room, registers a request at 'now'.
+        """
+        pass
+
+    @abstractmethod
+    def sync_state(self, func_name: str, current_requests: list[int], now: float):
+        """
+        Brings the stored windows up to the request counts the API reports in its x-rate-limit-*-state headers.
+        Requests the API knows about but we don't (other hosts, crashed workers) are registered at 'now'.
+
+        :param current_requests: One request count per policy, in the same order as the policies
+        """
+        pass
+
+
+class InProcessStateBackend(RateLimitStateBackend):
+
+    def __init__(self):
+        super().__init__()
+
+        # {func.__name__: [Deque]}
+        self.request_deques = dict()
+        self._lock = threading.Lock()
+
+    def set_policies(self, func_name: str, policies: list[RatePolicy], current_requests: list[int], now: float):
+        with self._lock:
+            self._policies[func_name] = policies
+            self.request_deques[func_name] = [
+                Deque(
+                    maximum_requests=policy.maximum_requests,
+                    seconds_interval=policy.seconds_interval,
+                    current_requests=requests_count,
+                    policy_name=policy.name
+                )
+                for policy, requests_count in zip(policies, current_requests)
+            ]
+
+    def try_acquire(self, func_name: str, now: float) -> Reservation:
+        with self._lock:
+            send_time = now
+            limiting_policy = None
+            for request_deque in self.request_deques[func_name]:
+                ready_time = request_deque.next_ready_time(now)
+                if ready_time > send_time:
+                    send_time = ready_time
+                    limiting_policy = request_deque.policy_name
+
+            if limiting_policy is None:
+                for request_deque in self.request_deques[func_name]:
+                    request_deque.register_request(now=now)
+
+            usage = {request_deque.policy_name: len(request_deque.requests)
+                     for request_deque in self.request_deques[func_name]}
+
+        return Reservation(wait_seconds=send_time - now,
+                           limiting_policy=limiting_policy,
+                           usage=usage)
+
+    def sync_state(self, func_name: str, current_requests: list[int], now: float):
+        with self._lock:
+            for request_deque, requests_count in zip(self.request_deques[func_name], current_requests):
+                request_deque.remove_expired_timestamps(now=now)
+                for _ in range(requests_count - len(request_deque.requests)):
+                    request_deque.register_request(now=now)
+
+
+class _SqlStateBackend(RateLimitStateBackend, ABC):
+    """
+    Shared logic for backends that store one row per request in a 'rate_limit_requests' table.
+    Subclasses only provide the locked transaction and the parameter style.
+    """
+
+    @abstractmethod
+    def _locked_transaction(self):
+        """
+        Context manager yielding a function execute(sql, params) -> list of rows, run while holding an exclusive lock.
+        """
+        pass
+
+    def _fetch_window(self, execute, func_name: str, policy: RatePolicy, now: float) -> list[float]:
+        window_start = now - policy.seconds_interval
+        execute(self._delete_expired_sql, (func_name, policy.name, window_start))
+        rows = execute(self._select_window_sql, (func_name, policy.name))
+        return [row[0] for row in rows]
+
+    def _insert(self, execute, func_name: str, policy: RatePolicy, now: float, count: int = 1):
+        for _ in range(count):
+            execute(self._insert_sql, (func_name, policy.name, now))
+
+    def try_acquire(self, func_name: str, now: float) -> Reservation:
+        policies = self._policies[func_name]
+        with self._locked_transaction() as execute:
+            windows = {policy.name: self._fetch_window(execute, func_name, policy, now) for policy in policies}
+
+            send_time = now
+            limiting_policy = None
+            for policy in policies:
+                ready_time = _next_ready_time(timestamps=windows[policy.name],
+                                              maximum_requests=policy.maximum_requests,
+                                              seconds_interval=policy.seconds_interval,
+                                              now=now)
+                if ready_time > send_time:
+                    send_time = ready_time
+                    limiting_policy = policy.name
+
+            usage = {policy_name: len(timestamps) for policy_name, timestamps in windows.items()}
+            if limiting_policy is None:
+                for policy in policies:
+                    self._insert(execute, func_name, policy, now)
+                    usage[policy.name] += 1
+
+        return Reservation(wait_seconds=send_time - now,
+                           limiting_policy=limiting_policy,
+                           usage=usage)
+
+    def sync_state(self, func_name: str, current_requests: list[int], now: float):
+        with self._locked_transaction() as execute:
+            for policy, requests_count in zip(self._policies[func_name], current_requests):
+                window = self._fetch_window(execute, func_name, policy, now)
+                self._insert(execute, func_name, policy, now, count=requests_count - len(window))
+
+
+class _SqliteTransaction:
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.Lock):
+        self._connection = connection
+        self._lock = lock
+
+    def _execute(self, sql: str, params: tuple):
+        return self._connection.execute(sql, params).fetchall()
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            # IMMEDIATE takes the database's write lock up front, which serializes every process using the same file
+            self._connection.execute('BEGIN IMMEDIATE')
+        except Exception:
+            # __exit__ doesn't run if __enter__ raises, ex: the database stayed locked past the busy timeout
+            self._lock.release()
+            raise
+
+        return self._execute
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._lock.release()
+
+
+class SqliteStateBackend(_SqlStateBackend):
+    _delete_expired_sql = 'DELETE FROM rate_limit_requests WHERE func_name = ? AND policy = ? AND ts <= ?'
+    _select_window_sql = 'SELECT ts FROM rate_limit_requests WHERE func_name = ? AND policy = ? ORDER BY ts'
+    _insert_sql = 'INSERT INTO rate_limit_requests (func_name, policy, ts) VALUES (?, ?, ?)'
+
+    def __init__(self, path: Path = None):
+        super().__init__()
+        self._path = path or Path.cwd() / 'file_management/dynamic_files/rate_limit_state.sqlite'
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(str(self._path),
+                                           timeout=60,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_requests (func_name TEXT, policy TEXT, ts REAL)'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS rate_limit_requests_idx ON rate_limit_requests (func_name, policy, ts)'
+        )
+        self._lock = threading.Lock()
+
+        api_log.info(f"Sharing rate limit state through SQLite file {self._path}")
+
+    def _locked_transaction(self):
+        return _SqliteTransaction(self._connection, self._lock)
+
+
+class _PostgresTransaction:
+
+    def __init__(self, engine, lock_key: int):
+        self._engine = engine
+        self._lock_key = lock_key
+        self._transaction_context = None
+
+    def __enter__(self):
+        from sqlalchemy import text
+
+        self._transaction_context = self._engine.begin()
+        conn = self._transaction_context.__enter__()
+
+        # Transaction-level advisory locks are released automatically on commit / rollback
+        conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': self._lock_key})
+
+        def execute(sql: str, params: tuple):
+            result = conn.execute(text(sql), {f"p{i}": p for i, p in enumerate(params)})
+            return result.fetchall() if result.returns_rows else []
+
+        return execute
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._transaction_context.__exit__(exc_type, exc_val, exc_tb)
+
+
+class PostgresAdvisoryLockBackend(_SqlStateBackend):
+    _delete_expired_sql = 'DELETE FROM rate_limit_requests WHERE func_name = :p0 AND policy = :p1 AND ts <= :p2'
+    _select_window_sql = 'SELECT ts FROM rate_limit_requests WHERE func_name = :p0 AND policy = :p1 ORDER BY ts'
+    _insert_sql = 'INSERT INTO rate_limit_requests (func_name, policy, ts) VALUES (:p0, :p1, :p2)'
+
+    def __init__(self, engine, lock_name: str = 'poe_trade_rate_limits'):
+        """
+        :param engine: SqlAlchemy engine, usually PostgreSqlManager().engine
+        :param lock_name: Every process using the same lock name shares one rate limit budget
+        """
+        from sqlalchemy import text
+
+        super().__init__()
+        self._engine = engine
+        self._lock_key = zlib.crc32(lock_name.encode('utf-8'))
+
+        with self._engine.begin() as conn:
+            conn.execute(text('CREATE TABLE IF NOT EXISTS rate_limit_requests '
+                              '(func_name TEXT, policy TEXT, ts DOUBLE PRECISION)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS rate_limit_requests_idx '
+                              'ON rate_limit_requests (func_name, policy, ts)'))
+
+        api_log.info(f"Sharing rate limit state through Postgres advisory lock '{lock_name}' ({self._lock_key})")
+
+    def _locked_transaction(self):
+        return _PostgresTransaction(self._engine, self._lock_key)
+
+
+def create_state_backend(backend_name: str = None) -> RateLimitStateBackend:
+    """
+    :param backend_name: 'memory' (default), 'sqlite' or 'postgres'
+    """
+    backend_name = (backend_name or 'memory').lower()
+
+    if backend_name == 'memory':
+        return InProcessStateBackend()
+    elif backend_name == 'sqlite':
+        return SqliteStateBackend()
+    elif backend_name == 'postgres':
+        from psql import PostgreSqlManager
+
+        return PostgresAdvisoryLockBackend(engine=PostgreSqlManager().engine)
+
+    raise ValueError(f"Unknown rate limit state backend '{backend_name}'. Expected 'memory', 'sqlite' or 'postgres'.")
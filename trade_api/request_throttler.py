@@ -1,7 +1,8 @@
+import threading
 import time
-from collections import deque
 
 from program_logging import LogFile, LogsHandler, log_errors
+from .rate_limit_state import RateLimitStateBackend, InProcessStateBackend, RatePolicy
 
 api_log = LogsHandler().fetch_log(LogFile.EXTERNAL_APIS)
 
@@ -25,51 +26,62 @@ def _parse_rate_string(rate_limit_str):
     return limits
 
 
-class Deque:
+class PolicyMetrics:
 
-    def __init__(self, maximum_requests: int, seconds_interval: int, current_requests: int):
-        """
-
-        :param maximum_requests:
-        :param seconds_interval:
-        :param current_requests: The number of requests that have been made within the seconds_interval -
-            often requests will have been made from this IP outside of this program instance. So we need to take that into account.
-        """
-        self.maximum_requests = maximum_requests
-        self.seconds_interval = seconds_interval
+    def __init__(self, policy_name: str):
+        self.policy_name = policy_name
 
-        self.requests = deque()
+        self.requests_sent = 0
+        self.times_limiting = 0
+        self.total_wait_seconds = 0.0
+        self.last_wait_seconds = 0.0
 
-        now = time.time()
-        for _ in list(range(current_requests)):
-            self.register_request(now=now)
+        self.headroom = None
+        self.budget_used = None
 
-    def remove_expired_timestamps(self, now):
-        while self.requests and (now - self.requests[0]) > self.seconds_interval:
-            self.requests.popleft()
+    def record_wait(self, wait_seconds: float):
+        self.times_limiting += 1
+        self.total_wait_seconds += wait_seconds
+        self.last_wait_seconds = wait_seconds
 
-    def register_request(self, now):
-        self.requests.append(now)
+    def record_request(self, headroom: int, budget_used: float):
+        self.requests_sent += 1
+        self.headroom = headroom
+        self.budget_used = budget_used
 
-    def is_ready(self, now):
-        self.remove_expired_timestamps(now=now)
-        num_requests_in_queue = len(self.requests)
-        return num_requests_in_queue < self.maximum_requests
+    def __repr__(self):
+        return (f"{self.policy_name}: sent={self.requests_sent}, limiting={self.times_limiting}, "
+                f"waited={self.total_wait_seconds:.2f}s, headroom={self.headroom}, "
+                f"budget_used={self.budget_used if self.budget_used is None else round(self.budget_used, 3)}")
 
 
 class RequestThrottler:
 
-    def __init__(self):
+    def __init__(self,
+                 state_backend: RateLimitStateBackend = None,
+                 safety_margin: int = 1,
+                 metrics_log_interval: int = 50):
         """
-        {
-            func.__name__: [deques]
-        }
+        :param state_backend: Where the request history of each rate limit policy is kept. Defaults to in-process
+            memory. Use a shared backend when running several workers against the same account / IP
+        :param safety_margin: How many requests below each window's maximum we stay, to account for clock drift
+            between us and the API
+        :param metrics_log_interval: Policy metrics are logged every this many requests
         """
-        self.request_deques = dict()
+        self.state_backend = state_backend or InProcessStateBackend()
 
         self.current_account_limits = dict()
         self.current_ip_limits = dict()
 
+        # {func.__name__: {policy name: PolicyMetrics}}
+        self.policy_metrics = dict()
+
+        self.safety_margin = safety_margin
+        self.metrics_log_interval = metrics_log_interval
+
+        # Waiting threads are woken early whenever the limits are reset
+        self._condition = threading.Condition()
+
         self.request_counter = 0
 
     @staticmethod
@@ -119,22 +131,41 @@ class RequestThrottler:
                      f"\n\tIP limits: {ip_limits}"
                      f"\n\tIP state: {ip_state}")
 
-        self.current_account_limits[func_name] = account_limits
-        self.current_ip_limits[func_name] = ip_limits
-
-        self.request_deques[func_name] = []
-
-        for limit, state in list(zip([*account_limits, *ip_limits], [*account_state, *ip_state])):
-            max_requests = limit[0]
-            seconds_interval = limit[1]
-            current_requests = state[0]
-            self.request_deques[func_name].append(
-                Deque(
-                    maximum_requests=max_requests - 1, # We lower the max requests by 1 to stay conservative
-                    seconds_interval=seconds_interval,
-                    current_requests=current_requests
-                )
-            )
+        policies = [
+            *[RatePolicy(name=f"account:{limit[1]}s",
+                         maximum_requests=max(limit[0] - self.safety_margin, 1),
+                         seconds_interval=limit[1])
+              for limit in account_limits],
+            *[RatePolicy(name=f"ip:{limit[1]}s",
+                         maximum_requests=max(limit[0] - self.safety_margin, 1),
+                         seconds_interval=limit[1])
+              for limit in ip_limits]
+        ]
+        current_requests = [state[0] for state in [*account_state, *ip_state]]
+
+        with self._condition:
+            self.current_account_limits[func_name] = account_limits
+            self.current_ip_limits[func_name] = ip_limits
+
+            self.state_backend.set_policies(func_name=func_name,
+                                            policies=policies,
+                                            current_requests=current_requests,
+                                            now=time.time())
+
+            func_metrics = self.policy_metrics.setdefault(func_name, dict())
+            for policy in policies:
+                if policy.name not in func_metrics:
+                    func_metrics[policy.name] = PolicyMetrics(policy.name)
+
+            self._condition.notify_all()
+
+    def _sync_state(self, func_name: str, response_headers: dict):
+        _, account_state, _, ip_state = self._fetch_limits_and_state(response_headers)
+        current_requests = [state[0] for state in [*account_state, *ip_state]]
+
+        self.state_backend.sync_state(func_name=func_name,
+                                      current_requests=current_requests,
+                                      now=time.time())
 
     def _check_if_limits_have_changed(self, func_name: str, response_headers: dict):
         account_limits, account_state, ip_limits, ip_state = self._fetch_limits_and_state(response_headers)
@@ -152,64 +183,87 @@ class RequestThrottler:
 
         return limits_changed
 
-    def _wait_if_needed(self, func_name: str):
-        now = time.time()
-
-        can_request = all(
-            [
-                request_deque.is_ready(now)
-                for request_deque in self.request_deques[func_name]
-            ]
-        )
-
-        if not can_request:
-            # api_log.info(f"Waiting to send {func_name} request...")
-            x=0
-
-        while not can_request:
-            sleep_time = 0.25
-            time.sleep(sleep_time)
-            now = time.time()
-
-            can_request = all(
-                [
-                    request_deque.is_ready(now)
-                    for request_deque in self.request_deques[func_name]
-                ]
+    def _record_usage(self, func_name: str, usage: dict):
+        for policy in self.state_backend.fetch_policies(func_name):
+            requests_in_window = usage.get(policy.name, 0)
+            self.policy_metrics[func_name][policy.name].record_request(
+                headroom=max(policy.maximum_requests - requests_in_window, 0),
+                budget_used=min(requests_in_window / policy.maximum_requests, 1.0)
             )
 
-    def _register_requests(self, func_name: str, now):
-        for request_deque in self.request_deques[func_name]:
-            request_deque.register_request(now=now)
+        self.request_counter += 1
+        if self.metrics_log_interval and self.request_counter % self.metrics_log_interval == 0:
+            api_log.info(f"Rate limit metrics after {self.request_counter} requests:\n\t"
+                         + "\n\t".join(repr(m) for metrics in self.policy_metrics.values() for m in metrics.values()))
+
+    def _wait_if_needed(self, func_name: str):
+        """
+        Waits until every account and IP window has room, then reserves a slot in all of them.
+        """
+        with self._condition:
+            while True:
+                reservation = self.state_backend.try_acquire(func_name=func_name, now=time.time())
+
+                if reservation.wait_seconds <= 0:
+                    self._record_usage(func_name=func_name, usage=reservation.usage)
+                    return
+
+                self.policy_metrics[func_name][reservation.limiting_policy].record_wait(reservation.wait_seconds)
+
+                # Sleeps exactly until the limiting window frees up, unless set_limits wakes us earlier
+                self._condition.wait(timeout=reservation.wait_seconds)
+
+    def fetch_metrics(self, func_name: str = None) -> dict:
+        """
+        :return: {policy name: PolicyMetrics} for the given request function, or for every request function
+        """
+        if func_name:
+            return dict(self.policy_metrics.get(func_name, dict()))
+
+        return {
+            f"{fn}/{policy_name}": metrics
+            for fn, func_metrics in self.policy_metrics.items()
+            for policy_name, metrics in func_metrics.items()
+        }
+
+    def has_limits(self, func_name: str) -> bool:
+        return self.state_backend.has_policies(func_name)
+
+    def wait_for_slot(self, func_name: str):
+        """
+        Blocks until a request for func_name can be sent, and reserves it. Only valid once the limits are known.
+        """
+        self._wait_if_needed(func_name=func_name)
+
+    def update_limits(self, func_name: str, response_headers: dict):
+        """
+        Feeds a response's rate limit headers back into the throttler.
+        """
+        if not self.has_limits(func_name):
+            # The state headers already count this request
+            self.set_limits(response_headers=response_headers,
+                            func_name=func_name)
+        elif self._check_if_limits_have_changed(func_name=func_name,
+                                                response_headers=response_headers):
+            self.set_limits(func_name=func_name,
+                            response_headers=response_headers)
+        else:
+            self._sync_state(func_name=func_name,
+                             response_headers=response_headers)
 
     @log_errors(api_log)
     def send_request(self, request_func, *args, **kwargs):
         func_name = request_func.__name__
-        if func_name not in self.request_deques:
+        if not self.has_limits(func_name):
             response = request_func(*args, **kwargs)
             response.raise_for_status()
 
-            self.set_limits(response_headers=response.headers,
-                            func_name=func_name)
-
-            now = time.time()
-            self._register_requests(now=now,
-                                    func_name=func_name)
+            self.update_limits(func_name=func_name, response_headers=response.headers)
             return response
 
-        self._wait_if_needed(func_name=func_name)
+        self.wait_for_slot(func_name=func_name)
 
-        now = time.time()
         response = request_func(*args, **kwargs)
+        self.update_limits(func_name=func_name, response_headers=response.headers)
 
-        # ip_state = _parse_rate_string(response.headers['x-rate-limit-ip-state'])
-        # account_state = _parse_rate_string(response.headers['x-rate-limit-account-state'])
-
-        if self._check_if_limits_have_changed(func_name=func_name,
-                                              response_headers=response.headers):
-            self.set_limits(func_name=func_name,
-                            response_headers=response.headers)
-
-        self._register_requests(now=now,
-                                func_name=func_name)
         return response
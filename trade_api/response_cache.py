@@ -0,0 +1,95 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from file_management import json_codec
+from program_logging import LogFile, LogsHandler
+
+api_log = LogsHandler().fetch_log(LogFile.EXTERNAL_APIS)
+
+
+class TradeResponseCache:
+    """
+    On-disk cache of trade API responses. Search results are keyed by a hash of the canonicalized query JSON and
+    fetch results are keyed by item id. Entries older than their TTL are ignored unless ignore_ttl is set, which is
+    what replay mode uses.
+    """
+
+    def __init__(self,
+                 path: Path = None,
+                 search_ttl_minutes: float = 10,
+                 items_ttl_minutes: float = 180):
+        self._path = path or Path.cwd() / 'file_management/dynamic_files/trade_response_cache.sqlite'
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.search_ttl_seconds = search_ttl_minutes * 60
+        self.items_ttl_seconds = items_ttl_minutes * 60
+
+        self._connection = sqlite3.connect(str(self._path), timeout=60, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS searches (query_key TEXT PRIMARY KEY, cached_at REAL, body TEXT)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS items (item_id TEXT PRIMARY KEY, cached_at REAL, body TEXT)'
+            )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def query_key(query: dict) -> str:
+        # Stays on the json module - the keys of already cached searches depend on its exact output
+        canonical_query = json.dumps(query, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical_query.encode('utf-8')).hexdigest()
+
+    def load_search(self, query: dict, ignore_ttl: bool = False) -> dict | None:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT cached_at, body FROM searches WHERE query_key = ?', (self.query_key(query),)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        cached_at, body = row
+        if not ignore_ttl and time.time() - cached_at > self.search_ttl_seconds:
+            return None
+
+        return json_codec.loads(body)
+
+    def save_search(self, query: dict, post_response: dict):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO searches (query_key, cached_at, body) VALUES (?, ?, ?)',
+                (self.query_key(query), time.time(), json_codec.dumps(post_response))
+            )
+
+    def load_items(self, item_ids: list[str], ignore_ttl: bool = False) -> dict[str, dict]:
+        """
+        :return: {item id: fetch result} for every requested id that is cached
+        """
+        if not item_ids:
+            return dict()
+
+        placeholders = ', '.join('?' for _ in item_ids)
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT item_id, cached_at, body FROM items WHERE item_id IN ({placeholders})', item_ids
+            ).fetchall()
+
+        now = time.time()
+        return {
+            item_id: json_codec.loads(body)
+            for item_id, cached_at, body in rows
+            if ignore_ttl or now - cached_at <= self.items_ttl_seconds
+        }
+
+    def save_items(self, items: list[dict]):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO items (item_id, cached_at, body) VALUES (?, ?, ?)',
+                [(item['id'], now, json_codec.dumps(item)) for item in items]
+            )
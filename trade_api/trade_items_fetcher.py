@@ -1,11 +1,15 @@
 
+import threading
 from datetime import datetime
 
 import requests
 
 from core import env_loader
+from file_management import json_codec
 from program_logging import LogsHandler, LogFile, log_errors
+from trade_api.rate_limit_state import create_state_backend
 from trade_api.request_throttler import RequestThrottler
+from trade_api.response_cache import TradeResponseCache
 
 api_log = LogsHandler().fetch_log(LogFile.EXTERNAL_APIS)
 
@@ -36,22 +40,52 @@ class TradeItemsFetcher:
         'Referer': 'https://www.pathofexile.com/trade2/search/poe2/Dawn%20of%20the%20Hunt'
     }
 
-    request_throttler = RequestThrottler()
+    # Created on first use by fetch_request_throttler, so importing trade_api doesn't connect to the state backend.
+    # Set RATE_LIMIT_BACKEND to 'sqlite' or 'postgres' when running several fetching workers at once
+    request_throttler: RequestThrottler = None
+    _request_throttler_lock = threading.Lock()
+
+    # Reusing one session keeps the TCP / TLS connection alive between requests
+    session = requests.Session()
 
     items_fetched = 0
     class_start = datetime.now()
 
+    def __init__(self, response_cache: TradeResponseCache = None, replay: bool = False):
+        """
+        :param response_cache: If provided, search and fetch results are served from / saved to this cache
+        :param replay: Serve everything from the response cache regardless of age, and never send a request.
+            Searches or items that aren't cached are skipped
+        """
+        if replay and not response_cache:
+            raise ValueError("Replay mode requires a response cache.")
+
+        self.response_cache = response_cache
+        self.replay = replay
+
+        # Set through TradeApiHandler.use_listing_gatekeeper so that recently fetched listings are never downloaded
+        self.listing_gatekeeper = None
+
+    @classmethod
+    def fetch_request_throttler(cls) -> RequestThrottler:
+        with cls._request_throttler_lock:
+            if cls.request_throttler is None:
+                state_backend = create_state_backend(env_loader.get_env("RATE_LIMIT_BACKEND"))
+                cls.request_throttler = RequestThrottler(state_backend=state_backend)
+
+        return cls.request_throttler
+
     @classmethod
     @log_errors(api_log)
     def _post_for_search_id(cls, query):
-        response = cls.request_throttler.send_request(
-            request_func=requests.post,
+        response = cls.fetch_request_throttler().send_request(
+            request_func=cls.session.post,
             url=cls.post_url,
             headers=cls.headers,
             json=query
         )
         response.raise_for_status()
-        json_data = response.json()
+        json_data = json_codec.decode_search_response(response.content)
 
         return json_data
 
@@ -74,27 +108,72 @@ class TradeItemsFetcher:
             cookies = {
                 'POSSESSID': env_loader.get_env("POSSESSID")
             }
-            response = cls.request_throttler.send_request(
-                request_func=requests.get,
+            response = cls.fetch_request_throttler().send_request(
+                request_func=cls.session.get,
                 url=get_url,
                 headers=cls.headers,
                 params=params,
                 cookies=cookies
             )
             response.raise_for_status()
-            json_data = response.json()
-            result = json_data['result']
-            response_items.extend(result)
+            json_data = json_codec.decode_fetch_response(response.content)
+            response_items.extend(item for item in json_data['result'] if item)
 
         return response_items
 
-    @classmethod
-    def fetch_items_response(cls, query) -> tuple[list, int]:
-        post_response = cls._post_for_search_id(query=query)
+    def _search(self, query) -> dict | None:
+        if self.response_cache:
+            post_response = self.response_cache.load_search(query, ignore_ttl=self.replay)
+            if post_response:
+                return post_response
+
+        if self.replay:
+            api_log.info(f"Replay: no cached search for query key {TradeResponseCache.query_key(query)}. Skipping.")
+            return None
+
+        post_response = self._post_for_search_id(query=query)
+
+        if self.response_cache:
+            self.response_cache.save_search(query, post_response)
+
+        return post_response
+
+    def _fetch_items(self, post_response: dict, item_ids: list[str]) -> list:
+        # A replayed session's ids were imported when it was recorded, so the gatekeeper would skip all of them
+        if self.listing_gatekeeper and not self.replay:
+            unseen_ids = self.listing_gatekeeper.filter_unseen_ids(item_ids)
+            api_log.info(f"Skipping {len(item_ids) - len(unseen_ids)} of {len(item_ids)} recently fetched item ids.")
+            item_ids = unseen_ids
+
+        if not item_ids:
+            return []
+
+        if not self.response_cache:
+            return self._get_with_item_ids(post_response=post_response,
+                                           item_ids=item_ids)
+
+        items_by_id = self.response_cache.load_items(item_ids, ignore_ttl=self.replay)
+        missing_ids = [item_id for item_id in item_ids if item_id not in items_by_id]
+
+        if missing_ids and not self.replay:
+            fetched_items = self._get_with_item_ids(post_response=post_response,
+                                                    item_ids=missing_ids)
+            self.response_cache.save_items(fetched_items)
+            items_by_id.update({item['id']: item for item in fetched_items})
+
+        api_log.info(f"{len(item_ids) - len(missing_ids)} of {len(item_ids)} items served from the response cache.")
+
+        return [items_by_id[item_id] for item_id in item_ids if item_id in items_by_id]
+
+    def fetch_items_response(self, query) -> tuple[list, int]:
+        post_response = self._search(query=query)
+
+        if not post_response:
+            return [], 0
 
         total_responses = post_response['total']
         item_ids = post_response['result']
 
-        get_response = cls._get_with_item_ids(post_response=post_response,
-                                              item_ids=item_ids)
+        get_response = self._fetch_items(post_response=post_response,
+                                         item_ids=item_ids)
         return get_response, total_responses